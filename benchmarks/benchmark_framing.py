@@ -0,0 +1,76 @@
+"""Time to frame a page of get_all results with pyld and with the Framer of
+QueryManager.frame_results
+
+Usage:
+    python benchmarks/benchmark_framing.py [--repeat N] [--items N]
+"""
+import argparse
+import copy
+import json
+import logging
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from pyld import jsonld  # noqa: E402
+
+from obasparql import QueryManager  # noqa: E402
+from obasparql.static import EMBED_OPTION  # noqa: E402
+
+TESTS_DIR = Path(__file__).parent.parent / "tests"
+MODEL_URI = "https://w3id.org/okn/o/sdm#Model"
+CYCLES = "https://w3id.org/okn/i/mint/CYCLES"
+
+
+def build_query_manager() -> QueryManager:
+    return QueryManager(queries_dir=TESTS_DIR / "model_catalog/queries",
+                        context_dir=TESTS_DIR / "model_catalog/contexts",
+                        endpoint="http://localhost:3030/ds",
+                        named_graph_base="http://localhost:3030/ds/data/",
+                        uri_prefix="https://w3id.org/okn/i/mint/")
+
+
+def model_page(items: int) -> str:
+    """Response of the endpoint with items copies of the model CYCLES of tests/inputs/input.json"""
+    with open(TESTS_DIR / "inputs/input.json") as reader:
+        response = json.load(reader)
+    cycles = next(node for node in response["@graph"] if node["@id"] == CYCLES)
+    graph = [node for node in response["@graph"] if node["@id"] != CYCLES]
+    for i in range(items):
+        model = copy.deepcopy(cycles)
+        model["@id"] = f"{CYCLES}_{i}"
+        model["label"] = f"Cycles {i}"
+        graph.append(model)
+    response["@graph"] = graph
+    return json.dumps(response)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--items", type=int, default=100)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    query_manager = build_query_manager()
+    response = model_page(args.items)
+
+    def with_pyld():
+        response_dict = json.loads(response)
+        response_context, frame = query_manager.build_frame(response_dict["@context"], MODEL_URI)
+        jsonld.frame({"@graph": response_dict["@graph"], "@context": response_context}, frame,
+                     {"embed": EMBED_OPTION})
+
+    def with_framer():
+        query_manager.frame_results(response, MODEL_URI)
+
+    pyld_ms = timeit.timeit(with_pyld, number=args.repeat) / args.repeat * 1000
+    framer_ms = timeit.timeit(with_framer, number=args.repeat) / args.repeat * 1000
+    print(f"{'items':<12}{'pyld (ms)':>14}{'framer (ms)':>14}")
+    print(f"{args.items:<12}{pyld_ms:>14.3f}{framer_ms:>14.3f}")
+
+
+if __name__ == '__main__':
+    main()
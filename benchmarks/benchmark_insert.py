@@ -0,0 +1,84 @@
+"""Time to convert the body of a POST request to the triples of the INSERT DATA query, with rdflib
+(JSON-LD parser and Turtle serializer) and the whole context, with rdflib and the trimmed context
+(the conversion of the resources not supported by the NTriplesSerializer) and with the
+NTriplesSerializer
+
+Usage:
+    python benchmarks/benchmark_insert.py [--repeat N] [--parameters N]
+"""
+import argparse
+import json
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from obasparql import QueryManager  # noqa: E402
+
+TESTS_DIR = Path(__file__).parent.parent / "tests"
+PREFIX = "https://w3id.org/okn/i/mint/"
+SD = "https://w3id.org/okn/o/sd#"
+SDM = "https://w3id.org/okn/o/sdm#"
+
+
+def build_query_manager() -> QueryManager:
+    return QueryManager(queries_dir=TESTS_DIR / "model_catalog/queries",
+                        context_dir=TESTS_DIR / "model_catalog/contexts",
+                        endpoint="http://localhost:3030/ds",
+                        named_graph_base="http://localhost:3030/ds/data/",
+                        uri_prefix=PREFIX)
+
+
+def model_configuration(parameters: int) -> list:
+    """The nodes of a ModelConfiguration with its parameters, as flattened by QueryManager"""
+    nodes = [{
+        "id": f"{PREFIX}parameter_{i}",
+        "type": [f"{SD}Parameter"],
+        "label": [f"Parameter {i}"],
+        "description": [f"Description of the parameter {i}"],
+        "hasDefaultValue": [i * 0.5],
+        "position": [i],
+        "hasDataType": ["float"]
+    } for i in range(parameters)]
+    nodes.append({
+        "id": f"{PREFIX}configuration",
+        "type": [f"{SDM}ModelConfiguration"],
+        "label": ["Configuration"],
+        "description": ["A configuration with \"quotes\" and\nnew lines"],
+        "hasParameter": [{"id": node["id"]} for node in nodes],
+        "hasOutput": [{"id": None, "label": ["Output without id"]}],
+    })
+    return nodes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--parameters", type=int, default=40)
+    args = parser.parse_args()
+
+    query_manager = build_query_manager()
+    nodes = model_configuration(args.parameters)
+
+    def before():
+        resource = {'@context': query_manager.context, '@graph': nodes}
+        query_manager.build_query_insert(json.dumps(resource))
+
+    def trimmed():
+        resource = {'@context': query_manager.trim_context(nodes), '@graph': nodes}
+        query_manager.build_query_insert(json.dumps(resource))
+
+    def after():
+        query_manager.serialize_resources(nodes)
+
+    before_ms = timeit.timeit(before, number=args.repeat) / args.repeat * 1000
+    trimmed_ms = timeit.timeit(trimmed, number=args.repeat) / args.repeat * 1000
+    after_ms = timeit.timeit(after, number=args.repeat) / args.repeat * 1000
+    print(f"{'resources':<12}{'rdflib (ms)':>14}{'rdflib trimmed (ms)':>22}"
+          f"{'serializer (ms)':>18}")
+    print(f"{len(nodes):<12}{before_ms:>14.3f}{trimmed_ms:>22.3f}{after_ms:>18.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Per-request latency of get_one and get_all with and without the compiled templates
+
+The SPARQL endpoint is replaced by a connector that returns a canned response, so the benchmark
+measures the work done by the QueryManager (query preparation and framing).
+
+Usage:
+    python benchmarks/benchmark_query_templates.py [--repeat N]
+"""
+import argparse
+import json
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from obasparql import QueryManager  # noqa: E402
+
+TESTS_DIR = Path(__file__).parent.parent / "tests"
+PREFIX = "https://w3id.org/okn/i/mint/"
+CLASS_URI = "https://w3id.org/okn/o/sdm#Region"
+
+
+def canned_response(items: int) -> bytes:
+    graph = []
+    for i in range(items):
+        graph.append({
+            "@id": f"{PREFIX}region_{i}",
+            "@type": CLASS_URI,
+            "label": f"Region {i}",
+            "description": f"Description of the region {i}",
+            "partOf": f"{PREFIX}region_{(i + 1) % items}"
+        })
+    return json.dumps({
+        "@graph": graph,
+        "@context": {
+            "label": {"@id": "http://www.w3.org/2000/01/rdf-schema#label"},
+            "description": {"@id": "https://w3id.org/okn/o/sd#description"},
+            "partOf": {"@id": "https://w3id.org/okn/o/sdm#partOf", "@type": "@id"}
+        }
+    }).encode()
+
+
+class CannedConnector:
+    def __init__(self, response: bytes):
+        self.response = response
+
+    def query(self, query, *args, **kwargs):
+        return self.response
+
+    query_stream = query
+
+
+def build_query_manager() -> QueryManager:
+    return QueryManager(queries_dir=TESTS_DIR / "model_catalog/queries",
+                        context_dir=TESTS_DIR / "model_catalog/contexts",
+                        endpoint="http://localhost:3030/ds",
+                        named_graph_base="http://localhost:3030/ds/data/",
+                        uri_prefix=PREFIX)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    query_manager = build_query_manager()
+    templates = dict(query_manager.query_templates)
+    cases = {
+        "get_one": (canned_response(2), dict(id=f"{PREFIX}region_0", username="mint@isi.edu")),
+        "get_all": (canned_response(20), dict(username="mint@isi.edu", page=1, per_page=20)),
+    }
+    print(f"{'request':<10}{'before (ms)':>14}{'after (ms)':>14}{'speedup':>10}")
+    for name, (response, kwargs) in cases.items():
+        query_manager.sparql = CannedConnector(response)
+
+        def request():
+            query_manager.get_resource(rdf_type_uri=CLASS_URI, rdf_type_name="Region", **kwargs)
+
+        # Before: the template is parsed by every request
+        query_manager.query_templates = {}
+        before = timeit.timeit(request, number=args.repeat) / args.repeat * 1000
+        # After: the template has been compiled at startup
+        query_manager.query_templates = templates
+        after = timeit.timeit(request, number=args.repeat) / args.repeat * 1000
+        print(f"{name:<10}{before:>14.3f}{after:>14.3f}{before / after:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
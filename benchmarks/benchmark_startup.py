@@ -0,0 +1,55 @@
+"""Startup time of the QueryManager without cache, with a cold cache and with a warm cache
+
+Usage:
+    python benchmarks/benchmark_startup.py [--repeat N]
+"""
+import argparse
+import logging
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from obasparql import QueryManager  # noqa: E402
+
+TESTS_DIR = Path(__file__).parent.parent / "tests"
+CONFIGURATIONS = ["model_catalog", "dbpedia"]
+
+
+def start(configuration: str, cache_dir: str = None) -> float:
+    begin = time.perf_counter()
+    QueryManager(queries_dir=TESTS_DIR / configuration / "queries",
+                 context_dir=TESTS_DIR / configuration / "contexts",
+                 endpoint="http://localhost:3030/ds",
+                 named_graph_base="http://localhost:3030/ds/data/",
+                 uri_prefix="http://localhost:3030/ds/i/",
+                 cache_dir=cache_dir)
+    return (time.perf_counter() - begin) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    print(f"{'configuration':<16}{'no cache (ms)':>16}{'cold (ms)':>12}{'warm (ms)':>12}")
+    for configuration in CONFIGURATIONS:
+        no_cache = min(start(configuration) for _ in range(args.repeat))
+        cold = []
+        for _ in range(args.repeat):
+            cache_dir = tempfile.mkdtemp()
+            cold.append(start(configuration, cache_dir))
+            shutil.rmtree(cache_dir)
+        cache_dir = tempfile.mkdtemp()
+        start(configuration, cache_dir)
+        warm = min(start(configuration, cache_dir) for _ in range(args.repeat))
+        shutil.rmtree(cache_dir)
+        print(f"{configuration:<16}{no_cache:>16.1f}{min(cold):>12.1f}{warm:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Peak memory and time to frame a large get_all response read as a whole and read by chunks
+
+Usage:
+    python benchmarks/benchmark_streaming.py [--items N] [--chunk-size BYTES]
+"""
+import argparse
+import copy
+import json
+import logging
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Iterator
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from obasparql.connection_pool import STREAM_CHUNK_SIZE  # noqa: E402
+
+from benchmark_framing import CYCLES, MODEL_URI, TESTS_DIR, build_query_manager  # noqa: E402
+
+
+def model_chunks(items: int, chunk_size: int) -> Iterator[bytes]:
+    """Chunks of the response of the endpoint with items copies of the model CYCLES of
+    tests/inputs/input.json, generated as they are consumed (as they would be received from the
+    endpoint)"""
+    with open(TESTS_DIR / "inputs/input.json") as reader:
+        response = json.load(reader)
+    cycles = next(node for node in response["@graph"] if node["@id"] == CYCLES)
+    graph = [node for node in response["@graph"] if node["@id"] != CYCLES]
+
+    def nodes():
+        yield from graph
+        for i in range(items):
+            model = copy.deepcopy(cycles)
+            model["@id"] = f"{CYCLES}_{i}"
+            model["label"] = f"Cycles {i}"
+            yield model
+
+    def text():
+        yield '{"@graph": ['
+        for i, node in enumerate(nodes()):
+            yield (", " if i else "") + json.dumps(node)
+        yield '], "@context": ' + json.dumps(response["@context"]) + "}"
+
+    buffer = b""
+    for part in text():
+        buffer += part.encode()
+        while len(buffer) >= chunk_size:
+            yield buffer[:chunk_size]
+            buffer = buffer[chunk_size:]
+    yield buffer
+
+
+def measure(function):
+    tracemalloc.start()
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 2 ** 20, elapsed * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--chunk-size", type=int, default=STREAM_CHUNK_SIZE)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    query_manager = build_query_manager()
+    size = sum(len(chunk) for chunk in model_chunks(args.items, args.chunk_size))
+    # Build the frame before measuring
+    query_manager.frame_results(b"".join(model_chunks(0, args.chunk_size)), MODEL_URI)
+
+    def buffered():
+        # Before: the body is read as a whole and parsed with json.loads
+        query_manager.frame_results(b"".join(model_chunks(args.items, args.chunk_size)), MODEL_URI)
+
+    def streamed():
+        query_manager.frame_results(model_chunks(args.items, args.chunk_size), MODEL_URI)
+
+    print(f"response: {size / 2 ** 20:.1f} MiB, {args.items} models")
+    print(f"{'':<12}{'peak (MiB)':>14}{'time (ms)':>14}")
+    for name, function in (("buffered", buffered), ("streamed", streamed)):
+        peak, elapsed = measure(function)
+        print(f"{name:<12}{peak:>14.1f}{elapsed:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 from .query_manager import QueryManager
+from .async_query_manager import AsyncQueryManager
 
 
 def init(**kwargs):
@@ -0,0 +1,92 @@
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+from pathlib import Path
+
+logger = logging.getLogger('fastapi')
+
+# Increase it when the structure of the cached artifacts changes
+CACHE_FORMAT_VERSION = "3"
+
+
+class ArtifactCache:
+    """Persistent cache of the artifacts built by the QueryManager when it starts
+    (the compiled query templates and the processed contexts).
+
+    The artifacts are keyed by the hash of their source files, so a change of a template or a
+    context produces a new key and the stale artifact is never used. The artifacts are stored with
+    pickle: the cache directory must only be writable by the owner of the API.
+    """
+
+    def __init__(self, cache_dir: str):
+        """Constructor of the ArtifactCache class
+
+        Args:
+            cache_dir (str): the directory where the artifacts are stored. It is created if it does
+                not exist
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(*sources: str) -> str:
+        """Compute the key of an artifact from the contents of its sources
+
+        Returns:
+            str: the hexadecimal digest of the sources
+        """
+        digest = hashlib.sha256(CACHE_FORMAT_VERSION.encode())
+        for source in sources:
+            source = b'' if source is None else source.encode('utf-8')
+            # The length avoids collisions between different splits of the same text
+            digest.update(str(len(source)).encode())
+            digest.update(b':')
+            digest.update(source)
+        return digest.hexdigest()
+
+    def path(self, kind: str, key: str) -> Path:
+        return self.cache_dir / f"{kind}-{key}.pickle"
+
+    def load(self, kind: str, key: str):
+        """Load an artifact
+
+        Args:
+            kind (str): the kind of artifact (templates, contexts)
+            key (str): the key returned by ArtifactCache.key
+
+        Returns:
+            The artifact or None if it is not in the cache or it can not be read
+        """
+        path = self.path(kind, key)
+        try:
+            with open(path, 'rb') as reader:
+                return pickle.load(reader)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.warning("Unable to read the cached artifact %s", path, exc_info=True)
+            return None
+
+    def store(self, kind: str, key: str, artifact):
+        """Store an artifact. The file is replaced atomically, so concurrent workers never read a
+        partial file
+
+        Args:
+            kind (str): the kind of artifact (templates, contexts)
+            key (str): the key returned by ArtifactCache.key
+            artifact: the artifact
+        """
+        path = self.path(kind, key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=f".{kind}-")
+        try:
+            with os.fdopen(fd, 'wb') as writer:
+                pickle.dump(artifact, writer, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except Exception:
+            logger.warning("Unable to write the cached artifact %s", path, exc_info=True)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
@@ -0,0 +1,467 @@
+import asyncio
+import logging
+from typing import AsyncIterator, Dict, Hashable, List, Tuple
+
+from starlette.exceptions import HTTPException
+
+from obasparql.caching import DEFAULT_FRAME_CACHE_SIZE, DEFAULT_RESPONSE_CACHE_SIZE, \
+    DEFAULT_RESPONSE_CACHE_TTL, DEFAULT_RESPONSE_CACHE_MAX_BYTES, \
+    DEFAULT_RESPONSE_CACHE_STALE_TTL, DEFAULT_COUNT_CACHE_SIZE, DEFAULT_COUNT_CACHE_TTL
+from obasparql.async_sparqlconnector import AsyncSPARQLConnector, AsyncStreamedResponse, \
+    DEFAULT_MAX_CONCURRENCY
+from obasparql.batching import AsyncBatchLoader, DEFAULT_BATCH_MAX_SIZE, DEFAULT_BATCH_WAIT
+from obasparql.coalescing import AsyncSingleFlight
+from obasparql.connection_pool import DEFAULT_POOL_MAXSIZE, DEFAULT_POOL_IDLE_TIMEOUT
+from obasparql.query_manager import QueryManager, FRAME_EXECUTOR
+from obasparql.replicas import DEFAULT_HEDGE_BUDGET
+from obasparql.resilience import DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT, \
+    DEFAULT_QUERY_RETRIES, DEFAULT_CIRCUIT_FAILURE_THRESHOLD, DEFAULT_CIRCUIT_RESET_TIMEOUT
+from obasparql.streaming import JSONLDStreamParser
+from obasparql.static import COUNT_KEY, DEFAULT_PER_PAGE, IDS_CHUNK_SIZE, INSERT_CHUNK_SIZE
+
+logger = logging.getLogger('fastapi')
+
+
+class AsyncQueryManager(QueryManager):
+    """QueryManager for asyncio applications: the get, put, post and delete methods are coroutines
+    and the SPARQL requests do not block the event loop.
+
+    The templates, the contexts, the framing and the construction of the queries are shared with
+    QueryManager. The responses are framed in a thread pool (see run_in_executor): the framing of a
+    large response does not delay the other coroutines.
+    """
+
+    def __init__(self,
+                 endpoint: str,
+                 named_graph_base: str,
+                 uri_prefix: str,
+                 queries_dir: str,
+                 context_dir: str,
+                 endpoint_username=None,
+                 endpoint_password=None,
+                 cache_dir: str = None,
+                 pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+                 pool_idle_timeout: float = DEFAULT_POOL_IDLE_TIMEOUT,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout: float = DEFAULT_READ_TIMEOUT,
+                 query_retries: int = DEFAULT_QUERY_RETRIES,
+                 circuit_failure_threshold: int = DEFAULT_CIRCUIT_FAILURE_THRESHOLD,
+                 circuit_reset_timeout: float = DEFAULT_CIRCUIT_RESET_TIMEOUT,
+                 query_endpoints: List[str] = None,
+                 update_endpoint: str = None,
+                 read_your_writes_ttl: float = 0,
+                 hedge_percentile: float = None,
+                 hedge_budget: float = DEFAULT_HEDGE_BUDGET,
+                 coalesce_queries: bool = False,
+                 batch_wait: float = DEFAULT_BATCH_WAIT,
+                 batch_max_size: int = DEFAULT_BATCH_MAX_SIZE,
+                 frame_cache_size: int = DEFAULT_FRAME_CACHE_SIZE,
+                 response_cache_size: int = DEFAULT_RESPONSE_CACHE_SIZE,
+                 response_cache_ttl: float = DEFAULT_RESPONSE_CACHE_TTL,
+                 response_cache_max_bytes: int = DEFAULT_RESPONSE_CACHE_MAX_BYTES,
+                 response_cache_stale_ttl: float = DEFAULT_RESPONSE_CACHE_STALE_TTL,
+                 count_cache_size: int = DEFAULT_COUNT_CACHE_SIZE,
+                 count_cache_ttl: float = DEFAULT_COUNT_CACHE_TTL,
+                 reject_unbounded_templates: bool = False):
+        """Constructor of the AsyncQueryManager class. See QueryManager
+
+        Args:
+            max_concurrency (int, optional): the maximum number of SPARQL requests in flight.
+                Defaults to 100.
+        """
+        self.max_concurrency = max_concurrency
+        super().__init__(endpoint=endpoint,
+                         named_graph_base=named_graph_base,
+                         uri_prefix=uri_prefix,
+                         queries_dir=queries_dir,
+                         context_dir=context_dir,
+                         endpoint_username=endpoint_username,
+                         endpoint_password=endpoint_password,
+                         cache_dir=cache_dir,
+                         pool_maxsize=pool_maxsize,
+                         pool_idle_timeout=pool_idle_timeout,
+                         connect_timeout=connect_timeout,
+                         read_timeout=read_timeout,
+                         query_retries=query_retries,
+                         circuit_failure_threshold=circuit_failure_threshold,
+                         circuit_reset_timeout=circuit_reset_timeout,
+                         query_endpoints=query_endpoints,
+                         update_endpoint=update_endpoint,
+                         read_your_writes_ttl=read_your_writes_ttl,
+                         hedge_percentile=hedge_percentile,
+                         hedge_budget=hedge_budget,
+                         coalesce_queries=coalesce_queries,
+                         batch_wait=batch_wait,
+                         batch_max_size=batch_max_size,
+                         frame_cache_size=frame_cache_size,
+                         response_cache_size=response_cache_size,
+                         response_cache_ttl=response_cache_ttl,
+                         response_cache_max_bytes=response_cache_max_bytes,
+                         response_cache_stale_ttl=response_cache_stale_ttl,
+                         count_cache_size=count_cache_size,
+                         count_cache_ttl=count_cache_ttl,
+                         reject_unbounded_templates=reject_unbounded_templates)
+        self.single_flight = AsyncSingleFlight(coalesce_queries)
+        self.batch_loader = AsyncBatchLoader(self.load_batch, batch_max_size, batch_wait)
+        # Keep a reference to the background refreshes of the stale responses until they are done
+        self.refresh_tasks = set()
+
+    def build_connector(self, **kwargs) -> AsyncSPARQLConnector:
+        """Return the asyncio connector to the endpoints. See QueryManager.build_connector"""
+        return AsyncSPARQLConnector(query_endpoint=self.query_endpoints,
+                                    update_endpoint=self.update_endpoint,
+                                    primary_query_endpoint=self.endpoint,
+                                    auth=(self.endpoint_username,
+                                          self.endpoint_password),
+                                    method="POST",
+                                    returnFormat='json-ld',
+                                    max_concurrency=self.max_concurrency,
+                                    **kwargs)
+
+    async def run_in_executor(self, function, *args):
+        """Run a CPU-bound function (e.g., the framing of a response) in the thread pool
+        FRAME_EXECUTOR, so it does not block the event loop"""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor(FRAME_EXECUTOR), function, *args)
+
+    async def get_resource(self, **kwargs):
+        """Handle the GET Requests. See QueryManager.get_resource"""
+        # The helper get methods return the coroutine of run_query_get
+        return await super().get_resource(**kwargs)
+
+    async def get_one_batched(self, owl_class_name: str, owl_class_uri: str, query_type: str,
+                              request_args: dict, username: str, _id: str):
+        """Return a resource from the response cache, or request it with the lookups of the same
+        class and graph. See QueryManager.get_one_batched"""
+        query_template = getattr(self, owl_class_name)[query_type]
+        cache_key = self.response_cache_key(query_template, owl_class_uri, request_args)
+        response, stale = self.get_cached_response(cache_key)
+        if response is not None and not stale:
+            return response
+        generation = self.response_cache.generation
+        resource = await self.batch_loader.load((owl_class_name, owl_class_uri, username), _id)
+        return self.process_batched_resource(cache_key, resource, generation)
+
+    async def load_batch(self, key: Tuple[str, str, str], ids: List[str]) -> Dict[str, dict]:
+        """Request a batch of lookups. See QueryManager.load_batch"""
+        owl_class_name, owl_class_uri, username = key
+        return await self.get_resources(ids, owl_class_uri, owl_class_name, username,
+                                        chunk_size=len(ids))
+
+    async def get_resources(self,
+                            ids: List[str],
+                            rdf_type_uri: str,
+                            rdf_type_name: str,
+                            username: str = None,
+                            chunk_size: int = IDS_CHUNK_SIZE) -> Dict[str, dict]:
+        """Handle a GET method to get many resources by id. The chunks are requested concurrently.
+        See QueryManager.get_resources"""
+
+        async def get_chunk(chunk, query_template, request_args):
+            try:
+                result = await self.dispatch_sparql_query(raw_sparql_query=query_template,
+                                                          request_args=request_args)
+            except Exception as err:
+                raise self.query_exception(err, "Unable to send query") from err
+            chunk_resources = await self.run_in_executor(self.process_resources_result, result,
+                                                         rdf_type_uri, chunk)
+            dependent = self.dependent_ids(chunk_resources) if len(chunk) > 1 else []
+            if dependent:
+                chunk_resources.update(await self.get_resources(dependent, rdf_type_uri,
+                                                                rdf_type_name, username,
+                                                                chunk_size=1))
+            return chunk_resources
+
+        resources = {}
+        queries = self.build_resources_queries(ids, rdf_type_name, username, chunk_size)
+        for chunk_resources in await asyncio.gather(*[get_chunk(*query) for query in queries]):
+            resources.update(chunk_resources)
+        return resources
+
+    async def iter_resources(self,
+                             rdf_type_uri: str,
+                             rdf_type_name: str,
+                             username: str = None,
+                             page_size: int = DEFAULT_PER_PAGE) -> AsyncIterator[dict]:
+        """Asynchronous generator of the resources of a class. The next page is requested in a task
+        while the current one is consumed. See QueryManager.iter_resources"""
+        query_template, kwargs = self.iter_resources_kwargs(rdf_type_uri, rdf_type_name, username,
+                                                            page_size)
+        position = self.first_iter_position(query_template)
+        task = asyncio.ensure_future(
+            self.get_resource(**self.iter_page_kwargs(kwargs, query_template, position)))
+        try:
+            while task is not None:
+                page = await task
+                next_position = self.next_iter_position(page, query_template, position)
+                task = None
+                if next_position is not None:
+                    page_kwargs = self.iter_page_kwargs(kwargs, query_template, next_position)
+                    task = asyncio.ensure_future(self.get_resource(**page_kwargs))
+                for resource in self.iter_page_resources(page, query_template, position):
+                    yield resource
+                position = next_position
+        finally:
+            if task is not None:
+                task.cancel()
+
+    async def put_resource(self,
+                           id,
+                           user,
+                           body,
+                           rdf_type_uri,
+                           rdf_type_name=None,
+                           kls=None,
+                           single_request: bool = False,
+                           return_body: bool = False):
+        """Handle a PUT method to update a resource. See QueryManager.put_resource"""
+        resource_uri = self.build_instance_uri(id)
+        body = body.dict()
+        body["id"] = resource_uri
+        username = user
+
+        request_args_delete: Dict[str, str] = {
+            "resource": resource_uri,
+            "g": self.generate_graph(username),
+            "delete_incoming_relations": False
+        }
+        if single_request:
+            # DELETE AND INSERT QUERY
+            request_args = self.build_insert_request_args(body, username)
+            try:
+                await self.run_query_update(self.build_query_replace(request_args_delete,
+                                                                     request_args))
+            finally:
+                self.record_write(username)
+        else:
+            await self.get_resource(
+                id=id, username=username, rdf_type_uri=rdf_type_uri, rdf_type_name=rdf_type_name,
+                kls=kls)
+            try:
+                # DELETE QUERY
+                await self.run_query_delete(request_args_delete)
+
+                # INSERT QUERY
+                request_args = self.build_insert_request_args(body, username)
+                try:
+                    await self.run_query_insert(request_args=request_args)
+                except Exception as err:
+                    logger.error("Exception occurred", exc_info=True)
+                    raise HTTPException(status_code=500, detail=str(err)) from err
+            finally:
+                self.record_write(username)
+
+        if return_body:
+            return self.submitted_body(body)
+
+        # GET QUERY
+        try:
+            return await self.get_resource(
+                id=id, username=username, rdf_type_uri=rdf_type_uri, rdf_type_name=rdf_type_name,
+                kls=kls)
+        except Exception as err:
+            logger.error("Error while retrieving the resource", exc_info=True)
+            raise HTTPException(
+                status_code=500, detail="Error while retrieving the resource") from err
+
+    async def delete_resource(self,
+                              id: str,
+                              user: str,
+                              rdf_type_uri: str = None,
+                              rdf_type_name: str = None,
+                              kls: str = None) -> dict:
+        """Handle a DELETE method to delete a resource. See QueryManager.delete_resource"""
+        resource_uri = self.build_instance_uri(id)
+        request_args: Dict[str, str] = {
+            "resource": resource_uri,
+            "g": self.generate_graph(user),
+            "delete_incoming_relations": True
+        }
+        # GET QUERY
+        try:
+            response = await self.get_resource(
+                id=resource_uri, username=user, rdf_type_uri=rdf_type_uri,
+                rdf_type_name=rdf_type_name, kls=kls)
+        except Exception as err:
+            logger.error("Error while retrieving the resource", exc_info=True)
+            raise HTTPException(
+                status_code=500, detail="Error while retrieving the resource") from err
+
+        if not response:
+            logger.error("Error while retrieving the resource", exc_info=True)
+            raise HTTPException(status_code=404, detail="Resource not found")
+
+        try:
+            await self.run_query_delete(request_args)
+        finally:
+            self.record_write(user)
+
+    async def post_resource(self,
+                            user,
+                            body,
+                            rdf_type_uri,
+                            rdf_type_name=None,
+                            kls=None):
+        """Post a resource and generate the id. See QueryManager.post_resource"""
+        body = self.new_resource_body(body, rdf_type_uri)
+        try:
+            await self.insert_resources(self.flatten_resources(body), user)
+        finally:
+            self.record_write(user)
+        if '@context' in body:
+            del body['@context']
+        return body
+
+    async def run_query_get(self,
+                            query_directory,
+                            owl_class_uri,
+                            query_type,
+                            request_args=None,
+                            skip_id_framing=False):
+        """Generate the query, dispatch it to the SPARQL endpoint, frame it and return the
+        response. See QueryManager.run_query_get"""
+        query_template = getattr(self, query_directory)[query_type]
+        self.add_offset(request_args)
+        response = self.get_response(query_template, owl_class_uri, request_args, skip_id_framing)
+        if request_args.get(COUNT_KEY):
+            count = self.count_resources(query_template, request_args)
+            response, total = await asyncio.gather(response, count)
+        else:
+            response, total = await response, None
+        return self.build_resource_page(response, request_args, total)
+
+    async def get_response(self, query_template: str, owl_class_uri: str, request_args: dict,
+                           skip_id_framing=False):
+        """Return the framed response of a GET query from the response cache, or send the query.
+        See QueryManager.get_response"""
+        key = self.response_key(query_template, owl_class_uri, request_args, skip_id_framing)
+        cache_key = key if self.response_cache.enabled else None
+        response, stale = self.get_cached_response(cache_key)
+        if response is None:
+            response = await self.single_flight.do(
+                self.flight_key(key, request_args),
+                lambda: self.fetch_response(cache_key, query_template, owl_class_uri, request_args,
+                                            skip_id_framing))
+        elif stale and self.response_cache.start_refresh(cache_key):
+            task = asyncio.ensure_future(self.refresh_response(cache_key, query_template,
+                                                               owl_class_uri, dict(request_args),
+                                                               skip_id_framing))
+            self.refresh_tasks.add(task)
+            task.add_done_callback(self.refresh_tasks.discard)
+        return response
+
+    async def count_resources(self, query_template: str, request_args: dict) -> int:
+        """Return the total number of items selected by a get_all query. See
+        QueryManager.count_resources"""
+        cache_key, count_query = self.count_query(query_template, request_args)
+        total = self.count_cache.get(cache_key)
+        if total is not None:
+            return total
+        generation = self.count_cache.generation
+        logger.info(count_query)
+        try:
+            result = await self.sparql.query(count_query, return_format="json",
+                                             primary=self.reads_from_primary(request_args))
+        except Exception as err:
+            raise self.query_exception(err, "Unable to count the resources") from err
+        total = self.process_count_result(result)
+        self.count_cache.put(cache_key, total, graph=cache_key[1], generation=generation)
+        return total
+
+    async def fetch_response(self, cache_key: Hashable, query_template: str, owl_class_uri: str,
+                             request_args: dict, skip_id_framing=False):
+        """Send the GET query, frame the response and store it in the response cache.
+        See QueryManager.fetch_response"""
+        generation = self.response_cache.generation
+        try:
+            result = await self.dispatch_sparql_query(
+                raw_sparql_query=query_template, request_args=request_args, stream=True)
+            if isinstance(result, AsyncStreamedResponse):
+                result = await self.read_stream(result)
+        except HTTPException:
+            raise
+        except Exception as err:
+            raise self.query_exception(err, "Unable to send query") from err
+
+        response = await self.run_in_executor(self.process_query_get_result, result, owl_class_uri,
+                                              request_args, skip_id_framing)
+        self.cache_response(cache_key, response, generation)
+        return response
+
+    async def refresh_response(self, cache_key: Hashable, query_template: str, owl_class_uri: str,
+                               request_args: dict, skip_id_framing=False):
+        """Replace a stale cached response. See QueryManager.refresh_response"""
+        try:
+            await self.fetch_response(cache_key, query_template, owl_class_uri, request_args,
+                                      skip_id_framing)
+        except Exception:
+            logger.warning("Unable to refresh the cached response", exc_info=True)
+        finally:
+            self.response_cache.end_refresh(cache_key)
+
+    @staticmethod
+    async def read_stream(result: AsyncStreamedResponse) -> dict:
+        """Parse the chunks of a streamed JSON-LD response as they are received
+
+        Returns:
+            dict: the document, see JSONLDStreamParser.document
+        """
+        parser = JSONLDStreamParser()
+        try:
+            async for chunk in result:
+                parser.feed(chunk)
+            parser.close()
+        except ValueError as err:
+            raise HTTPException(status_code=500, detail="Unable to frame the results") from err
+        finally:
+            result.close()
+        return parser.document()
+
+    async def dispatch_sparql_query(self, raw_sparql_query: str, request_args: dict,
+                                    stream: bool = False):
+        """Replace the variables in the query with the request arguments and send it.
+        See QueryManager.dispatch_sparql_query"""
+        rewritten_query = self.rewrite_sparql_query(raw_sparql_query, request_args)
+        logger.info(rewritten_query)
+        primary = self.reads_from_primary(request_args)
+        if stream:
+            return await self.sparql.query_stream(rewritten_query, primary=primary)
+        return await self.sparql.query(rewritten_query, primary=primary)
+
+    async def insert_resources(self, nodes: List[dict], username: str,
+                               chunk_size: int = INSERT_CHUNK_SIZE):
+        """Insert the nodes returned by flatten_resources. See QueryManager.insert_resources"""
+        for request_args in self.build_insert_requests_args(nodes, username, chunk_size):
+            await self.run_query_insert(request_args=request_args)
+
+    async def run_query_insert(self, request_args: dict):
+        """Send the insert query. See QueryManager.run_query_insert"""
+        query_string = self.build_query_insert_data(request_args)
+        try:
+            await self.sparql.update(query_string)
+        except Exception as err:
+            logger.error("Exception occurred", exc_info=True)
+            logger.error(query_string)
+            raise err
+
+    async def run_query_update(self, query_string: str):
+        """Send an update request. See QueryManager.run_query_update"""
+        try:
+            logger.debug("updating: %s", query_string)
+            await self.sparql.update(query_string)
+        except Exception as exception:
+            logger.error("Exception occurred", exc_info=True)
+            logger.error(query_string)
+            raise HTTPException(status_code=500, detail=str(exception)) from exception
+
+    async def run_query_delete(self, request_args: dict):
+        """Delete a resource. See QueryManager.run_query_delete"""
+        logger.info("deleting %s", request_args["resource"])
+        for query_string in self.build_queries_delete(request_args):
+            try:
+                logger.debug("deleting: %s", query_string)
+                await self.sparql.update(query_string)
+            except Exception as exception:
+                logger.error("Exception occurred", exc_info=True)
+                raise HTTPException(status_code=500, detail=str(exception)) from exception
@@ -0,0 +1,519 @@
+import asyncio
+import functools
+import http.client
+import io
+import logging
+import ssl
+import time
+from collections import deque
+from typing import Dict, Optional, Tuple
+from urllib.error import HTTPError
+from urllib.parse import urlsplit
+from urllib.request import Request
+
+from obasparql.connection_pool import PooledResponse, DEFAULT_POOL_MAXSIZE, \
+    DEFAULT_POOL_IDLE_TIMEOUT, STREAM_CHUNK_SIZE, IDEMPOTENT_METHODS
+from obasparql.resilience import CircuitOpenError, DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT
+from obasparql.sparqlconnector import SPARQLConnector, close_response
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENCY = 100
+
+# Errors raised when the server has closed a persistent connection while it was idle
+STALE_CONNECTION_ERRORS = (asyncio.IncompleteReadError, ConnectionResetError,
+                           ConnectionAbortedError, BrokenPipeError, http.client.RemoteDisconnected)
+
+
+class AsyncConnection:
+    """A persistent HTTP/1.1 connection on top of asyncio streams"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 read_timeout: float = None):
+        self.reader = reader
+        self.writer = writer
+        self.read_timeout = read_timeout
+        self.last_used = time.monotonic()
+        self._framing = ("length", 0)
+
+    def close(self):
+        self.writer.close()
+
+    async def _read(self, read):
+        """Wait for a read of the socket, at most read_timeout seconds"""
+        if self.read_timeout is None:
+            return await read
+        return await asyncio.wait_for(read, self.read_timeout)
+
+    async def request(self, method: str, host: str, path: str, data: Optional[bytes],
+                      headers: dict):
+        status, reason, response_headers, will_close = await self.send(method, host, path, data,
+                                                                       headers)
+        framing, length = self._framing
+        if framing == "length":
+            body = await self._read(self.reader.readexactly(length))
+        else:
+            body = b"".join([chunk async for chunk in self.iter_body()])
+        self.last_used = time.monotonic()
+        return status, reason, response_headers, body, will_close
+
+    async def send(self, method: str, host: str, path: str, data: Optional[bytes], headers: dict):
+        """Send a request and read the head of the response. The body is read by iter_body
+
+        Returns:
+            tuple: the status, the reason, the headers of the response and whether the connection
+                will be closed
+        """
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {host}"]
+        headers = {name.title(): value for name, value in headers.items()}
+        headers.setdefault("Accept-Encoding", "identity")
+        if data is not None:
+            headers["Content-Length"] = str(len(data))
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + (data or b""))
+        await self._read(self.writer.drain())
+
+        head = await self._read(self.reader.readuntil(b"\r\n\r\n"))
+        status_line, _, header_lines = head.partition(b"\r\n")
+        if not status_line:
+            raise http.client.RemoteDisconnected("Remote end closed connection without response")
+        version, status, reason = (status_line.decode("latin-1").split(" ", 2) + [""])[:3]
+        response_headers = http.client.parse_headers(io.BytesIO(header_lines))
+        status = int(status)
+
+        connection_header = response_headers.get("Connection", "").lower()
+        will_close = version == "HTTP/1.0" or connection_header == "close"
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            self._framing = ("length", 0)
+        elif response_headers.get("Transfer-Encoding", "").lower() == "chunked":
+            self._framing = ("chunked", None)
+        elif response_headers.get("Content-Length") is not None:
+            self._framing = ("length", int(response_headers["Content-Length"]))
+        else:
+            self._framing = ("eof", None)
+            will_close = True
+        return status, reason.strip(), response_headers, will_close
+
+    async def iter_body(self):
+        """Read the body of the response by chunks"""
+        framing, length = self._framing
+        if framing == "chunked":
+            while True:
+                size_line = await self._read(self.reader.readuntil(b"\r\n"))
+                size = int(size_line.split(b";", 1)[0].strip(), 16)
+                if size == 0:
+                    # Trailers end with an empty line
+                    while await self._read(self.reader.readuntil(b"\r\n")) != b"\r\n":
+                        pass
+                    break
+                yield await self._read(self.reader.readexactly(size))
+                await self._read(self.reader.readexactly(2))
+        elif framing == "length":
+            while length > 0:
+                chunk = await self._read(self.reader.readexactly(min(length, STREAM_CHUNK_SIZE)))
+                length -= len(chunk)
+                yield chunk
+        else:
+            while True:
+                chunk = await self._read(self.reader.read(STREAM_CHUNK_SIZE))
+                if not chunk:
+                    break
+                yield chunk
+        self.last_used = time.monotonic()
+
+
+class AsyncStreamedResponse:
+    """The response of a request sent by AsyncConnectionPool.urlopen_stream. The body is read by
+    chunks when the response is iterated with async for. close returns the connection to the pool
+    if the body has been read, else closes it, and frees the slot of the request."""
+
+    def __init__(self, pool: 'AsyncConnectionPool', key: Tuple[str, str, int],
+                 connection: AsyncConnection, url: str, status: int, reason: str, headers,
+                 will_close: bool):
+        self.pool = pool
+        self.key = key
+        self.connection = connection
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.will_close = will_close
+        self.complete = False
+
+    async def __aiter__(self):
+        async for chunk in self.connection.iter_body():
+            yield chunk
+        self.complete = True
+
+    async def read(self) -> bytes:
+        return b"".join([chunk async for chunk in self])
+
+    def getcode(self) -> int:
+        return self.status
+
+    def close(self):
+        if self.connection is None:
+            return
+        connection, self.connection = self.connection, None
+        if self.complete and not self.will_close:
+            self.pool._put_connection(self.key, connection)
+        else:
+            connection.close()
+        self.pool._semaphore.release()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+
+class AsyncConnectionPool:
+    """Pool of persistent HTTP/1.1 connections for asyncio, indexed by endpoint (scheme, host and
+    port)
+
+    Same policy as ConnectionPool: at most maxsize idle connections are kept by endpoint and the
+    connections idle for more than idle_timeout seconds are evicted. At most max_concurrency
+    requests are in flight, the other ones wait for a free slot.
+    """
+
+    def __init__(self,
+                 maxsize: int = DEFAULT_POOL_MAXSIZE,
+                 idle_timeout: float = DEFAULT_POOL_IDLE_TIMEOUT,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 timeout: float = None,
+                 connect_timeout: float = None,
+                 read_timeout: float = None):
+        """Constructor of the AsyncConnectionPool class
+
+        Args:
+            maxsize (int, optional): the maximum number of idle connections kept by endpoint.
+                Defaults to 10.
+            idle_timeout (float, optional): seconds before an idle connection is closed. Defaults
+                to 60.
+            max_concurrency (int, optional): the maximum number of requests in flight. Defaults to
+                100.
+            timeout (float, optional): the timeout of a request. Defaults to None (no timeout).
+            connect_timeout (float, optional): the timeout of the connection. Defaults to None (no
+                timeout).
+            read_timeout (float, optional): the timeout of each write or read of a connection
+                (e.g., waiting for the response). Defaults to None (no timeout).
+        """
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.connections_created = 0
+        self._idle: Dict[Tuple[str, str, int], deque] = {}
+        self._loop = None
+        self._semaphore = None
+
+    def _bind_loop(self):
+        # The connections and the semaphore belong to the event loop that created them
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._idle = {}
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    def _evict_idle(self, connections: deque, now: float):
+        # The oldest connections are on the left
+        while connections and now - connections[0].last_used > self.idle_timeout:
+            connections.popleft().close()
+
+    def _get_connection(self, key: Tuple[str, str, int]) -> Optional[AsyncConnection]:
+        connections = self._idle.get(key)
+        if connections:
+            self._evict_idle(connections, time.monotonic())
+        while connections:
+            connection = connections.pop()
+            # The server has closed the idle connection
+            if not connection.reader.at_eof() and not connection.writer.is_closing():
+                return connection
+            connection.close()
+        return None
+
+    def _put_connection(self, key: Tuple[str, str, int], connection: AsyncConnection):
+        connections = self._idle.setdefault(key, deque())
+        self._evict_idle(connections, time.monotonic())
+        if len(connections) < self.maxsize:
+            connections.append(connection)
+        else:
+            connection.close()
+
+    def idle_connections(self, url: str) -> int:
+        """Number of idle connections of the endpoint of url"""
+        connections = self._idle.get(self._key(urlsplit(url)))
+        if not connections:
+            return 0
+        self._evict_idle(connections, time.monotonic())
+        return len(connections)
+
+    @staticmethod
+    def _key(url) -> Tuple[str, str, int]:
+        scheme = url.scheme.lower()
+        default_port = 443 if scheme == "https" else 80
+        return scheme, url.hostname, url.port or default_port
+
+    async def _new_connection(self, scheme: str, host: str, port: int) -> AsyncConnection:
+        self.connections_created += 1
+        if scheme == "https":
+            connect = asyncio.open_connection(host, port, ssl=ssl.create_default_context(),
+                                              server_hostname=host)
+        else:
+            connect = asyncio.open_connection(host, port)
+        if self.connect_timeout is None:
+            reader, writer = await connect
+        else:
+            reader, writer = await asyncio.wait_for(connect, self.connect_timeout)
+        return AsyncConnection(reader, writer, self.read_timeout)
+
+    async def urlopen(self, request: Request, idempotent: Optional[bool] = None) -> PooledResponse:
+        """Send a request using a persistent connection. HTTP errors raise HTTPError
+
+        Args:
+            request (Request): the request
+            idempotent (Optional[bool], optional): the request can be sent again if the connection
+                fails (see ConnectionPool._request). Defaults to None (the requests of
+                IDEMPOTENT_METHODS).
+
+        Returns:
+            PooledResponse: the response
+        """
+        self._bind_loop()
+        async with self._semaphore:
+            if self.timeout is None:
+                return await self._urlopen(request, idempotent)
+            return await asyncio.wait_for(self._urlopen(request, idempotent), self.timeout)
+
+    async def urlopen_stream(self, request: Request,
+                             idempotent: Optional[bool] = None) -> AsyncStreamedResponse:
+        """Send a request using a persistent connection, without reading the body of the response.
+        HTTP errors raise HTTPError. The request keeps its slot until the response is closed and
+        the timeout only applies to the head of the response
+
+        Args:
+            request (Request): the request
+            idempotent (Optional[bool], optional): the request can be sent again if the connection
+                fails (see ConnectionPool._request). Defaults to None (the requests of
+                IDEMPOTENT_METHODS).
+
+        Returns:
+            AsyncStreamedResponse: the response, to close when its body has been read
+        """
+        self._bind_loop()
+        await self._semaphore.acquire()
+        try:
+            opening = self._request(request, AsyncConnection.send, idempotent)
+            if self.timeout is None:
+                key, connection, head = await opening
+            else:
+                key, connection, head = await asyncio.wait_for(opening, self.timeout)
+        except BaseException:
+            self._semaphore.release()
+            raise
+        status, reason, response_headers, will_close = head
+        streamed = AsyncStreamedResponse(self, key, connection, request.full_url, status, reason,
+                                         response_headers, will_close)
+        if status >= 400:
+            try:
+                body = await streamed.read()
+            finally:
+                streamed.close()
+            raise HTTPError(request.full_url, status, reason, response_headers, io.BytesIO(body))
+        return streamed
+
+    async def _urlopen(self, request: Request, idempotent: Optional[bool]) -> PooledResponse:
+        key, connection, response = await self._request(request, AsyncConnection.request,
+                                                        idempotent)
+        status, reason, response_headers, body, will_close = response
+        if will_close:
+            connection.close()
+        else:
+            self._put_connection(key, connection)
+        if status >= 400:
+            raise HTTPError(request.full_url, status, reason, response_headers, io.BytesIO(body))
+        return PooledResponse(request.full_url, status, reason, response_headers, body)
+
+    async def _request(self, request: Request, send, idempotent: Optional[bool] = None):
+        """Send a request with send(connection, method, host, path, data, headers). A reused
+        connection that fails is only retried for an idempotent request (see
+        ConnectionPool._request)
+
+        Returns:
+            tuple: the key of the endpoint, the connection and the result of send
+        """
+        url = urlsplit(request.full_url)
+        key = self._key(url)
+        path = url.path or "/"
+        if url.query:
+            path = f"{path}?{url.query}"
+        headers = dict(request.header_items())
+        method = request.get_method()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+
+        connection = self._get_connection(key)
+        reused = connection is not None
+        if connection is None:
+            connection = await self._new_connection(*key)
+        try:
+            response = await send(connection, method, url.netloc, path, request.data, headers)
+        except STALE_CONNECTION_ERRORS:
+            connection.close()
+            if not reused or not idempotent:
+                raise
+            # The server closed the reused connection, maybe after processing the request
+            log.debug("Retrying the request with a new connection to %s", url.netloc)
+            connection = await self._new_connection(*key)
+            try:
+                response = await send(connection, method, url.netloc, path, request.data, headers)
+            except BaseException:
+                connection.close()
+                raise
+        except BaseException:
+            # Including the cancellation: the state of the connection is unknown
+            connection.close()
+            raise
+        return key, connection, response
+
+    def clear(self):
+        """Close all the idle connections"""
+        for connections in self._idle.values():
+            while connections:
+                connections.pop().close()
+        self._idle.clear()
+
+
+class AsyncSPARQLConnector(SPARQLConnector):
+    """SPARQLConnector for asyncio: query and update are coroutines.
+    The requests are built by SPARQLConnector and sent by an AsyncConnectionPool.
+    """
+
+    def __init__(self,
+                 *args,
+                 pool: Optional[AsyncConnectionPool] = None,
+                 pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+                 pool_idle_timeout: float = DEFAULT_POOL_IDLE_TIMEOUT,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 connect_timeout: Optional[float] = DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout: Optional[float] = DEFAULT_READ_TIMEOUT,
+                 **kwargs):
+        if pool is None:
+            pool = AsyncConnectionPool(maxsize=pool_maxsize,
+                                       idle_timeout=pool_idle_timeout,
+                                       max_concurrency=max_concurrency,
+                                       connect_timeout=connect_timeout,
+                                       read_timeout=read_timeout)
+        super().__init__(*args, pool=pool, **kwargs)
+
+    async def _open(self, request: Request, urlopen, breaker):
+        """Send a request with urlopen. See SPARQLConnector._open"""
+        self._count("requests")
+        try:
+            response = await urlopen(request)
+        except BaseException as error:
+            self._after_error(error, breaker)
+            raise
+        breaker.record_success()
+        return response
+
+    async def _open_replica(self, replica, requests, urlopen):
+        """Send a query to a reserved replica and release it. See SPARQLConnector._open_replica"""
+        start = time.monotonic()
+        try:
+            response = await self._open(requests(replica.url), urlopen, replica.breaker)
+        finally:
+            self.replicas.release(replica)
+        if self.hedging is not None:
+            self.hedging.record(time.monotonic() - start)
+        return response
+
+    async def _open_hedged(self, replica, failed, requests, urlopen):
+        """Send a query to replica and, if it has not answered after the delay of the hedging
+        policy, to another replica. Return the first successful response and cancel the other
+        request. See SPARQLConnector._open_hedged"""
+        delay = self.hedging.delay()
+        if delay is None:
+            return await self._open_replica(replica, requests, urlopen)
+        futures = [asyncio.ensure_future(self._open_replica(replica, requests, urlopen))]
+        try:
+            done, _ = await asyncio.wait(futures, timeout=delay)
+            other = None if done else self._hedge_replica(replica, failed)
+            if other is None:
+                return await futures[0]
+            log.debug("Hedging the query to %s with %s", replica.url, other.url)
+            futures.append(asyncio.ensure_future(self._open_replica(other, requests, urlopen)))
+            pending = set(futures)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((future for future in futures if future in done and
+                               not future.cancelled() and future.exception() is None), None)
+                if winner is not None:
+                    for future in done - {winner}:
+                        close_response(future)
+                    if winner is not futures[0]:
+                        self.hedging.record_win()
+                    return winner.result()
+            return futures[0].result()
+        finally:
+            # The loser (or both requests if the query is cancelled)
+            for future in futures:
+                if not future.done():
+                    future.cancel()
+
+    async def _open_query(self, requests, urlopen, primary: bool = False):
+        """Send a query with urlopen to a replica, retrying the transient failures on another
+        replica. See SPARQLConnector._open_query"""
+        # A query does not change the dataset: it is sent again if a reused connection fails
+        urlopen = functools.partial(urlopen, idempotent=True)
+        attempt = 0
+        failed = []
+        while True:
+            replica = self._acquire(failed, primary)
+            try:
+                if primary or not self.hedged:
+                    return await self._open_replica(replica, requests, urlopen)
+                return await self._open_hedged(replica, failed, requests, urlopen)
+            except Exception as error:
+                if not self.retry_policy.should_retry(error, attempt):
+                    raise
+                failed.append(replica)
+                delay = self.retry_policy.delay(attempt)
+                log.debug("Retrying the query in %.3f seconds: %s", delay, error)
+            self._count("retries")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def query(self, query, default_graph: str = None, named_graph: str = None,
+                    return_format: Optional[str] = None, primary: bool = False):
+        """Coroutine to send a SPARQL query to the endpoint. See SPARQLConnector.query"""
+        requests = self.query_requests(query, default_graph, return_format)
+        try:
+            res = await self._open_query(requests, self.pool.urlopen, primary)
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            return self.query_error(e)
+        return res.read()
+
+    async def query_stream(self, query, default_graph: str = None, named_graph: str = None,
+                           return_format: Optional[str] = None, primary: bool = False):
+        """Coroutine to send a SPARQL query to the endpoint without reading the response.
+        See SPARQLConnector.query_stream"""
+        requests = self.query_requests(query, default_graph, return_format)
+        try:
+            return await self._open_query(requests, self.pool.urlopen_stream, primary)
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            return self.query_error(e)
+
+    async def update(self, query, default_graph: Optional[str] = None,
+                     named_graph: Optional[str] = None):
+        """Coroutine to send a SPARQL update query to the endpoint. See SPARQLConnector.update"""
+        request = self.update_request(query, default_graph, named_graph)
+        self.circuit_breaker.before_request()
+        await self._open(request, self.pool.urlopen, self.circuit_breaker)
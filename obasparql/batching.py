@@ -0,0 +1,175 @@
+import asyncio
+import json
+import threading
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Dict, Hashable, List
+
+from obasparql.static import IDS_CHUNK_SIZE
+
+# The items of a batch are requested with one query
+DEFAULT_BATCH_MAX_SIZE = IDS_CHUNK_SIZE
+# Seconds during which the lookups are collected. 0 disables the batching
+DEFAULT_BATCH_WAIT = 0
+
+
+class Batch:
+    """The items requested by the callers of a batch, and the futures of the callers of each
+    item"""
+
+    def __init__(self):
+        self.items: Dict[str, list] = {}
+        self.closed = threading.Event()
+        self.timer = None
+
+
+def resolve(batch: Batch, results: Dict[str, object]):
+    """Set the result of each caller of a batch. The callers of the same item receive their own
+    copy"""
+    for item, futures in batch.items.items():
+        result = results.get(item)
+        serialized = json.dumps(result) if len(futures) > 1 else None
+        for position, future in enumerate(futures):
+            if not future.done():
+                future.set_result(result if position == 0 else json.loads(serialized))
+
+
+def reject(batch: Batch, error: BaseException):
+    for futures in batch.items.values():
+        for future in futures:
+            if not future.done():
+                future.set_exception(error)
+
+
+class BatchLoader:
+    """Thread-safe collection of the lookups of single items into batches (DataLoader)
+
+    The items requested with the same key within wait seconds, or until max_size distinct items are
+    requested, are loaded with one call of load_batch. The first caller of a batch waits for the
+    others and loads it, unless a caller fills it first. The results must be JSON values.
+    """
+
+    def __init__(self,
+                 load_batch: Callable[[Hashable, List[str]], Dict[str, object]],
+                 max_size: int = DEFAULT_BATCH_MAX_SIZE,
+                 wait: float = DEFAULT_BATCH_WAIT):
+        """Constructor of the BatchLoader class
+
+        Args:
+            load_batch (Callable[[Hashable, List[str]], Dict[str, object]]): loads the items of a
+                key, returns the result of each item (a missing item is None)
+            max_size (int, optional): the maximum number of distinct items of a batch. Defaults to
+                100.
+            wait (float, optional): seconds during which the lookups are collected. Defaults to 0
+                (disabled).
+        """
+        self.load_batch = load_batch
+        self.max_size = max_size
+        self.wait = wait
+        self.batches = 0
+        self.loads = 0
+        self._open: Dict[Hashable, Batch] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.wait > 0 and self.max_size > 1
+
+    def load(self, key: Hashable, item: str):
+        """Return the result of an item, loaded with the other items of its batch
+
+        Args:
+            key (Hashable): the key of the batch
+            item (str): the item
+        """
+        future = Future()
+        with self._lock:
+            batch, first = self._join(key, item, future)
+            full = len(batch.items) >= self.max_size
+            if full:
+                self._close(key, batch)
+        if full:
+            self._run(key, batch)
+        elif first:
+            batch.closed.wait(self.wait)
+            with self._lock:
+                run = self._close(key, batch)
+            if run:
+                self._run(key, batch)
+        return future.result()
+
+    def _join(self, key: Hashable, item: str, future):
+        """Add a caller to the open batch of a key. Call it with the lock"""
+        self.loads += 1
+        batch = self._open.get(key)
+        first = batch is None
+        if first:
+            batch = self._open[key] = Batch()
+        batch.items.setdefault(item, []).append(future)
+        return batch, first
+
+    def _close(self, key: Hashable, batch: Batch) -> bool:
+        """Close a batch to the next callers. Call it with the lock. Return False if it was already
+        closed"""
+        if batch.closed.is_set():
+            return False
+        batch.closed.set()
+        del self._open[key]
+        self.batches += 1
+        return True
+
+    def _run(self, key: Hashable, batch: Batch):
+        try:
+            results = self.load_batch(key, list(batch.items))
+        except BaseException as error:
+            reject(batch, error)
+        else:
+            resolve(batch, results)
+
+    def stats(self) -> Dict[str, int]:
+        """Counters of the batching
+
+        Returns:
+            Dict[str, int]: the lookups and the batches that loaded them
+        """
+        with self._lock:
+            return {"loads": self.loads, "batches": self.batches}
+
+
+class AsyncBatchLoader(BatchLoader):
+    """BatchLoader of coroutines. The batches are loaded in tasks of the event loop: cancelling a
+    caller does not cancel the batch of the other callers"""
+
+    def __init__(self,
+                 load_batch: Callable[[Hashable, List[str]], Awaitable[Dict[str, object]]],
+                 max_size: int = DEFAULT_BATCH_MAX_SIZE,
+                 wait: float = DEFAULT_BATCH_WAIT):
+        super().__init__(load_batch, max_size, wait)
+        # Keep a reference to the tasks until they are done
+        self.tasks = set()
+
+    async def load(self, key: Hashable, item: str):
+        """Return the result of an item. See BatchLoader.load"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch, first = self._join(key, item, future)
+        if len(batch.items) >= self.max_size:
+            if batch.timer is not None:
+                batch.timer.cancel()
+            self._start(key, batch)
+        elif first:
+            batch.timer = loop.call_later(self.wait, self._start, key, batch)
+        return await future
+
+    def _start(self, key: Hashable, batch: Batch):
+        if self._close(key, batch):
+            task = asyncio.ensure_future(self._run(key, batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, key: Hashable, batch: Batch):
+        try:
+            results = await self.load_batch(key, list(batch.items))
+        except Exception as error:
+            reject(batch, error)
+        else:
+            resolve(batch, results)
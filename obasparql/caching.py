@@ -0,0 +1,258 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+DEFAULT_FRAME_CACHE_SIZE = 128
+# The response cache is disabled by default: the triple store can be modified by other clients
+DEFAULT_RESPONSE_CACHE_SIZE = 0
+DEFAULT_RESPONSE_CACHE_TTL = 60
+DEFAULT_RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Seconds after the TTL during which an expired response is served while it is refreshed.
+# 0 disables it
+DEFAULT_RESPONSE_CACHE_STALE_TTL = 0
+# Totals of the get_all queries (the count option), by count query and named graph
+DEFAULT_COUNT_CACHE_SIZE = 1024
+DEFAULT_COUNT_CACHE_TTL = 60
+
+
+class LRUCache:
+    """Thread-safe cache that evicts the least recently used entry when it holds maxsize entries.
+    It counts the hits and the misses of get
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_FRAME_CACHE_SIZE):
+        """Constructor of the LRUCache class
+
+        Args:
+            maxsize (int, optional): the maximum number of entries. 0 disables the cache. Defaults
+                to 128.
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        """Counters of the cache
+
+        Returns:
+            Dict[str, int]: the hits, the misses, the number of entries and the maximum number of
+                entries
+        """
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries),
+                "maxsize": self.maxsize}
+
+
+class ResponseCache(LRUCache):
+    """LRUCache of the responses of the endpoint, indexed by the named graph they were read from.
+
+    The entries expire ttl seconds after they are stored, and the least recently used entries are
+    evicted when the cache holds maxsize entries or max_bytes bytes. invalidate_graph removes the
+    entries of a graph and the entries read from every graph (graph None). A response read while a
+    graph was invalidated is not stored (see generation).
+
+    With stale_ttl, an expired entry is kept stale_ttl more seconds: lookup returns it as stale so
+    the caller can serve it and refresh it. start_refresh allows one refresh by key at a time
+    """
+
+    def __init__(self,
+                 maxsize: int = DEFAULT_RESPONSE_CACHE_SIZE,
+                 ttl: float = DEFAULT_RESPONSE_CACHE_TTL,
+                 max_bytes: int = DEFAULT_RESPONSE_CACHE_MAX_BYTES,
+                 stale_ttl: float = DEFAULT_RESPONSE_CACHE_STALE_TTL,
+                 clock: Callable[[], float] = time.monotonic):
+        """Constructor of the ResponseCache class
+
+        Args:
+            maxsize (int, optional): the maximum number of entries. 0 disables the cache. Defaults
+                to 0.
+            ttl (float, optional): seconds before an entry expires. Defaults to 60.
+            max_bytes (int, optional): the maximum total size of the entries. Defaults to 64 MiB.
+            stale_ttl (float, optional): seconds after the TTL during which an entry is returned as
+                stale. Defaults to 0 (the entries are removed when they expire).
+            clock (Callable[[], float], optional): the time source in seconds. Defaults to
+                time.monotonic.
+        """
+        super().__init__(maxsize)
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.stale_hits = 0
+        self.refreshes = 0
+        self.generation = 0
+        self._graphs: Dict[Optional[str], set] = {}
+        self._refreshing = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0
+
+    def get(self, key: Hashable, default=None):
+        value, stale = self.lookup(key)
+        return default if value is None or stale else value
+
+    def lookup(self, key: Hashable) -> Tuple[object, bool]:
+        """Return an entry and whether it is stale. A stale entry is counted as a stale hit
+
+        Args:
+            key (Hashable): the key of the entry
+
+        Returns:
+            Tuple[object, bool]: the value (None if there is no entry, or it is older than the
+                stale TTL) and True if the value has expired
+        """
+        with self._lock:
+            try:
+                value, _, _, expires = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return None, False
+            now = self.clock()
+            if expires + self.stale_ttl <= now:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None, False
+            self._entries.move_to_end(key)
+            if expires <= now:
+                self.stale_hits += 1
+                return value, True
+            self.hits += 1
+            return value, False
+
+    def start_refresh(self, key: Hashable) -> bool:
+        """Register the refresh of an entry
+
+        Args:
+            key (Hashable): the key of the entry
+
+        Returns:
+            bool: False if the entry is already being refreshed
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            self.refreshes += 1
+            return True
+
+    def end_refresh(self, key: Hashable):
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def put(self, key: Hashable, value, graph: str = None, size: int = 0, generation: int = None):
+        """Store a response
+
+        Args:
+            key (Hashable): the key of the response
+            value: the response
+            graph (str, optional): the named graph of the response. Defaults to None (every graph).
+            size (int, optional): the size of the response in bytes. Defaults to 0.
+            generation (int, optional): the generation read before requesting the response. The
+                response is not stored if a graph has been invalidated since then. Defaults to None
+                (always stored).
+        """
+        if self.maxsize <= 0 or size > self.max_bytes:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, graph, size, self.clock() + self.ttl)
+            self._graphs.setdefault(graph, set()).add(key)
+            self.bytes += size
+            while len(self._entries) > self.maxsize or self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_graph(self, graph: str) -> int:
+        """Remove the responses read from a named graph and the responses read from every graph
+
+        Args:
+            graph (str): the named graph
+
+        Returns:
+            int: the number of responses removed
+        """
+        with self._lock:
+            self.generation += 1
+            keys = self._graphs.get(graph, set()) | self._graphs.get(None, set())
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._graphs.clear()
+            self.bytes = 0
+
+    def _remove(self, key: Hashable):
+        _, graph, size, _ = self._entries.pop(key)
+        self.bytes -= size
+        keys = self._graphs[graph]
+        keys.discard(key)
+        if not keys:
+            del self._graphs[graph]
+
+    def stats(self) -> Dict[str, int]:
+        """Counters of the cache
+
+        Returns:
+            Dict[str, int]: the hits, the misses, the stale hits and the refreshes, the evictions
+                (LRU and memory cap), the expirations (TTL), the invalidations (writes), the number
+                of entries and their size in bytes, and the limits
+        """
+        return dict(super().stats(),
+                    stale_hits=self.stale_hits,
+                    refreshes=self.refreshes,
+                    evictions=self.evictions,
+                    expirations=self.expirations,
+                    invalidations=self.invalidations,
+                    bytes=self.bytes,
+                    max_bytes=self.max_bytes)
+
+
+def fingerprint(value) -> str:
+    """Digest of a JSON value, independent of the order of the keys"""
+    text = json.dumps(value, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
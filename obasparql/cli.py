@@ -0,0 +1,41 @@
+import argparse
+import sys
+import time
+
+from obasparql.query_manager import QueryManager
+
+
+def build_cache(argv=None):
+    """Prebuild the artifact cache of a QueryManager (compiled templates and processed contexts).
+    It is meant to run when the image of the API is built, so the workers start from a warm cache.
+
+    Args:
+        argv (list, optional): the command line arguments. Defaults to sys.argv.
+    """
+    parser = argparse.ArgumentParser(
+        prog="obasparql-build-cache",
+        description="Prebuild the cache of compiled query templates and contexts")
+    parser.add_argument("--queries-dir", required=True,
+                        help="the directory where the queries are stored")
+    parser.add_argument("--context-dir", required=True, help="the directory where the context are")
+    parser.add_argument("--cache-dir", required=True,
+                        help="the directory where the cache is written")
+    parser.add_argument("--endpoint", default=None,
+                        help="the endpoint used to resolve the enumerations of the templates")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    query_manager = QueryManager(endpoint=args.endpoint,
+                                 named_graph_base=None,
+                                 uri_prefix=None,
+                                 queries_dir=args.queries_dir,
+                                 context_dir=args.context_dir,
+                                 cache_dir=args.cache_dir)
+    elapsed = time.perf_counter() - start
+    print(f"Cached {len(query_manager.query_templates)} query templates and the contexts "
+          f"in {args.cache_dir} ({elapsed:.2f} s)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(build_cache())
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import threading
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Dict, Hashable
+
+
+class Flight:
+    """A call in progress and the number of callers waiting for it"""
+
+    def __init__(self, future):
+        self.future = future
+        self.callers = 1
+        # The JSON result of a call shared by several callers, each of them reads a new copy
+        self.serialized = None
+
+
+class SingleFlight:
+    """Thread-safe coalescing of identical concurrent calls (single flight)
+
+    The callers of do with the same key, while a call of that key is in progress, wait for that
+    call instead of running the function again. The result must be a JSON value: when it is shared,
+    each caller receives its own copy. invalidate prevents the next callers from joining the calls
+    in progress, e.g., after a write.
+    """
+
+    def __init__(self, enabled: bool = True):
+        """Constructor of the SingleFlight class
+
+        Args:
+            enabled (bool, optional): False runs every call. Defaults to True.
+        """
+        self.enabled = enabled
+        self.calls = 0
+        self.shared = 0
+        self.generation = 0
+        self._flights: Dict[Hashable, Flight] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, function: Callable[[], object]):
+        """Run function, or wait for the call of the same key in progress
+
+        Args:
+            key (Hashable): the key of the call. None runs function
+            function (Callable[[], object]): the call
+
+        Returns:
+            The result of function, a copy if it is shared
+        """
+        if not self.enabled or key is None:
+            return function()
+        with self._lock:
+            key = (self.generation, key)
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight(Future())
+                self.calls += 1
+            else:
+                flight.callers += 1
+                self.shared += 1
+        if not leader:
+            return json.loads(flight.future.result())
+        try:
+            result = function()
+        except BaseException as error:
+            self._land(key, flight)
+            flight.future.set_exception(error)
+            raise
+        if self._land(key, flight) > 1:
+            flight.future.set_result(json.dumps(result))
+        else:
+            flight.future.set_result(None)
+        return result
+
+    def _land(self, key: Hashable, flight: Flight) -> int:
+        """Remove a call in progress and return its number of callers"""
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            return flight.callers
+
+    def invalidate(self):
+        """The next callers do not join the calls in progress"""
+        with self._lock:
+            self.generation += 1
+
+    def stats(self) -> Dict[str, int]:
+        """Counters of the coalescing
+
+        Returns:
+            Dict[str, int]: the calls run, the calls that waited for another one and the calls in
+                progress
+        """
+        with self._lock:
+            return {"calls": self.calls, "shared": self.shared, "in_flight": len(self._flights)}
+
+
+class AsyncSingleFlight(SingleFlight):
+    """SingleFlight of coroutines. The call runs in a task: cancelling a caller does not cancel the
+    call of the other callers"""
+
+    async def do(self, key: Hashable, function: Callable[[], Awaitable]):
+        """Await function(), or the call of the same key in progress. See SingleFlight.do"""
+        if not self.enabled or key is None:
+            return await function()
+        key = (self.generation, key)
+        flight = self._flights.get(key)
+        if flight is not None:
+            flight.callers += 1
+            self.shared += 1
+        else:
+            flight = self._flights[key] = Flight(None)
+            flight.future = asyncio.ensure_future(self._run(key, flight, function))
+            self.calls += 1
+        result = await asyncio.shield(flight.future)
+        if flight.serialized is not None:
+            return json.loads(flight.serialized)
+        return result
+
+    async def _run(self, key: Hashable, flight: Flight, function: Callable[[], Awaitable]):
+        try:
+            result = await function()
+        finally:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        if flight.callers > 1:
+            flight.serialized = json.dumps(result)
+        return result
@@ -0,0 +1,364 @@
+import http.client
+import io
+import logging
+import select
+import socket
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterator, Optional, Tuple
+from urllib.error import HTTPError
+from urllib.parse import urlsplit
+from urllib.request import Request
+
+log = logging.getLogger(__name__)
+
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_POOL_IDLE_TIMEOUT = 60.0
+# Size of the chunks of a streamed response
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Errors raised when the server has closed a persistent connection while it was idle
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                           BrokenPipeError, ConnectionResetError, ConnectionAbortedError)
+# The requests that can be sent again when the connection fails (e.g., not a SPARQL update)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def is_dropped(connection: http.client.HTTPConnection) -> bool:
+    """Indicates if the server has closed an idle connection: its socket is readable"""
+    if connection.sock is None:
+        return False
+    try:
+        poller = select.poll()
+    except AttributeError:
+        return bool(select.select([connection.sock], [], [], 0)[0])
+    poller.register(connection.sock, select.POLLIN)
+    return bool(poller.poll(0))
+
+
+class RequestCancelled(BaseException):
+    """The request has been cancelled (see Cancellation). Like asyncio.CancelledError, it is not an
+    Exception, so it is not handled as a failure of the request or of the endpoint"""
+
+
+class Cancellation:
+    """Cancel a request sent by the ConnectionPool from another thread: cancel shuts down the
+    connection of the request, so its blocked send or read fails with RequestCancelled"""
+
+    def __init__(self):
+        self.cancelled = False
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def attach(self, connection: Optional[http.client.HTTPConnection]):
+        """Set the connection of the request, None when the response has been received. The
+        connection is opened, so it can be shut down"""
+        if connection is not None and connection.sock is None:
+            connection.connect()
+        with self._lock:
+            self._connection = connection
+            if self.cancelled:
+                self._shutdown()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            self._shutdown()
+
+    def _shutdown(self):
+        sock = self._connection.sock if self._connection is not None else None
+        if sock is None:
+            return
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            # The connection has been closed
+            pass
+
+
+class PooledResponse:
+    """The response of a request sent by the ConnectionPool. The body has been read,
+    so the connection can be reused by the next request."""
+
+    def __init__(self, url: str, status: int, reason: str, headers: http.client.HTTPMessage,
+                 body: bytes):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    def read(self) -> bytes:
+        return self.body
+
+    def getcode(self) -> int:
+        return self.status
+
+
+class StreamedResponse:
+    """The response of a request sent by ConnectionPool.urlopen_stream. The body is read by chunks
+    when the response is iterated; close returns the connection to the pool if the body has been
+    read, else closes it."""
+
+    def __init__(self, pool: 'ConnectionPool', key: Tuple[str, str, int],
+                 connection: http.client.HTTPConnection, url: str,
+                 response: http.client.HTTPResponse):
+        self.pool = pool
+        self.key = key
+        self.connection = connection
+        self.url = url
+        self.response = response
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            chunk = self.response.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+    def read(self) -> bytes:
+        return self.response.read()
+
+    def getcode(self) -> int:
+        return self.status
+
+    def close(self):
+        if self.connection is None:
+            return
+        connection, self.connection = self.connection, None
+        if self.response.isclosed() and not self.response.will_close:
+            self.pool._put_connection(self.key, connection)
+        else:
+            connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ConnectionPool:
+    """Pool of persistent HTTP/1.1 connections, indexed by endpoint (scheme, host and port)
+
+    Each request takes an idle connection of its endpoint (or opens a new one) and returns it to
+    the pool when the response has been read. At most maxsize idle connections are kept by
+    endpoint, the others are closed. Connections idle for more than idle_timeout seconds are
+    evicted.
+    """
+
+    def __init__(self,
+                 maxsize: int = DEFAULT_POOL_MAXSIZE,
+                 idle_timeout: float = DEFAULT_POOL_IDLE_TIMEOUT,
+                 timeout: float = None,
+                 connect_timeout: float = None,
+                 read_timeout: float = None):
+        """Constructor of the ConnectionPool class
+
+        Args:
+            maxsize (int, optional): the maximum number of idle connections kept by endpoint.
+                Defaults to 10.
+            idle_timeout (float, optional): seconds before an idle connection is closed. Defaults
+                to 60.
+            timeout (float, optional): the timeout of the socket operations. Defaults to None (no
+                timeout).
+            connect_timeout (float, optional): the timeout of the connection. Defaults to None
+                (timeout).
+            read_timeout (float, optional): the timeout of the operations of a connected socket
+                (e.g., waiting for the response). Defaults to None (timeout).
+        """
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout if connect_timeout is not None else timeout
+        self.read_timeout = read_timeout if read_timeout is not None else timeout
+        self.connections_created = 0
+        self._idle: Dict[Tuple[str, str, int], deque] = {}
+        self._lock = threading.Lock()
+
+    def _new_connection(self, scheme: str, host: str, port: int) -> http.client.HTTPConnection:
+        with self._lock:
+            self.connections_created += 1
+        if scheme == "https":
+            connection = http.client.HTTPSConnection(host, port, timeout=self.connect_timeout)
+        else:
+            connection = http.client.HTTPConnection(host, port, timeout=self.connect_timeout)
+        if self.read_timeout != self.connect_timeout:
+            connection.connect()
+            connection.sock.settimeout(self.read_timeout)
+        return connection
+
+    def _evict_idle(self, connections: deque, now: float):
+        # The oldest connections are on the left
+        while connections and now - connections[0][1] > self.idle_timeout:
+            connection, _ = connections.popleft()
+            connection.close()
+
+    def _get_connection(self, key: Tuple[str, str, int]):
+        with self._lock:
+            connections = self._idle.get(key)
+            if connections:
+                self._evict_idle(connections, time.monotonic())
+            while connections:
+                connection = connections.pop()[0]
+                if not is_dropped(connection):
+                    return connection
+                connection.close()
+        return None
+
+    def _put_connection(self, key: Tuple[str, str, int], connection: http.client.HTTPConnection):
+        with self._lock:
+            connections = self._idle.setdefault(key, deque())
+            self._evict_idle(connections, time.monotonic())
+            if len(connections) < self.maxsize:
+                connections.append((connection, time.monotonic()))
+                return
+        connection.close()
+
+    def idle_connections(self, url: str) -> int:
+        """Number of idle connections of the endpoint of url"""
+        key = self._key(urlsplit(url))
+        with self._lock:
+            connections = self._idle.get(key)
+            if not connections:
+                return 0
+            self._evict_idle(connections, time.monotonic())
+            return len(connections)
+
+    @staticmethod
+    def _key(url) -> Tuple[str, str, int]:
+        scheme = url.scheme.lower()
+        default_port = 443 if scheme == "https" else 80
+        return scheme, url.hostname, url.port or default_port
+
+    def urlopen(self, request: Request, idempotent: Optional[bool] = None,
+                cancellation: Optional[Cancellation] = None) -> PooledResponse:
+        """Send a request using a persistent connection. Same behaviour as urllib.request.urlopen:
+        HTTP errors raise HTTPError
+
+        Args:
+            request (Request): the request
+            idempotent (Optional[bool], optional): the request can be sent again if the connection
+                fails (see _request). Defaults to None (the requests of IDEMPOTENT_METHODS).
+            cancellation (Optional[Cancellation], optional): cancels the request from another
+                thread. Defaults to None.
+
+        Raises:
+            RequestCancelled: the request has been cancelled before the response
+
+        Returns:
+            PooledResponse: the response
+        """
+        key, connection, response = self._request(request, self._send, idempotent, cancellation)
+        status, reason, response_headers, body, will_close = response
+        if will_close:
+            connection.close()
+        else:
+            self._put_connection(key, connection)
+        if status >= 400:
+            raise HTTPError(request.full_url, status, reason, response_headers, io.BytesIO(body))
+        return PooledResponse(request.full_url, status, reason, response_headers, body)
+
+    def urlopen_stream(self, request: Request, idempotent: Optional[bool] = None,
+                       cancellation: Optional[Cancellation] = None) -> StreamedResponse:
+        """Send a request using a persistent connection, without reading the body of the response.
+        HTTP errors raise HTTPError
+
+        Args:
+            request (Request): the request
+            idempotent (Optional[bool], optional): the request can be sent again if the connection
+                fails (see _request). Defaults to None (the requests of IDEMPOTENT_METHODS).
+            cancellation (Optional[Cancellation], optional): cancels the request until the head of
+                the response has been received. Defaults to None.
+
+        Raises:
+            RequestCancelled: the request has been cancelled before the head of the response
+
+        Returns:
+            StreamedResponse: the response, to close when its body has been read
+        """
+        key, connection, response = self._request(request, self._send_streaming, idempotent,
+                                                  cancellation)
+        streamed = StreamedResponse(self, key, connection, request.full_url, response)
+        if response.status >= 400:
+            try:
+                body = response.read()
+            finally:
+                streamed.close()
+            raise HTTPError(request.full_url, response.status, response.reason, response.headers,
+                            io.BytesIO(body))
+        return streamed
+
+    def _request(self, request: Request, send, idempotent: Optional[bool] = None,
+                 cancellation: Optional[Cancellation] = None):
+        """Send a request with send(connection, method, path, data, headers). The idle connections
+        closed by the server are discarded before they are used; if a reused connection fails
+        anyway, an idempotent request is sent again once with a new connection. The server may have
+        processed the request before the connection failed, so the other requests (e.g., a SPARQL
+        update sent with POST) are not sent again
+
+        Returns:
+            tuple: the key of the endpoint, the connection and the result of send
+        """
+        url = urlsplit(request.full_url)
+        key = self._key(url)
+        path = url.path or "/"
+        if url.query:
+            path = f"{path}?{url.query}"
+        headers = dict(request.header_items())
+        if idempotent is None:
+            idempotent = request.get_method() in IDEMPOTENT_METHODS
+
+        if cancellation is None:
+            cancellation = Cancellation()
+        connection = self._get_connection(key)
+        reused = connection is not None
+        if connection is None:
+            connection = self._new_connection(*key)
+        try:
+            try:
+                cancellation.attach(connection)
+                response = send(connection, request.get_method(), path, request.data, headers)
+            except STALE_CONNECTION_ERRORS:
+                connection.close()
+                if not reused or not idempotent or cancellation.cancelled:
+                    raise
+                # The server closed the reused connection, maybe after processing the request
+                log.debug("Retrying the request with a new connection to %s", url.netloc)
+                connection = self._new_connection(*key)
+                cancellation.attach(connection)
+                response = send(connection, request.get_method(), path, request.data, headers)
+        except Exception as error:
+            connection.close()
+            if cancellation.cancelled:
+                raise RequestCancelled(f"Cancelled request to {url.netloc}") from error
+            raise
+        finally:
+            cancellation.attach(None)
+        return key, connection, response
+
+    @staticmethod
+    def _send(connection: http.client.HTTPConnection, method: str, path: str, data: bytes,
+              headers: dict):
+        connection.request(method, path, body=data, headers=headers)
+        response = connection.getresponse()
+        body = response.read()
+        return response.status, response.reason, response.headers, body, response.will_close
+
+    @staticmethod
+    def _send_streaming(connection: http.client.HTTPConnection, method: str, path: str,
+                        data: bytes, headers: dict) -> http.client.HTTPResponse:
+        connection.request(method, path, body=data, headers=headers)
+        return connection.getresponse()
+
+    def clear(self):
+        """Close all the idle connections"""
+        with self._lock:
+            for connections in self._idle.values():
+                while connections:
+                    connections.pop()[0].close()
+            self._idle.clear()
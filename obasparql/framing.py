@@ -0,0 +1,462 @@
+import re
+from collections import namedtuple
+from typing import Dict, List, Optional, Tuple, Union
+
+from obasparql.ntriples import JSONLD_CONTEXT, JSONLD_ID, JSONLD_TYPE, JSONLD_VALUE, \
+    URI_GEN_DELIMS, UnsupportedJSONLD
+
+JSONLD_CONTAINER = "@container"
+JSONLD_LANGUAGE_MAP = "@language"
+JSONLD_NONE = "@none"
+JSONLD_NULL = "@null"
+JSONLD_SET = "@set"
+
+# Keys of the term definitions supported by the framer
+TERM_DEFINITION_KEYS = {JSONLD_ID, JSONLD_TYPE, JSONLD_CONTAINER}
+# Same test as pyld
+ABSOLUTE_IRI = re.compile(r"^([A-Za-z][A-Za-z0-9+.-]*|_):[^\s]*$")
+# Containers of the inverse context, in the order used by pyld to select a term
+CONTAINERS = (JSONLD_SET, JSONLD_NONE)
+
+
+class Mapping(namedtuple('Mapping', ['iri', 'coercion', 'container', 'prefix'])):
+    """Term definition as processed by pyld: the IRI (or the keyword of an alias), the coercion of
+    the values (@id, a datatype or None), the container (@set or @none) and if the term can be the
+    prefix of a compact IRI"""
+    __slots__ = ()
+
+
+class ActiveContext:
+    """Subset of the JSON-LD 1.1 active context used by pyld to expand and compact the results:
+    terms with an IRI, a coercion to @id or to a datatype and an optional @set container, and the
+    aliases of @id and @type.
+
+    Other features raise UnsupportedJSONLD.
+    """
+
+    def __init__(self, context: dict):
+        """Constructor of the ActiveContext class
+
+        Args:
+            context (dict): the JSON-LD context, without the @context key
+
+        Raises:
+            UnsupportedJSONLD: the context uses a feature that is not supported
+        """
+        if any(name.startswith("@") for name in context):
+            raise UnsupportedJSONLD("The context defines JSON-LD keywords")
+        self.definitions = context
+        self.mappings: Dict[str, Optional[Mapping]] = {}
+        for name in context:
+            self._mapping(name, ())
+        self.keywords: Dict[str, str] = {JSONLD_ID: JSONLD_ID, JSONLD_TYPE: JSONLD_TYPE}
+        for name, mapping in self.mappings.items():
+            if mapping is not None and mapping.iri.startswith("@"):
+                self.keywords[name] = mapping.iri
+        self.prefixes: List[Tuple[str, str]] = [(mapping.iri, name)
+                                                for name, mapping in self.mappings.items()
+                                                if mapping is not None and mapping.prefix]
+        self.inverse = self._inverse()
+        self.id_key = self._keyword_alias(JSONLD_ID)
+        self.type_key = self._keyword_alias(JSONLD_TYPE)
+        type_mapping = self.mappings.get(self.type_key)
+        self.type_is_set = type_mapping is not None and type_mapping.container == JSONLD_SET
+
+    def _mapping(self, name: str, defining: tuple) -> Optional[Mapping]:
+        if name in self.mappings:
+            return self.mappings[name]
+        if ":" in name or "/" in name or name in defining:
+            raise UnsupportedJSONLD(f"Unsupported term {name}")
+        definition = self.definitions[name]
+        if definition is None:
+            self.mappings[name] = None
+            return None
+        simple = isinstance(definition, str)
+        if simple:
+            definition = {JSONLD_ID: definition}
+        if not isinstance(definition, dict) or not definition.keys() <= TERM_DEFINITION_KEYS or \
+                not isinstance(definition.get(JSONLD_ID), str):
+            raise UnsupportedJSONLD(f"Unsupported definition of the term {name}")
+
+        container = definition.get(JSONLD_CONTAINER, JSONLD_NONE)
+        if container == [JSONLD_SET]:
+            container = JSONLD_SET
+        if container not in (JSONLD_NONE, JSONLD_SET):
+            raise UnsupportedJSONLD(f"Unsupported container of the term {name}")
+
+        iri, coercion = definition[JSONLD_ID], definition.get(JSONLD_TYPE)
+        if iri in (JSONLD_ID, JSONLD_TYPE):
+            if coercion is not None:
+                raise UnsupportedJSONLD(f"Unsupported definition of the term {name}")
+            mapping = Mapping(iri, None, container, False)
+        else:
+            iri = self._expand_definition(iri, defining + (name,))
+            if coercion is not None and coercion != JSONLD_ID:
+                if not isinstance(coercion, str) or coercion.startswith("@"):
+                    raise UnsupportedJSONLD(f"Unsupported coercion of the term {name}")
+                coercion = self._expand_definition(coercion, defining + (name,))
+            mapping = Mapping(iri, coercion, container, simple and iri.endswith(URI_GEN_DELIMS))
+        self.mappings[name] = mapping
+        return mapping
+
+    def _expand_definition(self, value: str, defining: tuple) -> str:
+        """Expand the IRI of a term definition, which can be another term or a compact IRI"""
+        if value.startswith("@"):
+            raise UnsupportedJSONLD(f"Unsupported keyword {value}")
+        if value in self.definitions:
+            mapping = self._mapping(value, defining)
+            if mapping is None or mapping.iri.startswith("@"):
+                raise UnsupportedJSONLD(f"Unsupported IRI {value}")
+            return mapping.iri
+        prefix, colon, suffix = value.partition(":")
+        if colon and prefix != "_" and not suffix.startswith("//") and prefix in self.definitions:
+            mapping = self._mapping(prefix, defining)
+            if mapping is not None and mapping.prefix:
+                return mapping.iri + suffix
+        if colon and prefix != "_" and ABSOLUTE_IRI.match(value):
+            return value
+        raise UnsupportedJSONLD(f"Unsupported IRI {value}")
+
+    def _inverse(self) -> Dict[str, dict]:
+        """Inverse context of pyld, restricted to the supported term definitions"""
+        inverse = {}
+        for name, mapping in sorted(self.mappings.items(),
+                                    key=lambda item: (len(item[0]), item[0])):
+            if mapping is None:
+                continue
+            entry = inverse.setdefault(mapping.iri, {}).setdefault(
+                mapping.container, {JSONLD_LANGUAGE_MAP: {}, JSONLD_TYPE: {}})
+            if mapping.coercion is not None:
+                entry[JSONLD_TYPE].setdefault(mapping.coercion, name)
+            else:
+                entry[JSONLD_LANGUAGE_MAP].setdefault(JSONLD_NONE, name)
+                entry[JSONLD_TYPE].setdefault(JSONLD_NONE, name)
+        return inverse
+
+    def _keyword_alias(self, keyword: str) -> str:
+        types = self.inverse.get(keyword, {}).get(JSONLD_NONE, {}).get(JSONLD_TYPE, {})
+        alias = types.get(JSONLD_NONE)
+        return alias or self.select_term(keyword, JSONLD_TYPE, JSONLD_ID) or keyword
+
+    def select_term(self, iri: str, type_or_language: str, preference: str) -> Optional[str]:
+        """Select the term of an IRI for a value: node objects and types prefer @id in the @type
+        map, plain values prefer @null in the @language map and typed values prefer their datatype
+        in the @type map
+        """
+        containers = self.inverse.get(iri)
+        if containers is None:
+            return None
+        for container in CONTAINERS:
+            entry = containers.get(container)
+            if entry is None:
+                continue
+            terms = entry[type_or_language]
+            for candidate in (preference, JSONLD_NONE):
+                if candidate in terms:
+                    return terms[candidate]
+        return None
+
+    def expand_iri(self, value, vocab: bool = False) -> str:
+        """Expand a term, a compact IRI or an absolute IRI. Relative IRIs and blank nodes are not
+        supported
+
+        Args:
+            value: the value to expand
+            vocab (bool, optional): the value can be a term of the context (types and properties).
+                Defaults to False.
+
+        Returns:
+            str: the IRI
+        """
+        if not isinstance(value, str):
+            raise UnsupportedJSONLD(f"Not an IRI: {value!r}")
+        if vocab and value in self.mappings:
+            mapping = self.mappings[value]
+            if mapping is None or mapping.iri.startswith("@"):
+                raise UnsupportedJSONLD(f"Unsupported IRI {value}")
+            return mapping.iri
+        prefix, colon, suffix = value.partition(":")
+        if colon and prefix != "_":
+            if not suffix.startswith("//"):
+                mapping = self.mappings.get(prefix)
+                if mapping is not None and mapping.prefix:
+                    return mapping.iri + suffix
+            if ABSOLUTE_IRI.match(value):
+                return value
+        raise UnsupportedJSONLD(f"Unsupported IRI {value}")
+
+    def compact_iri(self, iri: str, vocab: bool = False, type_or_language: str = JSONLD_TYPE,
+                    preference: str = JSONLD_ID) -> str:
+        """Compact an IRI to a term, a compact IRI or the IRI itself, as pyld does
+
+        Args:
+            iri (str): the IRI
+            vocab (bool, optional): the IRI is a type or a property. Defaults to False.
+            type_or_language (str, optional): the map of the inverse context used to select the
+                term
+            preference (str, optional): the preferred coercion or language of the term
+
+        Returns:
+            str: the compacted IRI
+        """
+        if vocab:
+            term = self.select_term(iri, type_or_language, preference)
+            if term is not None:
+                return term
+        candidate = None
+        for prefix_iri, name in self.prefixes:
+            if iri != prefix_iri and iri.startswith(prefix_iri):
+                curie = f"{name}:{iri[len(prefix_iri):]}"
+                if candidate is None or (len(curie), curie) < (len(candidate), candidate):
+                    candidate = curie
+        if candidate is not None:
+            return candidate
+        for _, name in self.prefixes:
+            if iri.startswith(name + ":"):
+                raise UnsupportedJSONLD(f"Absolute IRI {iri} confused with the prefix {name}")
+        return iri
+
+
+class Framer:
+    """Frame the results of the queries without pyld, for the frames built by
+    QueryManager.build_frame: the resources of a class (or the resources with the given IRIs) and
+    all the resources they reference, embedded with @embed @always.
+
+    The output is the output of pyld.jsonld.frame. The framer follows the same steps (node map,
+    matching, embedding and compaction) but only supports the contexts generated by OBA and Fuseki:
+    the graphs or the contexts that use another JSON-LD feature (blank nodes, languages, lists,
+    @vocab...) raise UnsupportedJSONLD and must be framed with pyld.
+    """
+
+    def __init__(self, context: dict, frame: dict):
+        """Constructor of the Framer class
+
+        Args:
+            context (dict): the context of the results
+            frame (dict): the frame, with a @context and a @type
+        """
+        try:
+            if not frame.keys() <= {JSONLD_CONTEXT, JSONLD_TYPE} or \
+                    not isinstance(frame[JSONLD_TYPE], str):
+                raise UnsupportedJSONLD("Unsupported frame")
+            self.input_context = ActiveContext(context)
+            self.frame_context = ActiveContext(frame[JSONLD_CONTEXT])
+            self.owl_class_uri = self.frame_context.expand_iri(frame[JSONLD_TYPE], vocab=True)
+        except UnsupportedJSONLD as error:
+            self.supported = False
+            self.reason = str(error)
+        else:
+            self.supported = True
+            self.reason = None
+
+    def frame(self, graph: Union[list, dict],
+              owl_resource_iri: Union[str, List[str]] = None) -> Union[dict, list]:
+        """Frame the results
+
+        Args:
+            graph (Union[list, dict]): the @graph of the results, or the resource when there is
+                only one
+            owl_resource_iri (Union[str, List[str]], optional): the resource uri or a list of uris.
+                Defaults to None.
+
+        Raises:
+            UnsupportedJSONLD: the context or the results use a feature that is not supported
+
+        Returns:
+            Union[dict, list]: the framed resource when one resource matches the frame, else the
+                list of resources
+        """
+        if not self.supported:
+            raise UnsupportedJSONLD(self.reason)
+        if isinstance(graph, dict):
+            # The context of a single resource is the context of the results
+            graph = [{key: value for key, value in graph.items() if key != JSONLD_CONTEXT}]
+        nodes: Dict[str, dict] = {}
+        for node in graph:
+            expanded = self._expand_node(node)
+            # The expansion drops the top-level nodes that only have an @id, the references create
+            # them
+            if len(expanded) > 1:
+                self._add_node(expanded, nodes)
+
+        if owl_resource_iri is None:
+            matches = [node_id for node_id in sorted(nodes)
+                       if self.owl_class_uri in nodes[node_id].get(JSONLD_TYPE, ())]
+        else:
+            # pyld matches the @id of the frame and ignores its @type
+            iris = owl_resource_iri if isinstance(owl_resource_iri, list) else [owl_resource_iri]
+            iris = {self.frame_context.expand_iri(iri) for iri in iris}
+            matches = [node_id for node_id in sorted(nodes) if not iris or node_id in iris]
+
+        compacted: Dict[tuple, str] = {}
+        framed = [self._embed(node_id, nodes, [], compacted) for node_id in matches]
+        if len(framed) == 1:
+            return framed[0]
+        return framed if framed else {}
+
+    def _expand_node(self, node) -> dict:
+        """Expand a node with the context of the results. The nested nodes are expanded, not
+        flattened"""
+        if not isinstance(node, dict):
+            raise UnsupportedJSONLD(f"Unsupported node {node!r}")
+        context = self.input_context
+        expanded = {}
+        # As pyld, the keys are sorted: it sets the order of the values of the terms with the same
+        # IRI
+        for key, value in sorted(node.items()):
+            keyword = context.keywords.get(key)
+            values = value if isinstance(value, list) else [value]
+            if keyword == JSONLD_ID:
+                if JSONLD_ID in expanded:
+                    raise UnsupportedJSONLD("Colliding keywords")
+                expanded[JSONLD_ID] = context.expand_iri(value)
+                continue
+            if keyword == JSONLD_TYPE:
+                if JSONLD_TYPE in expanded:
+                    raise UnsupportedJSONLD("Colliding keywords")
+                if values:
+                    expanded[JSONLD_TYPE] = [context.expand_iri(rdf_type, vocab=True)
+                                             for rdf_type in values]
+                continue
+            if key.startswith("@"):
+                raise UnsupportedJSONLD(f"Unsupported keyword {key}")
+            if key in context.mappings:
+                mapping = context.mappings[key]
+                if mapping is None:
+                    continue
+                iri, coercion = mapping.iri, mapping.coercion
+            elif ":" in key:
+                iri, coercion = context.expand_iri(key, vocab=True), None
+            else:
+                # Keys that are not in the context are dropped
+                continue
+            items = [item for item in (self._expand_value(item, coercion) for item in values)
+                     if item is not None]
+            # An array is kept even if it is empty, a null value is dropped
+            if items or isinstance(value, list):
+                expanded.setdefault(iri, []).extend(items)
+        if JSONLD_ID not in expanded:
+            raise UnsupportedJSONLD("Blank node")
+        return expanded
+
+    def _expand_value(self, value, coercion: Optional[str]) -> Optional[dict]:
+        if value is None:
+            return None
+        context = self.input_context
+        if isinstance(value, dict):
+            if JSONLD_VALUE in value:
+                if not value.keys() <= {JSONLD_VALUE, JSONLD_TYPE}:
+                    raise UnsupportedJSONLD(f"Unsupported value object {value}")
+                literal = value[JSONLD_VALUE]
+                if literal is None:
+                    return None
+                if JSONLD_TYPE in value:
+                    if not isinstance(literal, str):
+                        raise UnsupportedJSONLD(f"Unsupported value object {value}")
+                    return {JSONLD_VALUE: literal,
+                            JSONLD_TYPE: context.expand_iri(value[JSONLD_TYPE], vocab=True)}
+                return {JSONLD_VALUE: self._literal(literal)}
+            return self._expand_node(value)
+        if isinstance(value, str) and coercion == JSONLD_ID:
+            return {JSONLD_ID: context.expand_iri(value)}
+        if coercion == JSONLD_ID:
+            raise UnsupportedJSONLD(f"Not an IRI: {value!r}")
+        if coercion is not None:
+            return {JSONLD_VALUE: self._literal(value), JSONLD_TYPE: coercion}
+        return {JSONLD_VALUE: self._literal(value)}
+
+    def _add_node(self, expanded: dict, nodes: Dict[str, dict]):
+        """Add an expanded node and its nested nodes to the node map, in the order of pyld"""
+        subject = nodes.setdefault(expanded[JSONLD_ID], {JSONLD_ID: expanded[JSONLD_ID]})
+        types = subject.setdefault(JSONLD_TYPE, []) if JSONLD_TYPE in expanded else ()
+        for rdf_type in expanded.get(JSONLD_TYPE, ()):
+            if rdf_type not in types:
+                types.append(rdf_type)
+        for iri in sorted(expanded):
+            if iri.startswith("@"):
+                continue
+            for item in expanded[iri]:
+                if JSONLD_ID in item:
+                    self._add_value(subject, iri, {JSONLD_ID: item[JSONLD_ID]})
+                    self._add_node(item, nodes)
+                else:
+                    self._add_value(subject, iri, item)
+
+    @staticmethod
+    def _literal(value):
+        if isinstance(value, (str, int, float)):
+            return value
+        raise UnsupportedJSONLD(f"Unsupported value {value!r}")
+
+    @staticmethod
+    def _add_value(subject: dict, key: str, value):
+        values = subject.setdefault(key, [])
+        # As pyld, true and 1 are different values
+        if not any(existing == value and isinstance(existing.get(JSONLD_VALUE), bool) ==
+                   isinstance(value.get(JSONLD_VALUE), bool) for existing in values):
+            values.append(value)
+
+    def _compact(self, compacted: Dict[tuple, str], iri: str, vocab: bool = False,
+                 type_or_language: str = JSONLD_TYPE, preference: str = JSONLD_ID) -> str:
+        key = (iri, vocab, type_or_language, preference)
+        try:
+            return compacted[key]
+        except KeyError:
+            value = self.frame_context.compact_iri(iri, vocab, type_or_language, preference)
+            compacted[key] = value
+            return value
+
+    def _embed(self, node_id: str, nodes: Dict[str, dict], stack: List[str],
+               compacted: Dict[tuple, str]) -> dict:
+        """Embed a node and the nodes it references (except its ancestors) and compact it with the
+        frame context"""
+        context = self.frame_context
+        output = {context.id_key: self._compact(compacted, node_id)}
+        # As pyld, the parent of the node is not checked
+        if node_id in stack[:-1]:
+            return output
+        stack.append(node_id)
+        subject = nodes[node_id]
+        for key in sorted(subject):
+            values = subject[key]
+            if key == JSONLD_ID:
+                continue
+            if key == JSONLD_TYPE:
+                types = [self._compact(compacted, rdf_type, vocab=True) for rdf_type in values]
+                many = context.type_is_set or len(types) > 1
+                output[context.type_key] = types if many else types[0]
+                continue
+            for value in values:
+                if JSONLD_ID in value:
+                    term = self._compact(compacted, key, vocab=True)
+                    mapping = context.mappings.get(term)
+                    item = self._embed(value[JSONLD_ID], nodes, stack, compacted)
+                    if len(item) == 1 and mapping is not None and mapping.coercion == JSONLD_ID:
+                        item = item[context.id_key]
+                elif JSONLD_TYPE in value:
+                    term = self._compact(compacted, key, vocab=True, preference=value[JSONLD_TYPE])
+                    mapping = context.mappings.get(term)
+                    if mapping is not None and mapping.coercion == value[JSONLD_TYPE]:
+                        item = value[JSONLD_VALUE]
+                    else:
+                        datatype = self._compact(compacted, value[JSONLD_TYPE], vocab=True)
+                        item = {context.type_key: datatype, JSONLD_VALUE: value[JSONLD_VALUE]}
+                else:
+                    term = self._compact(compacted, key, vocab=True,
+                                         type_or_language=JSONLD_LANGUAGE_MAP,
+                                         preference=JSONLD_NULL)
+                    mapping = context.mappings.get(term)
+                    item = value[JSONLD_VALUE]
+                is_set = mapping is not None and mapping.container == JSONLD_SET
+                self._add_output(output, term, item, is_set)
+        stack.pop()
+        return output
+
+    @staticmethod
+    def _add_output(output: dict, key: str, value, as_set: bool):
+        if key in output:
+            if not isinstance(output[key], list):
+                output[key] = [output[key]]
+            output[key].append(value)
+        else:
+            output[key] = [value] if as_set else value
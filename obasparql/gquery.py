@@ -18,6 +18,7 @@ import logging
 from pprint import pformat
 import traceback
 import re
+from collections import namedtuple
 import requests
 
 # grlc modules
@@ -296,28 +297,335 @@ def get_metadata(rq, endpoint):
     return query_metadata
 
 
-def rewrite_query(query, parameters, get_args):
-    glogger.debug("Query parameters")
-    glogger.debug(parameters)
+# Tokens of a query template: IRIs, strings and comments are copied verbatim, variables and the
+# solution modifiers of the first SELECT are the candidates to become slots. The key of a SELECT of
+# one variable (e.g., SELECT DISTINCT ?item) is the variable that selects the items of a page
+TEMPLATE_TOKEN_PATTERN = re.compile(
+    r'(?P<iri><[^<>"{}|^`\\\s]*>)'
+    r'|(?P<string>"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\')'
+    r'|(?P<comment>#[^\n]*)'
+    r'|(?P<select>\b(?i:SELECT)\s+(?:(?i:DISTINCT|REDUCED)\s+)?'
+    r'(?:(?=(?P<key>[?$]\w+)\s*(?:(?i:WHERE)\s*)?\{))?)'
+    r'|(?P<variable>[?$]\w+)'
+    r'|(?P<limit>\b(?i:LIMIT)\s+\d+\b)'
+    r'|(?P<offset>\b(?i:OFFSET)\s+\d+\b)'
+    r'|(?P<order>\b(?i:ORDER\s+BY)\b)'
+    r'|(?P<where>\b(?i:WHERE)\s*\{)'
+    r'|(?P<brace>[{}])')
+
+SLOT_IRI = 'iri'
+SLOT_NUMBER = 'number'
+SLOT_LITERAL = 'literal'
+SLOT_LANG = 'lang'
+SLOT_DATATYPE = 'datatype'
+SLOT_LIMIT = 'limit'
+SLOT_OFFSET = 'offset'
+SLOT_VALUES = 'values'
+SLOT_AFTER = 'after'
+
+
+class Slot(namedtuple('Slot', ['kind', 'name', 'original', 'suffix'])):
+    """A position of a compiled query where a value is inserted
+
+    kind is one of the SLOT_* constants, name is the name of the parameter (or of the pagination
+    argument), original is the text of the template and suffix the language or datatype of the
+    literal. The suffix of the values slot is the dict of the slots of the parameters, indexed by
+    name. The suffix of the limit and after slots is the variable of the keyset pagination (None
+    for the limit slots that do not support it).
+    """
+    __slots__ = ()
+
+
+def _parameter_slot(p):
+    """Returns the slot that substitutes the parameter p (an item of get_parameters)"""
+    # IRI
+    if p['type'] == 'iri' or p.get('format') == 'iri':
+        return Slot(SLOT_IRI, p['name'], p['original'], None)
+    # A number (without a datatype)
+    if p['type'] == 'number':
+        return Slot(SLOT_NUMBER, p['name'], p['original'], None)
+    # If there is a language tag
+    if p.get('lang'):
+        return Slot(SLOT_LANG, p['name'], p['original'], p['lang'])
+    if p.get('datatype'):
+        return Slot(SLOT_DATATYPE, p['name'], p['original'], p['datatype'])
+    return Slot(SLOT_LITERAL, p['name'], p['original'], None)
+
+
+def compile_query(query, parameters, pagination=False, values=False):
+    """ Splits the query into static fragments and typed slots, so it can be rewritten with a
+    single join. Only whole variables are replaced: the parameter ?_g_iri does not match the
+    variable ?_g_iri2. If pagination is True, the LIMIT and the OFFSET of the first SELECT of the
+    query (the subquery that selects the items of a CONSTRUCT, or the query itself) become slots.
+    If that SELECT is a subquery of one variable without LIMIT or OFFSET, the slots are added at
+    its end, with the default LIMIT 100 and OFFSET 0. The SELECT of one variable also gets an after
+    slot at the end of its WHERE clause to continue after the value of a cursor (keyset pagination,
+    see render_query). If values is True, a slot is added at the beginning of the WHERE clause of
+    the query to insert a VALUES block that binds parameters to multiple values (see render_query).
+    """
+    slots = {p['original']: _parameter_slot(p) for p in parameters.values()}
+    fragments = []
+    position = 0
+    depth = 0
+    # The first SELECT: its depth, its key, the part of the query being read (the WHERE clause,
+    # the solution modifiers or the rest of the query) and its solution modifiers
+    select_depth = None
+    select_key = None
+    select_part = None
+    limited = offset = ordered = False
+
+    def add_slot(start, end, slot):
+        nonlocal position
+        fragments.append(query[position:start])
+        fragments.append(slot)
+        position = end
+
+    def add_pagination(start):
+        # The subquery of one variable without LIMIT or OFFSET is paginated with the defaults
+        if select_key is None or select_depth == 0 or (limited and offset):
+            return
+        if not query[start - 1:start].isspace():
+            add_slot(start, start, ' ')
+        if not limited:
+            limit = 'LIMIT {}'.format(static.DEFAULT_PER_PAGE)
+            add_slot(start, start, Slot(SLOT_LIMIT, static.PER_PAGE_KEY, limit,
+                                        None if ordered else select_key))
+            add_slot(start, start, ' ')
+        if not offset:
+            add_slot(start, start, Slot(SLOT_OFFSET, 'offset', 'OFFSET 0', None))
+            add_slot(start, start, ' ')
+
+    for match in TEMPLATE_TOKEN_PATTERN.finditer(query):
+        kind = match.lastgroup
+        token = match.group()
+        modifiers = pagination and select_part == 'modifiers' and depth == select_depth
+        if kind == 'brace':
+            depth += 1 if token == '{' else -1
+            if select_part == 'where' and depth == select_depth:
+                select_part = 'modifiers'
+                if pagination and select_key is not None:
+                    add_slot(match.start(), match.start(),
+                             Slot(SLOT_AFTER, static.SPARQL_AFTER_KEY, '', select_key))
+            elif select_part == 'modifiers' and depth != select_depth:
+                # A group that is not a solution modifier (e.g., VALUES) is not paginated
+                select_part = None
+                if depth < select_depth and pagination:
+                    add_pagination(match.start())
+            continue
+        elif kind == 'select':
+            if select_depth is None:
+                select_depth = depth
+                select_key = match.group('key')
+                select_part = 'where'
+            continue
+        elif kind == 'where':
+            depth += 1
+            if not values or depth != 1:
+                continue
+            values = False
+            slot = Slot(SLOT_VALUES, None, '', {slot.name: slot for slot in slots.values()})
+            add_slot(match.end(), match.end(), slot)
+            continue
+        elif kind == 'variable' and token in slots:
+            slot = slots[token]
+        elif modifiers and kind == 'order':
+            ordered = True
+            continue
+        elif modifiers and kind == 'limit':
+            limited = True
+            slot = Slot(SLOT_LIMIT, static.PER_PAGE_KEY, token, None if ordered else select_key)
+        elif modifiers and kind == 'offset':
+            offset = True
+            slot = Slot(SLOT_OFFSET, 'offset', token, None)
+        else:
+            continue
+        add_slot(match.start(), match.end(), slot)
+    if pagination and select_part == 'modifiers':
+        add_pagination(len(query))
+    fragments.append(query[position:])
+    return [fragment for fragment in fragments if fragment != '']
+
+
+# The declarations of the prologue of a query, and the GRAPH keyword before a group graph pattern
+PROLOGUE_PATTERN = re.compile(r'^[ \t]*(?i:PREFIX\s+[\w.-]*:\s*<[^<>]*>|BASE\s*<[^<>]*>)',
+                              re.MULTILINE)
+GRAPH_PATTERN = re.compile(r'\b(?i:GRAPH)\s+(?:[?$]\w+|<[^<>"{}|^`\\\s]*>|[\w.-]*:[\w.-]*)\s*$')
+
+
+def derive_count_query(query):
+    """ Returns the query that counts the distinct items selected by the first SELECT of the query,
+    when it is a subquery of one variable (the subquery that selects the items of a page, see
+    compile_query), without its LIMIT and OFFSET. The groups that contain the subquery are kept if
+    they are plain groups or GRAPH patterns. Returns None if the query has no such subquery or it
+    is in another pattern (e.g., OPTIONAL or UNION).
+    """
+    openings = []
+    ancestors = None
+    key = None
+    end = None
+    removed = []
+    for match in TEMPLATE_TOKEN_PATTERN.finditer(query):
+        kind = match.lastgroup
+        token = match.group()
+        if kind == 'where' or (kind == 'brace' and token == '{'):
+            openings.append(match.end() - 1)
+        elif kind == 'brace':
+            if not openings:
+                return None
+            start = openings.pop()
+            if ancestors and start == ancestors[-1]:
+                end = match.start()
+                break
+        elif kind == 'select' and ancestors is None:
+            key = match.group('key')
+            ancestors = list(openings)
+        elif kind in ('limit', 'offset') and ancestors is not None and \
+                len(openings) == len(ancestors):
+            removed.append((match.start(), match.end()))
+    if key is None or end is None or len(ancestors) < 2:
+        return None
+
+    groups = []
+    for previous, start in zip(ancestors, ancestors[1:]):
+        before = query[previous + 1:start].rstrip()
+        graph = GRAPH_PATTERN.search(before)
+        if graph is not None:
+            groups.append(graph.group().strip() + ' {')
+        elif before == '' or before[-1] in '{}.':
+            groups.append('{')
+        else:
+            return None
+
+    body = []
+    position = ancestors[-1] + 1
+    for start, stop in removed:
+        body.append(query[position:start])
+        position = stop
+    body.append(query[position:end])
+    prologue = '\n'.join(declaration.strip()
+                         for declaration in PROLOGUE_PATTERN.findall(query[:ancestors[0]]))
+    return '{}\nSELECT (COUNT(DISTINCT {}) AS ?{}) WHERE {{\n    {}{}{}\n}}\n'.format(
+        prologue, key, static.SPARQL_COUNT_VARIABLE, ' '.join(groups), ''.join(body).rstrip(),
+        ' }' * len(groups)).lstrip()
+
+
+def _render_value(slot, v):
+    """Returns the SPARQL term of the value v of the parameter of slot"""
+    kind = slot.kind
+    if kind == SLOT_IRI:
+        return '<{}>'.format(v)
+    elif kind == SLOT_NUMBER:
+        return str(v)
+    elif kind == SLOT_LANG:
+        return '"{}"@{}'.format(v, slot.suffix)
+    elif kind == SLOT_DATATYPE:
+        return '"{}"^^{}'.format(v, slot.suffix)
+    return '"{}"'.format(v)
+
+
+def _render_values(slots, values):
+    """Returns the VALUES blocks of the parameters bound to multiple values"""
+    blocks = []
+    for name, parameter_values in values.items():
+        if name not in slots:
+            raise ValueError('The parameter {} is not in the query'.format(name))
+        slot = slots[name]
+        terms = ' '.join(_render_value(slot, v) for v in parameter_values)
+        blocks.append('\n    VALUES {} {{ {} }}'.format(slot.original, terms))
+    return ''.join(blocks)
+
+
+def render_query(fragments, get_args):
+    """
+    Joins the fragments of a compiled query replacing the slots with the values of get_args.
+    get_args[static.SPARQL_VALUES_KEY] can bind parameters to a list of values: the variable of the
+    parameter remains in the query and a VALUES block is added (the query must be compiled with
+    values=True).
+    If get_args contains static.SPARQL_AFTER_KEY, the SELECT of the limit slot continues after the
+    value of static.SPARQL_AFTER_KEY (an IRI, or None for the first page), without offset. A page
+    of that SELECT (with a cursor, or per_page and offset) is ordered by its variable: ORDER BY is
+    added before its first LIMIT or OFFSET, so every page has the same order. It selects
+    get_args[static.SPARQL_LOOKAHEAD_KEY] items more than per_page (0 by default).
+    """
     requireXSD = False
+    keyset = static.SPARQL_AFTER_KEY in get_args
+    paginate = static.PER_PAGE_KEY in get_args and 'offset' in get_args
+    lookahead = get_args.get(static.SPARQL_LOOKAHEAD_KEY, 0)
+    # The variable of the SELECT of the limit slot, if the template does not order it
+    order_key = next((fragment.suffix for fragment in fragments
+                      if not isinstance(fragment, str) and fragment.kind == SLOT_LIMIT
+                      and fragment.suffix), None)
+    ordered = order_key is not None and (keyset or paginate)
+    values = get_args.get(static.SPARQL_VALUES_KEY) or {}
+    parts = []
+    for fragment in fragments:
+        if isinstance(fragment, str):
+            parts.append(fragment)
+            continue
+        kind = fragment.kind
+        if kind == SLOT_AFTER:
+            if keyset and get_args[fragment.name]:
+                parts.append(' FILTER(STR({}) > "{}") '.format(fragment.suffix,
+                                                                get_args[fragment.name]))
+            continue
+        if ordered and kind in (SLOT_LIMIT, SLOT_OFFSET) and order_key is not None:
+            # The first LIMIT or OFFSET of the SELECT
+            parts.append('ORDER BY STR({}) '.format(order_key))
+            order_key = None
+        if ordered and kind == SLOT_LIMIT:
+            if fragment.name in get_args:
+                limit = int(get_args[fragment.name])
+            else:
+                limit = int(fragment.original.split()[1])
+            parts.append('LIMIT {}'.format(limit + lookahead))
+            continue
+        if keyset and kind == SLOT_OFFSET:
+            parts.append(fragment.original)
+            continue
+        if kind == SLOT_LIMIT or kind == SLOT_OFFSET:
+            if paginate:
+                parts.append('{} {}'.format(kind.upper(), get_args[fragment.name]))
+            else:
+                parts.append(fragment.original)
+            continue
+        if kind == SLOT_VALUES:
+            parts.append(_render_values(fragment.suffix, values))
+            continue
+        v = get_args.get(fragment.name, None)
+        # If the parameter has not a value or it is bound by VALUES, the variable remains in the
+        # query
+        if not v or fragment.name in values:
+            parts.append(fragment.original)
+            continue
+        parts.append(_render_value(fragment, v))
+        if kind == SLOT_DATATYPE and 'xsd' in fragment.suffix:
+            requireXSD = True
+
+    query = ''.join(parts)
+    if requireXSD and XSD_PREFIX not in query:
+        query = XSD_PREFIX + '\n' + query
+    return query
+
 
-    required_params = {}
-    for k, v in parameters.items():
-        if parameters[k]['required']:
-            required_params[k] = v
-    requiredParams = set(required_params.keys())
-    providedParams = set(get_args.keys())
+def check_required_parameters(parameters, get_args):
+    requiredParams = set(k for k, v in parameters.items() if v['required'])
+    providedParams = set(get_args.keys()) | set(get_args.get(static.SPARQL_VALUES_KEY) or {})
     glogger.debug("Required parameters: {} Request args: {}".format(requiredParams, providedParams))
     assert requiredParams.issubset(providedParams), 'Provided parameters do not cover the required parameters!'
 
-    for pname, p in list(parameters.items()):
-        # Get the parameter value from the GET request
-        v = get_args.get(pname, None)
-        # If the parameter has a value
-        if not v:
-            continue
 
-        if isinstance(query, dict):  # json query (sparql transformer)
+def rewrite_query(query, parameters, get_args):
+    glogger.debug("Query parameters")
+    glogger.debug(parameters)
+    check_required_parameters(parameters, get_args)
+
+    if isinstance(query, dict):  # json query (sparql transformer)
+        for pname, p in list(parameters.items()):
+            # Get the parameter value from the GET request
+            v = get_args.get(pname, None)
+            # If the parameter has a value
+            if not v:
+                continue
             if '$values' not in query:
                 query['$values'] = {}
             values = query['$values']
@@ -328,36 +636,9 @@ def rewrite_query(query, parameters, get_args):
                 values[p['original']].append(v)
             else:
                 values[p['original']] = [values[p['original']], v]
+        return query
 
-            continue
-
-        # IRI
-        if p['type'] == 'iri':  # TODO: never reached anymore, since iris are now type=string with format=iri
-            query = query.replace(p['original'], "{}{}{}".format('<', v, '>'))
-        # A number (without a datatype)
-        elif p['type'] == 'number':
-            query = query.replace(p['original'], v)
-        # Literals
-        elif p['type'] == 'literal' or p['type'] == 'string':
-            # If it's a iri
-            if 'format' in p and p['format'] == 'iri':
-                query = query.replace(p['original'], "{}{}{}".format('<', v, '>'))
-            # If there is a language tag
-            if 'lang' in p and p['lang']:
-                query = query.replace(p['original'], "\"{}\"@{}".format(v, p['lang']))
-            elif 'datatype' in p and p['datatype']:
-                query = query.replace(p['original'], "\"{}\"^^{}".format(v, p['datatype']))
-                if 'xsd' in p['datatype']:
-                    requireXSD = True
-            else:
-                query = query.replace(p['original'], "\"{}\"".format(v))
-
-    if isinstance(query, dict):  # json query (sparql transformer)
-        pass
-
-    if requireXSD and XSD_PREFIX not in query:
-        query = query.replace('SELECT', XSD_PREFIX + '\n\nSELECT')
-
+    query = render_query(compile_query(query, parameters), get_args)
     glogger.debug("Query rewritten as: " + query)
 
     return query
@@ -0,0 +1,268 @@
+import math
+import re
+from collections import namedtuple
+from typing import Dict, List, Optional
+from urllib.parse import urljoin, urlsplit
+
+RDF_TYPE = "http://www.w3.org/1999/02/22-rdf-syntax-ns#type"
+XSD = "http://www.w3.org/2001/XMLSchema#"
+
+JSONLD_ID = "@id"
+JSONLD_TYPE = "@type"
+JSONLD_VALUE = "@value"
+JSONLD_LANGUAGE = "@language"
+JSONLD_CONTEXT = "@context"
+
+# A term whose IRI ends with one of these characters can be used as the prefix of a compact IRI
+URI_GEN_DELIMS = (":", "/", "?", "#", "[", "]", "@")
+# Keys of the term definitions supported by the serializer
+TERM_DEFINITION_KEYS = {JSONLD_ID, JSONLD_TYPE, "@container"}
+# Relative IRIs that are resolved the same way by every JSON-LD processor
+SIMPLE_RELATIVE_IRI = re.compile(r"^[A-Za-z0-9_~-][A-Za-z0-9_.~-]*$")
+INVALID_IRI_CHARACTERS = re.compile(r'[\x00-\x20<>"{}|^`\\]')
+LANGUAGE_TAG = re.compile(r"^[a-zA-Z]+(-[a-zA-Z0-9]+)*$")
+LITERAL_ESCAPE = re.compile(r'[\\"\x00-\x1f\x7f]')
+ECHARS = {'\\': '\\\\', '"': '\\"', '\n': '\\n', '\r': '\\r', '\t': '\\t', '\b': '\\b',
+          '\f': '\\f'}
+
+
+class UnsupportedJSONLD(ValueError):
+    """The resource or the context uses a JSON-LD feature that NTriplesSerializer or Framer do not
+    support"""
+
+
+class Term(namedtuple('Term', ['iri', 'coercion', 'prefix'])):
+    """Definition of a term of the context: the IRI of the property, the coercion of its values
+    (@id, a datatype or None) and if the term can be used as the prefix of a compact IRI"""
+    __slots__ = ()
+
+
+def escape_literal(value: str) -> str:
+    return LITERAL_ESCAPE.sub(
+        lambda match: ECHARS.get(match.group(0)) or '\\u%04X' % ord(match.group(0)), value)
+
+
+def lexical_form(value) -> str:
+    """Lexical form of a JSON scalar, as rdflib writes it"""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float) and not math.isfinite(value):
+        raise UnsupportedJSONLD(f"Not a finite number: {value}")
+    return str(value)
+
+
+class NTriplesSerializer:
+    """Serialize the resources of the API (JSON objects described by the context) to N-Triples,
+    without expanding the JSON-LD document and building an rdflib Graph.
+
+    The serializer supports the contexts generated by OBA: terms with an IRI (or a compact IRI), a
+    coercion to @id or to a datatype and an optional @set container, and the aliases of @id and
+    @type. Other JSON-LD features raise UnsupportedJSONLD: the caller must convert those resources
+    with a complete JSON-LD processor.
+    """
+
+    def __init__(self, context: dict, base: str):
+        """Constructor of the NTriplesSerializer class
+
+        Args:
+            context (dict): the JSON-LD context, with or without the @context key
+            base (str): the IRI used to resolve the relative IRIs
+        """
+        context = context.get(JSONLD_CONTEXT, context)
+        self.base = base
+        self.supported = not any(name.startswith("@") for name in context)
+        self.aliases: Dict[str, str] = {JSONLD_ID: JSONLD_ID, JSONLD_TYPE: JSONLD_TYPE}
+        self.terms: Dict[str, Optional[Term]] = {}
+        for name, definition in context.items():
+            idref = definition.get(JSONLD_ID) if isinstance(definition, dict) else definition
+            if idref in (JSONLD_ID, JSONLD_TYPE):
+                self.aliases[name] = idref
+        for name, definition in context.items():
+            if name.startswith("@") or name in self.aliases:
+                continue
+            if isinstance(definition, str) or isinstance(definition, dict) and \
+                    self._is_supported_definition(definition):
+                self.terms[name] = self._read_term(context, name, definition)
+            else:
+                # The term is used by the resources only if the JSON-LD processor is complete
+                self.terms[name] = None
+
+    @staticmethod
+    def _is_supported_definition(definition: dict) -> bool:
+        return definition.keys() <= TERM_DEFINITION_KEYS and \
+            definition.get("@container") in (None, "@set") and \
+            definition.get(JSONLD_TYPE) not in ("@vocab", "@json", "@none")
+
+    def _read_term(self, context: dict, name: str, definition) -> Optional[Term]:
+        if isinstance(definition, str):
+            idref, coercion = definition, None
+        else:
+            idref = definition.get(JSONLD_ID, name if ":" in name else None)
+            coercion = definition.get(JSONLD_TYPE)
+        iri = self._expand_definition(context, idref)
+        if iri is None:
+            return None
+        if coercion is not None and coercion != JSONLD_ID:
+            coercion = self._expand_definition(context, coercion)
+            if coercion is None:
+                return None
+        return Term(iri, coercion, iri.endswith(URI_GEN_DELIMS))
+
+    @staticmethod
+    def _expand_definition(context: dict, idref: Optional[str], depth: int = 0) -> Optional[str]:
+        """Expand the IRI of a term definition, which can be a compact IRI or another term"""
+        if not isinstance(idref, str) or depth > 10:
+            return None
+        prefix, colon, local = idref.partition(":")
+        if colon and not local.startswith("//") and prefix in context:
+            definition = context[prefix]
+            prefix_iri = definition.get(JSONLD_ID) if isinstance(definition, dict) else definition
+            prefix_iri = NTriplesSerializer._expand_definition(context, prefix_iri, depth + 1)
+            return None if prefix_iri is None else prefix_iri + local
+        if colon and urlsplit(idref).scheme:
+            return idref
+        # Relative IRIs require @vocab
+        return None
+
+    def serialize(self, nodes: List[dict]) -> List[str]:
+        """Serialize the resources to N-Triples
+
+        Args:
+            nodes (List[dict]): the resources
+
+        Raises:
+            UnsupportedJSONLD: the context or the resources use a feature that is not supported
+
+        Returns:
+            List[str]: the triples
+        """
+        if not self.supported:
+            raise UnsupportedJSONLD("The context defines JSON-LD keywords")
+        triples = []
+        blank_nodes = iter(range(1 << 62))
+        for node in nodes:
+            self._node(node, triples, blank_nodes)
+        return triples
+
+    def _term(self, key: str) -> Optional[Term]:
+        try:
+            term = self.terms[key]
+        except KeyError:
+            if ":" not in key:
+                # Keys that are not in the context are ignored
+                return None
+            return Term(self.expand_iri(key, vocab=True), None, False)
+        if term is None:
+            raise UnsupportedJSONLD(f"Unsupported definition of the term {key}")
+        return term
+
+    def expand_iri(self, value: str, vocab: bool = False) -> str:
+        """Expand a term, a compact IRI or a relative IRI
+
+        Args:
+            value (str): the value to expand
+            vocab (bool, optional): the value can be a term of the context (types and properties).
+                Defaults to False.
+
+        Returns:
+            str: the IRI
+        """
+        if not isinstance(value, str):
+            raise UnsupportedJSONLD(f"Not an IRI: {value!r}")
+        if vocab and value in self.terms:
+            iri = self._term(value).iri
+        elif ":" in value:
+            prefix, _, local = value.partition(":")
+            term = self.terms.get(prefix)
+            if prefix == "_":
+                raise UnsupportedJSONLD(f"Blank node identifier {value}")
+            if term is not None and term.prefix and not local.startswith("//"):
+                iri = term.iri + local
+            elif urlsplit(value).scheme:
+                iri = value
+            else:
+                raise UnsupportedJSONLD(f"Unsupported IRI {value}")
+        elif SIMPLE_RELATIVE_IRI.match(value) and value not in (".", ".."):
+            iri = urljoin(self.base, value)
+        else:
+            raise UnsupportedJSONLD(f"Unsupported relative IRI {value}")
+        if INVALID_IRI_CHARACTERS.search(iri):
+            raise UnsupportedJSONLD(f"Invalid IRI {iri}")
+        return iri
+
+    def _node(self, node: dict, triples: List[str], blank_nodes) -> str:
+        subject = None
+        for key, value in node.items():
+            if self.aliases.get(key) == JSONLD_ID and value is not None:
+                subject = f"<{self.expand_iri(value)}>"
+        if subject is None:
+            subject = f"_:b{next(blank_nodes)}"
+
+        for key, value in node.items():
+            keyword = self.aliases.get(key)
+            if keyword == JSONLD_ID:
+                continue
+            values = value if isinstance(value, list) else [value]
+            if keyword == JSONLD_TYPE:
+                for rdf_type in values:
+                    if rdf_type is not None:
+                        iri = self.expand_iri(rdf_type, vocab=True)
+                        triples.append(f"{subject} <{RDF_TYPE}> <{iri}> .")
+                continue
+            if key.startswith("@"):
+                raise UnsupportedJSONLD(f"Unsupported keyword {key}")
+            term = self._term(key)
+            if term is None:
+                continue
+            for inner_value in values:
+                rdf_object = self._object(term, inner_value, triples, blank_nodes)
+                if rdf_object is not None:
+                    triples.append(f"{subject} <{term.iri}> {rdf_object} .")
+        return subject
+
+    def _object(self, term: Term, value, triples: List[str], blank_nodes) -> Optional[str]:
+        if value is None:
+            return None
+        if isinstance(value, dict):
+            if JSONLD_VALUE in value:
+                return self._value_object(value)
+            if any(key.startswith("@") and self.aliases.get(key) is None for key in value):
+                raise UnsupportedJSONLD(f"Unsupported object {value}")
+            return self._node(value, triples, blank_nodes)
+        if isinstance(value, list):
+            raise UnsupportedJSONLD("Nested lists")
+        if term.coercion == JSONLD_ID:
+            return f"<{self.expand_iri(value)}>"
+        if term.coercion is not None:
+            return f'"{escape_literal(lexical_form(value))}"^^<{term.coercion}>'
+        return self._native_literal(value)
+
+    @staticmethod
+    def _native_literal(value) -> str:
+        if isinstance(value, str):
+            return f'"{escape_literal(value)}"'
+        if isinstance(value, bool):
+            datatype = "boolean"
+        elif isinstance(value, int):
+            datatype = "integer"
+        elif isinstance(value, float):
+            datatype = "double"
+        else:
+            raise UnsupportedJSONLD(f"Unsupported value {value!r}")
+        return f'"{lexical_form(value)}"^^<{XSD}{datatype}>'
+
+    def _value_object(self, value: dict) -> Optional[str]:
+        if not value.keys() <= {JSONLD_VALUE, JSONLD_TYPE, JSONLD_LANGUAGE}:
+            raise UnsupportedJSONLD(f"Unsupported value object {value}")
+        literal = value[JSONLD_VALUE]
+        if literal is None:
+            return None
+        language = value.get(JSONLD_LANGUAGE)
+        if language is not None:
+            if not isinstance(literal, str) or not LANGUAGE_TAG.match(language):
+                raise UnsupportedJSONLD(f"Unsupported value object {value}")
+            return f'"{escape_literal(literal)}"@{language}'
+        if value.get(JSONLD_TYPE) is not None:
+            datatype = self.expand_iri(value[JSONLD_TYPE], vocab=True)
+            return f'"{escape_literal(lexical_form(literal))}"^^<{datatype}>'
+        return self._native_literal(literal)
@@ -0,0 +1,94 @@
+import base64
+import binascii
+import re
+from typing import List, Optional
+
+# Characters that are not allowed in an IRI (and would break the FILTER of the keyset pagination)
+INVALID_IRI_CHARACTERS = re.compile(r'[<>"{}|^`\\\s]')
+
+
+class ResourcePage(list):
+    """A page of resources returned by get_all. next_cursor is the cursor of the next page (keyset
+    pagination), None if it is the last page. total is the number of resources of every page and
+    has_next indicates if there is a next page, None if they were not requested
+    """
+
+    def __init__(self, resources=(), next_cursor: Optional[str] = None,
+                 total: Optional[int] = None, has_next: Optional[bool] = None):
+        super().__init__(resources)
+        self.next_cursor = next_cursor
+        self.total = total
+        self.has_next = has_next
+
+
+def resource_list(resources) -> list:
+    """The framed resources of get_all as a list: the framing returns a dict if there is one
+    resource and an empty dict if there is none"""
+    if isinstance(resources, dict):
+        return [resources] if resources else []
+    return resources
+
+
+def encode_cursor(iri: str) -> str:
+    """Encode the IRI of the last resource of a page as an opaque cursor"""
+    return base64.urlsafe_b64encode(iri.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> str:
+    """Decode a cursor returned by encode_cursor. The empty cursor is the first page
+
+    Args:
+        cursor (str): the cursor
+
+    Raises:
+        ValueError: the cursor is not valid
+
+    Returns:
+        str: the IRI after which the page starts, the empty string for the first page
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        iri = base64.b64decode(padded, altchars=b'-_', validate=True).decode('utf-8')
+    except (binascii.Error, UnicodeDecodeError, ValueError) as err:
+        raise ValueError(f"Invalid cursor: {cursor}") from err
+    if INVALID_IRI_CHARACTERS.search(iri):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return iri
+
+
+def build_page(resources, id_key: str, after: str, per_page: int,
+               lookahead: int = 0) -> ResourcePage:
+    """Build the page of the framed resources of a keyset query
+
+    The framed resources are the resources selected by the query (per_page resources after the
+    cursor, ordered by IRI) and the nested resources of the same class. A nested resource between
+    the cursor and the last selected resource is a selected resource, so the last selected resource
+    is the per_page-th resource after the cursor. If there are less resources, the page is the last
+    one.
+    With lookahead, the query selects per_page + lookahead resources: the page is the last one if
+    there are not more than per_page resources after the cursor, and the resources after the
+    per_page-th one are removed.
+
+    Args:
+        resources: the framed resources (a list, a dict or an empty dict)
+        id_key (str): the key of the IRI of the resources
+        after (str): the IRI after which the page starts
+        per_page (int): the maximum number of resources of the page
+        lookahead (int, optional): the number of resources selected after the page. Defaults to 0.
+
+    Returns:
+        ResourcePage: the resources and the cursor of the next page
+    """
+    resources = resource_list(resources)
+    iris: List[str] = sorted(resource[id_key] for resource in resources
+                             if isinstance(resource.get(id_key), str) and resource[id_key] > after)
+    if not lookahead:
+        next_cursor = encode_cursor(iris[per_page - 1]) if len(iris) >= per_page else None
+        return ResourcePage(resources, next_cursor)
+    has_next = len(iris) > per_page
+    if not has_next:
+        return ResourcePage(resources, has_next=False)
+    last = iris[per_page - 1]
+    resources = [resource for resource in resources
+                 if not (isinstance(resource.get(id_key), str) and resource[id_key] > last)]
+    return ResourcePage(resources, encode_cursor(last), has_next=True)
@@ -1,19 +1,46 @@
 import json
 import logging.config
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Tuple
+from typing import Dict, Hashable, Iterable, Iterator, List, Tuple, Union
 from starlette.exceptions import HTTPException
 
 import validators
 from pyld import jsonld
 from rdflib import Graph
 from obasparql.sparqlconnector import SPARQLConnector
-from obasparql import gquery
+from obasparql.artifact_cache import ArtifactCache
+from obasparql.batching import BatchLoader, DEFAULT_BATCH_MAX_SIZE, DEFAULT_BATCH_WAIT
+from obasparql.coalescing import SingleFlight
+from obasparql.caching import LRUCache, ResponseCache, DEFAULT_FRAME_CACHE_SIZE, \
+    DEFAULT_RESPONSE_CACHE_SIZE, DEFAULT_RESPONSE_CACHE_TTL, DEFAULT_RESPONSE_CACHE_MAX_BYTES, \
+    DEFAULT_RESPONSE_CACHE_STALE_TTL, DEFAULT_COUNT_CACHE_SIZE, DEFAULT_COUNT_CACHE_TTL, \
+    fingerprint
+from obasparql.connection_pool import DEFAULT_POOL_MAXSIZE, DEFAULT_POOL_IDLE_TIMEOUT, \
+    StreamedResponse
+from obasparql.framing import Framer
+from obasparql.ntriples import NTriplesSerializer, UnsupportedJSONLD
+from obasparql.pagination import ResourcePage, build_page, decode_cursor, resource_list
+from obasparql.query_template import QueryTemplate
+from obasparql.replicas import HedgingPolicy, DEFAULT_HEDGE_BUDGET
+from obasparql.resilience import CircuitBreaker, CircuitOpenError, RetryPolicy, \
+    DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT, DEFAULT_QUERY_RETRIES, \
+    DEFAULT_CIRCUIT_FAILURE_THRESHOLD, DEFAULT_CIRCUIT_RESET_TIMEOUT
+from obasparql.streaming import is_stream, parse_stream
 from obasparql.static import CONTEXT_ID_KEY, CONTEXT_OVERWRITE_CLASS_FILE, CONTEXT_TYPE_KEY, CUSTOM_QUERY_NAME, DEFAULT_DIR, ID_KEY, PAGE_KEY, PER_PAGE_KEY, QUERY_TYPE_GET_ONE, QUERY_TYPE_GET_ONE_USER, QUERY_TYPE_GET_ALL, \
     CONTEXT_FILE, CONTEXT_CLASS_FILE, CONTEXT_KEY, SPARQL_QUERY_TYPE_VARIABLE, USERNAME_KEY, QUERY_TYPE_GET_ALL_USER, SPARQL_ID_TYPE_VARIABLE, SPARQL_GRAPH_TYPE_VARIABLE, SKIP_ID_FRAMING_KEY, EMBED_OPTION, JSONLD, XSD_DATATYPES
+from obasparql.static import SPARQL_VALUES_KEY, IDS_CHUNK_SIZE, INSERT_CHUNK_SIZE, CURSOR_KEY, \
+    SPARQL_AFTER_KEY, COUNT_KEY, SPARQL_COUNT_VARIABLE, HAS_NEXT_KEY, SPARQL_LOOKAHEAD_KEY, \
+    DEFAULT_PER_PAGE
 from obasparql.utils import generate_new_id, primitives, convert_snake
 
+COUNT_EXECUTOR = "count"
+PREFETCH_EXECUTOR = "prefetch"
+FRAME_EXECUTOR = "frame"
+
 glogger = logging.getLogger("grlc")
 logger = logging.getLogger('fastapi')
 
@@ -42,7 +69,31 @@ class QueryManager:
                  queries_dir: str,
                  context_dir: str,
                  endpoint_username=None,
-                 endpoint_password=None):
+                 endpoint_password=None,
+                 cache_dir: str = None,
+                 pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+                 pool_idle_timeout: float = DEFAULT_POOL_IDLE_TIMEOUT,
+                 connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout: float = DEFAULT_READ_TIMEOUT,
+                 query_retries: int = DEFAULT_QUERY_RETRIES,
+                 circuit_failure_threshold: int = DEFAULT_CIRCUIT_FAILURE_THRESHOLD,
+                 circuit_reset_timeout: float = DEFAULT_CIRCUIT_RESET_TIMEOUT,
+                 query_endpoints: List[str] = None,
+                 update_endpoint: str = None,
+                 read_your_writes_ttl: float = 0,
+                 hedge_percentile: float = None,
+                 hedge_budget: float = DEFAULT_HEDGE_BUDGET,
+                 coalesce_queries: bool = False,
+                 batch_wait: float = DEFAULT_BATCH_WAIT,
+                 batch_max_size: int = DEFAULT_BATCH_MAX_SIZE,
+                 frame_cache_size: int = DEFAULT_FRAME_CACHE_SIZE,
+                 response_cache_size: int = DEFAULT_RESPONSE_CACHE_SIZE,
+                 response_cache_ttl: float = DEFAULT_RESPONSE_CACHE_TTL,
+                 response_cache_max_bytes: int = DEFAULT_RESPONSE_CACHE_MAX_BYTES,
+                 response_cache_stale_ttl: float = DEFAULT_RESPONSE_CACHE_STALE_TTL,
+                 count_cache_size: int = DEFAULT_COUNT_CACHE_SIZE,
+                 count_cache_ttl: float = DEFAULT_COUNT_CACHE_TTL,
+                 reject_unbounded_templates: bool = False):
         """Constructor of the QueryManager class
 
         Args:
@@ -53,6 +104,64 @@ class QueryManager:
             context_dir (str): the directory where the context are
             endpoint_username (str, optional): the username to access the endpoint. Defaults to None.
             endpoint_password ([type], optional): [description]. Defaults to None.
+            cache_dir (str, optional): the directory where the compiled templates and the processed
+                contexts are stored to speed up the next start. Defaults to None (no cache).
+            pool_maxsize (int, optional): the maximum number of idle connections kept by endpoint.
+                Defaults to 10.
+            pool_idle_timeout (float, optional): seconds before an idle connection is closed.
+                Defaults to 60.
+            connect_timeout (float, optional): seconds to connect to the endpoint. Defaults to 10
+                (None waits forever).
+            read_timeout (float, optional): seconds to wait for each read of the response. Defaults
+                to 120 (None waits forever).
+            query_retries (int, optional): the maximum number of retries of a query that failed
+                with a timeout, a connection error or a 502, 503 or 504 response. The updates are
+                not retried. Defaults to 2.
+            circuit_failure_threshold (int, optional): consecutive failures after which the
+                requests are rejected (503) without contacting the endpoint. Defaults to 5 (0
+                disables the circuit breaker).
+            circuit_reset_timeout (float, optional): seconds before a request probes the endpoint
+                again. Defaults to 30.
+            query_endpoints (List[str], optional): the query endpoints of the replicas of the
+                triple store. The queries are balanced between the healthy replicas. Defaults to
+                None (endpoint).
+            update_endpoint (str, optional): the update endpoint of the primary. Defaults to None
+                ({endpoint}/update).
+            read_your_writes_ttl (float, optional): seconds after put_resource, post_resource or
+                delete_resource during which the queries of the user's graph are sent to endpoint
+                (the primary) instead of the replicas. Defaults to 0 (disabled).
+            hedge_percentile (float, optional): with several query_endpoints, a query without
+                response after this percentile of the recent latencies (e.g., 95) is also sent to
+                another replica and the first response is used. Defaults to None (no hedging).
+            hedge_budget (float, optional): the maximum ratio of hedged queries. Defaults to 0.05.
+            coalesce_queries (bool, optional): the identical GET queries requested at the same time
+                are sent and framed once, each request receives a copy of the response. Defaults to
+                False.
+            batch_wait (float, optional): seconds during which the get_one and get_one_user lookups
+                of the same class and graph are collected and requested with one query (see
+                get_resources). Defaults to 0 (disabled).
+            batch_max_size (int, optional): the maximum number of ids of a batch of lookups.
+                Defaults to 100.
+            frame_cache_size (int, optional): the maximum number of frames kept by class and
+                endpoint context. Defaults to 128.
+            response_cache_size (int, optional): the maximum number of framed responses kept by
+                query and named graph. The responses of a user's graph are removed when
+                put_resource, post_resource or delete_resource write to it. Defaults to 0 (no
+                cache).
+            response_cache_ttl (float, optional): seconds before a cached response expires.
+                Defaults to 60.
+            response_cache_max_bytes (int, optional): the maximum size of the cached responses.
+                Defaults to 64 MiB.
+            response_cache_stale_ttl (float, optional): seconds after the TTL during which an
+                expired response is returned while it is refreshed in the background
+                (stale-while-revalidate). Defaults to 0.
+            count_cache_size (int, optional): the maximum number of totals of the count option kept
+                by query and named graph. They are removed as the cached responses. Defaults to
+                1024 (0 disables the cache).
+            count_cache_ttl (float, optional): seconds before a cached total expires. Defaults to
+                60.
+            reject_unbounded_templates (bool, optional): raise an error if a get_all template can
+                not be paginated, instead of logging a warning. Defaults to False.
 
         Raises:
             e: [description]
@@ -65,16 +174,21 @@ class QueryManager:
         self.endpoint = endpoint
         self.endpoint_username = endpoint_username
         self.endpoint_password = endpoint_password
-        self.update_endpoint = f'{self.endpoint}/update'
+        self.update_endpoint = update_endpoint or f'{self.endpoint}/update'
+        self.query_endpoints = query_endpoints or [self.endpoint]
         self.query_endpoint = f'{self.endpoint}/query'
         self.named_graph_base = named_graph_base
         self.uri_prefix = uri_prefix
-        self.sparql = SPARQLConnector(query_endpoint=self.endpoint,
-                                      update_endpoint=self.update_endpoint,
-                                      auth=(self.endpoint_username,
-                                            self.endpoint_password),
-                                      method="POST",
-                                      returnFormat='json-ld')
+        self.artifact_cache = ArtifactCache(cache_dir) if cache_dir is not None else None
+        self.sparql = self.build_connector(pool_maxsize=pool_maxsize,
+                                           pool_idle_timeout=pool_idle_timeout,
+                                           connect_timeout=connect_timeout,
+                                           read_timeout=read_timeout,
+                                           retry_policy=RetryPolicy(query_retries),
+                                           circuit_breaker=CircuitBreaker(
+                                               circuit_failure_threshold, circuit_reset_timeout),
+                                           hedging=self.hedging_policy(hedge_percentile,
+                                                                       hedge_budget))
         queries_dir = Path(queries_dir)
         context_dir = Path(context_dir)
         default_dir = queries_dir / DEFAULT_DIR
@@ -94,33 +208,74 @@ class QueryManager:
             glogger.debug(query_name)
             glogger.debug(query_sparql)
 
-        try:
-            context_json = CONTEXT_FILE
-            context_class_json = CONTEXT_CLASS_FILE
-            temp_context = json.loads(
-                self.read_context(context_dir / context_json))[CONTEXT_KEY]
-            tmp_context_class = json.loads(
-                self.read_context(context_dir /
-                                  context_class_json))[CONTEXT_KEY]
-        except FileNotFoundError:
-            logging.error("The context file does not exists", exc_info=True)
-            exit(1)
-
-        try:
-            context_overwrite_json = CONTEXT_OVERWRITE_CLASS_FILE
-            context_overwrite_path = context_dir / context_overwrite_json
-            self.context_overwrite = json.loads(
-                self.read_context(context_overwrite_path))[CONTEXT_KEY]
-        except FileNotFoundError:
-            self.context_overwrite = {}
-
-        remove_jsonld_key(tmp_context_class, CONTEXT_TYPE_KEY)
-        remove_jsonld_key(tmp_context_class, CONTEXT_ID_KEY)
+        # Parse the templates once, the requests only replace the parameters
+        self.query_templates = self.load_query_templates(
+            [getattr(self, owl_class) for owl_class in os.listdir(queries_dir)])
+        self.check_list_templates({owl_class: getattr(self, owl_class)
+                                   for owl_class in os.listdir(queries_dir)},
+                                  reject_unbounded_templates)
+
+        self.context, self.class_context, self.context_overwrite = self.load_contexts(context_dir)
+        self.ntriples_serializer = NTriplesSerializer(self.context, self.uri_prefix)
+        self.frame_cache = LRUCache(frame_cache_size)
+        self.response_cache = ResponseCache(response_cache_size, response_cache_ttl,
+                                            response_cache_max_bytes, response_cache_stale_ttl)
+        self.count_cache = ResponseCache(count_cache_size, count_cache_ttl)
+        self.single_flight = SingleFlight(coalesce_queries)
+        self.batch_loader = BatchLoader(self.load_batch, batch_max_size, batch_wait)
+        # Graph -> time until which its queries are sent to the primary
+        self.read_your_writes_ttl = read_your_writes_ttl
+        self.pinned_graphs: Dict[str, float] = {}
+        self.pinned_graphs_lock = threading.Lock()
+        # The thread pools of the count queries (COUNT_EXECUTOR), of the prefetch of iter_resources
+        # (PREFETCH_EXECUTOR) and of the framing of AsyncQueryManager (FRAME_EXECUTOR), created on
+        # first use. Each one has its own threads: a long iteration does not delay the count
+        # queries
+        self.executor_workers = pool_maxsize
+        self.executors: Dict[str, ThreadPoolExecutor] = {}
+        self.executors_lock = threading.Lock()
+
+    def build_connector(self, **kwargs) -> SPARQLConnector:
+        """Return the connector to the endpoints of the QueryManager
 
-        self.context = temp_context.copy()
-        self.convert_snake_dict(temp_context)
-        self.context = {CONTEXT_KEY: self.context}
-        self.class_context = tmp_context_class.copy()
+        Args:
+            kwargs: the settings of the connection pool, the timeouts and the resilience policies
+                (see SPARQLConnector)
+        """
+        return SPARQLConnector(query_endpoint=self.query_endpoints,
+                               update_endpoint=self.update_endpoint,
+                               primary_query_endpoint=self.endpoint,
+                               auth=(self.endpoint_username,
+                                     self.endpoint_password),
+                               method="POST",
+                               returnFormat='json-ld',
+                               **kwargs)
+
+    def executor(self, name: str) -> ThreadPoolExecutor:
+        """Return the thread pool name (COUNT_EXECUTOR, PREFETCH_EXECUTOR or FRAME_EXECUTOR),
+        created on first use"""
+        with self.executors_lock:
+            executor = self.executors.get(name)
+            if executor is None:
+                executor = ThreadPoolExecutor(max_workers=self.executor_workers,
+                                              thread_name_prefix=f"obasparql-{name}")
+                self.executors[name] = executor
+            return executor
+
+    def close(self):
+        """Stop the thread pools and close the idle connections to the endpoint. The pools are
+        created again if the QueryManager is used after close"""
+        with self.executors_lock:
+            executors, self.executors = self.executors, {}
+        for executor in executors.values():
+            executor.shutdown(wait=False)
+        self.sparql.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
     def get_resource(self, **kwargs):
         """
@@ -148,9 +303,23 @@ class QueryManager:
                                                     **kwargs)
         return response
 
-    def put_resource(self, id, user, body, rdf_type_uri, rdf_type_name=None, kls=None):
+    def put_resource(self,
+                     id,
+                     user,
+                     body,
+                     rdf_type_uri,
+                     rdf_type_name=None,
+                     kls=None,
+                     single_request: bool = False,
+                     return_body: bool = False):
         """Handle a PUT method to update a resource
 
+        Args:
+            single_request (bool, optional): send the delete and the insert in one update request,
+                without reading the resource before. Defaults to False.
+            return_body (bool, optional): return the submitted body instead of reading the updated
+                resource. Defaults to False.
+
         Returns:
             dict: The response of the request as JSON format
         """
@@ -164,32 +333,37 @@ class QueryManager:
             raise HTTPException(
                 status_code=400, detail="Bad request: missing username") from err
 
-        response = self.get_resource(
-            id=id, username=username, rdf_type_uri=rdf_type_uri, rdf_type_name=rdf_type_name, kls=kls)
-        # DELETE QUERY
         request_args_delete: Dict[str, str] = {
             "resource": resource_uri,
             "g": self.generate_graph(username),
             "delete_incoming_relations": False
         }
-        self.run_query_delete(request_args_delete)
-
-        # INSERT QUERY
-        body_json = self.json_to_jsonld(body)
-        prefixes, triples = self.build_query_insert(body_json)
-        prefixes = '\n'.join(prefixes)
-        triples = '\n'.join(triples)
-
-        request_args: Dict[str, str] = {
-            "prefixes": prefixes,
-            "triples": triples,
-            "g": self.generate_graph(username)
-        }
-        try:
-            self.run_query_insert(request_args=request_args)
-        except Exception as err:
-            logger.error("Exception occurred", exc_info=True)
-            raise HTTPException(status_code=500, detail=str(err)) from err
+        if single_request:
+            # DELETE AND INSERT QUERY
+            request_args = self.build_insert_request_args(body, username)
+            try:
+                self.run_query_update(self.build_query_replace(request_args_delete, request_args))
+            finally:
+                self.record_write(username)
+        else:
+            response = self.get_resource(
+                id=id, username=username, rdf_type_uri=rdf_type_uri, rdf_type_name=rdf_type_name, kls=kls)
+            try:
+                # DELETE QUERY
+                self.run_query_delete(request_args_delete)
+
+                # INSERT QUERY
+                request_args = self.build_insert_request_args(body, username)
+                try:
+                    self.run_query_insert(request_args=request_args)
+                except Exception as err:
+                    logger.error("Exception occurred", exc_info=True)
+                    raise HTTPException(status_code=500, detail=str(err)) from err
+            finally:
+                self.record_write(username)
+
+        if return_body:
+            return self.submitted_body(body)
 
         # GET QUERY
         try:
@@ -201,6 +375,14 @@ class QueryManager:
             raise HTTPException(
                 status_code=500, detail="Error while retrieving the resource") from err
 
+    @staticmethod
+    def submitted_body(body: dict) -> dict:
+        """Return the body of a PUT request as the response, without the context added to insert
+        it"""
+        if '@context' in body:
+            del body['@context']
+        return body
+
     def delete_resource(self,
                         id: str,
                         user: str,
@@ -238,7 +420,10 @@ class QueryManager:
             logger.error("Error while retrieving the resource", exc_info=True)
             raise HTTPException(status_code=404, detail="Resource not found")
 
-        self.run_query_delete(request_args)
+        try:
+            self.run_query_delete(request_args)
+        finally:
+            self.record_write(user)
 
     def post_resource(self,
                       user,
@@ -253,16 +438,32 @@ class QueryManager:
             body: JSON to insert
             rdf_type_uri: RDF Class where to insert the target instance described in body.
         """
+        body = self.new_resource_body(body, rdf_type_uri)
+        try:
+            self.insert_resources(self.flatten_resources(body), user)
+        finally:
+            self.record_write(user)
+        if '@context' in body:
+            del body['@context']
+        return body
+
+    @staticmethod
+    def new_resource_body(body, rdf_type_uri: str) -> dict:
+        """Add the type and a new id to the body of a POST request
+
+        Args:
+            body: the resource to insert
+            rdf_type_uri (str): RDF Class of the resource
+
+        Returns:
+            dict: the resource as a dict
+        """
         if body.type and rdf_type_uri is not body.type:
             body.type.append(rdf_type_uri)
         else:
             body.type = [rdf_type_uri]
         body = body.dict()
         body[ID_KEY] = generate_new_id()
-        self.traverse_obj(body, user)
-        self.insert_all_resources(body, user)
-        if '@context' in body:
-            del body['@context']
         return body
 
     # Helper get methods
@@ -332,25 +533,331 @@ class QueryManager:
             username)
         skip_id_framing = True if SKIP_ID_FRAMING_KEY in kwargs and kwargs[
             SKIP_ID_FRAMING_KEY] else False
+        if not skip_id_framing and self.is_batched(owl_class_name, query_type, username):
+            return self.get_one_batched(owl_class_name, resource_type_uri, query_type,
+                                        request_args, username, kwargs[ID_KEY])
         return self.run_query_get(query_directory=owl_class_name,
                                   owl_class_uri=resource_type_uri,
                                   query_type=query_type,
                                   request_args=request_args,
                                   skip_id_framing=skip_id_framing)
 
+    def is_batched(self, owl_class_name: str, query_type: str, username: str) -> bool:
+        """Indicates if a get_one or get_one_user lookup is collected with the lookups of the same
+        class and graph: the batching is enabled, the query is the one of get_resources and the
+        template supports a VALUES block
+        """
+        if not self.batch_loader.enabled:
+            return False
+        if query_type != (QUERY_TYPE_GET_ONE_USER if username is not None else QUERY_TYPE_GET_ONE):
+            return False
+        return self.get_query_template(getattr(self, owl_class_name)[query_type]).supports_values
+
+    def get_one_batched(self, owl_class_name: str, owl_class_uri: str, query_type: str,
+                        request_args: dict, username: str, _id: str):
+        """Return a resource from the response cache, or request it with the lookups of the same
+        class and graph received within batch_wait seconds
+
+        Args:
+            owl_class_name (str): The class name of the resource
+            owl_class_uri (str): The uri of the class
+            query_type (str): QUERY_TYPE_GET_ONE or QUERY_TYPE_GET_ONE_USER
+            request_args (dict): The arguments of the get_one query
+            username (str): the user who owns the resource
+            _id (str): the resource id
+
+        Returns:
+            The framed resource, an empty dict if it does not exist
+        """
+        query_template = getattr(self, owl_class_name)[query_type]
+        cache_key = self.response_cache_key(query_template, owl_class_uri, request_args)
+        response, stale = self.get_cached_response(cache_key)
+        if response is not None and not stale:
+            return response
+        generation = self.response_cache.generation
+        resource = self.batch_loader.load((owl_class_name, owl_class_uri, username), _id)
+        return self.process_batched_resource(cache_key, resource, generation)
+
+    def load_batch(self, key: Tuple[str, str, str], ids: List[str]) -> Dict[str, dict]:
+        """Request a batch of lookups of get_one_batched with get_resources
+
+        Args:
+            key (Tuple[str, str, str]): the class name, the class uri and the user of the lookups
+            ids (List[str]): the resource ids
+        """
+        owl_class_name, owl_class_uri, username = key
+        return self.get_resources(ids, owl_class_uri, owl_class_name, username,
+                                  chunk_size=len(ids))
+
+    def process_batched_resource(self, cache_key: Hashable, resource, generation: int):
+        """Store a resource of a batch in the response cache and return it, an empty dict if it
+        does not exist (the framing of a get_one query without result)"""
+        if resource is None:
+            resource = {}
+        self.cache_response(cache_key, resource, generation)
+        return resource
+
+    def get_resources(self,
+                      ids: List[str],
+                      rdf_type_uri: str,
+                      rdf_type_name: str,
+                      username: str = None,
+                      chunk_size: int = IDS_CHUNK_SIZE) -> Dict[str, dict]:
+        """Handle a GET method to get many resources by id. The resources are obtained with one
+        query (and one framing) by chunk of ids, using the get_one or get_one_user template with a
+        VALUES block. The resources of a chunk that embed each other are requested again one by one
+        (see dependent_ids), so each resource is framed as get_one frames it.
+
+        Args:
+            ids (List[str]): the resource ids
+            rdf_type_uri (str): The rdf type uri of the resources
+            rdf_type_name (str): The class name of the resources
+            username (str, optional): the user who owns the resources. Defaults to None (get_one
+                query).
+            chunk_size (int, optional): the maximum number of ids by query. Defaults to 100.
+
+        Returns:
+            Dict[str, dict]: the resources indexed by id. The value is None if the resource does
+                not exist
+        """
+        resources = {}
+        queries = self.build_resources_queries(ids, rdf_type_name, username, chunk_size)
+        for chunk, query_template, request_args in queries:
+            try:
+                result = self.dispatch_sparql_query(raw_sparql_query=query_template,
+                                                    request_args=request_args)
+            except Exception as err:
+                raise self.query_exception(err, "Unable to send query") from err
+            chunk_resources = self.process_resources_result(result, rdf_type_uri, chunk)
+            resources.update(chunk_resources)
+            dependent = self.dependent_ids(chunk_resources) if len(chunk) > 1 else []
+            if dependent:
+                resources.update(self.get_resources(dependent, rdf_type_uri, rdf_type_name,
+                                                    username, chunk_size=1))
+        return resources
+
+    def build_resources_queries(self, ids: List[str], rdf_type_name: str, username: str,
+                                chunk_size: int):
+        """Split the ids in chunks and build the arguments of the query of each chunk.
+        If the template can not bind the resource to multiple values, each chunk contains one id.
+
+        Returns:
+            List[Tuple[List[str], str, dict]]: the ids, the template and the arguments of each
+                query
+        """
+        query_type = QUERY_TYPE_GET_ONE_USER if username is not None else QUERY_TYPE_GET_ONE
+        query_template = getattr(self, rdf_type_name)[query_type]
+        if not self.get_query_template(query_template).supports_values:
+            chunk_size = 1
+        ids = list(dict.fromkeys(ids))
+        queries = []
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            request_args = {SPARQL_GRAPH_TYPE_VARIABLE: self.generate_graph(username)}
+            if chunk_size == 1:
+                request_args[SPARQL_ID_TYPE_VARIABLE] = self.build_instance_uri(chunk[0])
+            else:
+                request_args[SPARQL_VALUES_KEY] = {
+                    SPARQL_ID_TYPE_VARIABLE: [self.build_instance_uri(_id) for _id in chunk]
+                }
+            queries.append((chunk, query_template, request_args))
+        return queries
+
+    def process_resources_result(self, result, owl_class_uri: str,
+                                 ids: List[str]) -> Dict[str, dict]:
+        """Frame the response of the endpoint to a query of many resources and index the resources
+        by id
+
+        Args:
+            result (bytes): The response of the endpoint
+            owl_class_uri (str): The uri of the class
+            ids (List[str]): the ids of the resources
+
+        Returns:
+            Dict[str, dict]: the resources indexed by id. The value is None if the resource does
+                not exist
+        """
+        uris = {self.build_instance_uri(_id): _id for _id in ids}
+        resources = dict.fromkeys(ids)
+        try:
+            framed = self.frame_results(result, owl_class_uri, list(uris))
+        except Exception as err:
+            raise HTTPException(
+                status_code=500, detail="Unable to frame the results") from err
+        if isinstance(framed, dict):
+            framed = [framed]
+        for resource in framed:
+            if resource.get(ID_KEY) in uris:
+                resources[uris[resource[ID_KEY]]] = resource
+        return resources
+
+    @staticmethod
+    def dependent_ids(resources: Dict[str, dict]) -> List[str]:
+        """Return the ids of the resources framed from one query whose framing may differ from the
+        framing of their own get_one query
+
+        The triples of a node depend on its depth in the query of a resource (e.g., the nested
+        resources only have their type and label). A node embedded at different depths by the
+        resources of the query, such as a requested resource nested in another one, is framed with
+        the triples of every depth: the resources that embed it are dependent.
+
+        Args:
+            resources (Dict[str, dict]): the framed resources indexed by id (None if the resource
+                does not exist)
+
+        Returns:
+            List[str]: the ids of the dependent resources
+        """
+        depths: Dict[str, set] = {}
+        nodes: Dict[str, set] = {}
+
+        def visit(value, depth: int, found: set):
+            if isinstance(value, list):
+                for item in value:
+                    visit(item, depth, found)
+            elif isinstance(value, dict):
+                if isinstance(value.get(ID_KEY), str):
+                    depths.setdefault(value[ID_KEY], set()).add(depth)
+                    found.add(value[ID_KEY])
+                for key, item in value.items():
+                    if key != ID_KEY:
+                        visit(item, depth + 1, found)
+
+        for _id, resource in resources.items():
+            if resource is not None:
+                visit(resource, 0, nodes.setdefault(_id, set()))
+        return [_id for _id, found in nodes.items() if any(len(depths[iri]) > 1 for iri in found)]
+
+    def iter_resources(self,
+                       rdf_type_uri: str,
+                       rdf_type_name: str,
+                       username: str = None,
+                       page_size: int = DEFAULT_PER_PAGE) -> Iterator[dict]:
+        """Yield the resources of a class one at a time, requesting them by pages of the get_all
+        (or get_all_user) template. The next page is requested in the background while the current
+        one is consumed, so about two pages are held in memory.
+
+        The pages follow a cursor if the template supports it (see QueryTemplate.supports_keyset),
+        and each resource is yielded once. Otherwise they follow the page number until a page is
+        empty, and the nested resources of the class can be yielded more than once. A template that
+        can not be paginated is one page.
+
+        Args:
+            rdf_type_uri (str): The rdf type uri of the resources
+            rdf_type_name (str): The class name of the resources
+            username (str, optional): the user who owns the resources. Defaults to None (get_all
+                query).
+            page_size (int, optional): the number of resources by query. Defaults to 100.
+
+        Yields:
+            dict: the framed resources
+        """
+        query_template, kwargs = self.iter_resources_kwargs(rdf_type_uri, rdf_type_name, username,
+                                                            page_size)
+        position = self.first_iter_position(query_template)
+        executor = self.executor(PREFETCH_EXECUTOR)
+        future = executor.submit(self.get_resource,
+                                 **self.iter_page_kwargs(kwargs, query_template, position))
+        try:
+            while future is not None:
+                page = future.result()
+                next_position = self.next_iter_position(page, query_template, position)
+                future = None
+                if next_position is not None:
+                    page_kwargs = self.iter_page_kwargs(kwargs, query_template, next_position)
+                    future = executor.submit(self.get_resource, **page_kwargs)
+                yield from self.iter_page_resources(page, query_template, position)
+                position = next_position
+        finally:
+            if future is not None:
+                future.cancel()
+
+    def iter_resources_kwargs(self, rdf_type_uri: str, rdf_type_name: str, username: str,
+                              page_size: int) -> Tuple[QueryTemplate, dict]:
+        """Return the get_all template of iter_resources and the arguments of get_resource common
+        to its pages"""
+        query_type = QUERY_TYPE_GET_ALL_USER if username is not None else QUERY_TYPE_GET_ALL
+        query_template = self.get_query_template(getattr(self, rdf_type_name)[query_type])
+        kwargs = {"rdf_type_uri": rdf_type_uri, "rdf_type_name": rdf_type_name,
+                  PER_PAGE_KEY: page_size}
+        if username is not None:
+            kwargs[USERNAME_KEY] = username
+        return query_template, kwargs
+
+    @staticmethod
+    def first_iter_position(query_template: QueryTemplate):
+        """The position of the first page of iter_resources: the empty cursor, or the page
+        number"""
+        return "" if query_template.supports_keyset else 1
+
+    @staticmethod
+    def iter_page_kwargs(kwargs: dict, query_template: QueryTemplate, position) -> dict:
+        """The arguments of get_resource for the page of iter_resources at position"""
+        if query_template.supports_keyset:
+            return dict(kwargs, **{CURSOR_KEY: position, HAS_NEXT_KEY: True})
+        return dict(kwargs, **{PAGE_KEY: position})
+
+    @staticmethod
+    def next_iter_position(page, query_template: QueryTemplate, position):
+        """The position of the page of iter_resources after page, None if page is the last one"""
+        if query_template.supports_keyset:
+            return page.next_cursor
+        if not query_template.bounded or not resource_list(page):
+            return None
+        return position + 1
+
+    @staticmethod
+    def iter_page_resources(page, query_template: QueryTemplate, position) -> list:
+        """The resources of a page of iter_resources. The resources of a cursor page up to the
+        cursor are nested resources that belong to a previous page"""
+        if not query_template.supports_keyset:
+            return resource_list(page)
+        after = decode_cursor(position)
+        return [resource for resource in page
+                if not (isinstance(resource.get(ID_KEY), str) and resource[ID_KEY] <= after)]
+
     def get_all_resource(self, request_args, query_type, **kwargs):
         """
         Handles a GET method to get all resource by rdf_type
         : param request_args: contains the values of the variables of the SPARQL query.
                              See SPARQL_QUERY_TYPE_VARIABLE and SPARQL_GRAPH_TYPE_VARIABLE
-        : param query_type: QUERY_TYPE_GET_ALL or QUERY_TYPE_GET_ALL_USER
-        : param kwargs:
+        : param query_type: QUERY_TYPE_GET_ALL or QUERY_TYPE_GET_ALL_USER : param kwargs: with a
+        cursor (CURSOR_KEY), the page continues after the last resource of the previous
+                        page (keyset pagination) and the response is a ResourcePage. The empty
+                        cursor is the first page. With count (COUNT_KEY), the response is a
+                        ResourcePage with the total number of resources. With has_next
+                        (HAS_NEXT_KEY), the query selects one more resource to know if there is a
+                        next page, with a cursor or with the page number. The pages of both kinds
+                        are ordered by IRI
         : type kwargs:
         : return:
         : rtype:
         """
         owl_class_name, resource_type_uri, username = self.parse_request_arguments(
             **kwargs)
+        query_template = self.get_query_template(getattr(self, owl_class_name)[query_type])
+        if kwargs.get(COUNT_KEY):
+            if query_template.count_template is None:
+                raise HTTPException(status_code=400,
+                                    detail="Bad request: the query does not support the count")
+            request_args[COUNT_KEY] = True
+        if kwargs.get(CURSOR_KEY) is not None:
+            if not query_template.supports_keyset:
+                raise HTTPException(status_code=400,
+                                    detail="Bad request: the query does not support cursors")
+            try:
+                request_args[SPARQL_AFTER_KEY] = decode_cursor(kwargs[CURSOR_KEY])
+            except ValueError as err:
+                raise HTTPException(status_code=400, detail="Bad request: invalid cursor") from err
+            request_args.setdefault(PER_PAGE_KEY, query_template.limit)
+        if kwargs.get(HAS_NEXT_KEY):
+            if not query_template.supports_keyset:
+                raise HTTPException(status_code=400,
+                                    detail="Bad request: the query does not support has_next")
+            if kwargs.get(CURSOR_KEY) is None:
+                request_args.setdefault(PER_PAGE_KEY, query_template.limit)
+                request_args.setdefault(PAGE_KEY, 1)
+            request_args[SPARQL_LOOKAHEAD_KEY] = 1
         request_args[SPARQL_QUERY_TYPE_VARIABLE] = resource_type_uri
         request_args[SPARQL_GRAPH_TYPE_VARIABLE] = self.generate_graph(
             username)
@@ -383,16 +890,350 @@ class QueryManager:
             [type]: [description]
         """
         query_template = getattr(self, query_directory)[query_type]
-        if PAGE_KEY in request_args and PER_PAGE_KEY in request_args:
-            request_args["offset"] = (request_args[PAGE_KEY] -
-                                      1) * request_args[PER_PAGE_KEY]
+        self.add_offset(request_args)
+        count = None
+        if request_args.get(COUNT_KEY):
+            count = self.executor(COUNT_EXECUTOR).submit(self.count_resources, query_template,
+                                                         dict(request_args))
+        response = self.get_response(query_template, owl_class_uri, request_args, skip_id_framing)
+        total = count.result() if count is not None else None
+        return self.build_resource_page(response, request_args, total)
+
+    def get_response(self, query_template: str, owl_class_uri: str, request_args: dict,
+                     skip_id_framing=False):
+        """Return the framed response of a GET query from the response cache, or send the query
+
+        Args:
+            query_template (str): The query template
+            owl_class_uri (str): The uri of the class
+            request_args (dict): The arguments of the query
+            skip_id_framing (bool, optional): Indicates if the id framing must be skipped. Defaults to False.
+
+        Returns:
+            The framed resources
+        """
+        key = self.response_key(query_template, owl_class_uri, request_args, skip_id_framing)
+        cache_key = key if self.response_cache.enabled else None
+        response, stale = self.get_cached_response(cache_key)
+        if response is None:
+            # The identical queries in progress are awaited instead of being sent again
+            response = self.single_flight.do(
+                self.flight_key(key, request_args),
+                lambda: self.fetch_response(cache_key, query_template, owl_class_uri, request_args,
+                                            skip_id_framing))
+        elif stale and self.response_cache.start_refresh(cache_key):
+            threading.Thread(target=self.refresh_response,
+                             args=(cache_key, query_template, owl_class_uri, dict(request_args),
+                                   skip_id_framing),
+                             daemon=True).start()
+        return response
+
+    @staticmethod
+    def build_resource_page(response, request_args: dict, total: int = None):
+        """Return the framed resources of a keyset query as a ResourcePage with the cursor of the
+        next page, the framed resources of a page with has_next as a ResourcePage without the
+        resource selected after the page, and the framed resources of a query with the count option
+        as a ResourcePage with the total. The other responses are returned as they are
+
+        Args:
+            response: the framed resources
+            request_args (dict): The arguments of the query
+            total (int, optional): the total number of resources. Defaults to None.
+
+        Returns:
+            The framed resources
+        """
+        if SPARQL_AFTER_KEY in request_args:
+            page = build_page(response, ID_KEY, request_args[SPARQL_AFTER_KEY],
+                              int(request_args[PER_PAGE_KEY]),
+                              request_args.get(SPARQL_LOOKAHEAD_KEY, 0))
+        elif request_args.get(SPARQL_LOOKAHEAD_KEY):
+            # The page number has no cursor: the page starts with the first resource of the
+            # response
+            page = build_page(response, ID_KEY, "", int(request_args[PER_PAGE_KEY]),
+                              request_args[SPARQL_LOOKAHEAD_KEY])
+            page.next_cursor = None
+        elif total is not None:
+            page = ResourcePage(resource_list(response))
+        else:
+            return response
+        page.total = total
+        return page
+
+    def count_resources(self, query_template: str, request_args: dict) -> int:
+        """Return the total number of items selected by a get_all query, from the count cache or
+        with the count query derived from the template (see QueryTemplate.count_template)
+
+        Args:
+            query_template (str): The query template
+            request_args (dict): The arguments of the query
+
+        Returns:
+            int: the number of items of every page
+        """
+        cache_key, count_query = self.count_query(query_template, request_args)
+        total = self.count_cache.get(cache_key)
+        if total is not None:
+            return total
+        generation = self.count_cache.generation
+        logger.info(count_query)
+        try:
+            result = self.sparql.query(count_query, return_format="json",
+                                       primary=self.reads_from_primary(request_args))
+        except Exception as err:
+            raise self.query_exception(err, "Unable to count the resources") from err
+        total = self.process_count_result(result)
+        self.count_cache.put(cache_key, total, graph=cache_key[1], generation=generation)
+        return total
+
+    def count_query(self, raw_sparql_query: str, request_args: dict) -> Tuple[Hashable, str]:
+        """Rewrite the count query of a template
+
+        Args:
+            raw_sparql_query (str): the raw query
+            request_args (dict): The arguments of the query
+
+        Returns:
+            Tuple[Hashable, str]: the key of the total in the count cache (the count query and the
+                named graph, None if the template reads every graph) and the count query
+        """
+        count_template = self.get_query_template(raw_sparql_query).count_template
+        count_query = count_template.rewrite(request_args)
+        graph = None
+        if SPARQL_GRAPH_TYPE_VARIABLE in count_template.parameters:
+            graph = request_args.get(SPARQL_GRAPH_TYPE_VARIABLE)
+        return (count_query, graph), count_query
+
+    @staticmethod
+    def process_count_result(result) -> int:
+        """Read the total of the SPARQL JSON results of a count query
+
+        Args:
+            result (bytes): The response of the endpoint
+
+        Returns:
+            int: the total
+        """
+        try:
+            bindings = json.loads(result)["results"]["bindings"]
+            return int(bindings[0][SPARQL_COUNT_VARIABLE]["value"])
+        except (TypeError, ValueError, KeyError, IndexError) as err:
+            logger.error("Unable to read the count: %s", result)
+            raise HTTPException(status_code=500, detail="Unable to count the resources") from err
+
+    def fetch_response(self, cache_key: Hashable, query_template: str, owl_class_uri: str,
+                       request_args: dict, skip_id_framing=False):
+        """Send the GET query, frame the response and store it in the response cache
+
+        Args:
+            cache_key (Hashable): the key returned by response_cache_key
+            query_template (str): The query template
+            owl_class_uri (str): The uri of the class
+            request_args (dict): The arguments of the query
+            skip_id_framing (bool, optional): Indicates if the id framing must be skipped. Defaults to False.
+
+        Returns:
+            The framed resources
+        """
+        generation = self.response_cache.generation
         try:
             result = self.dispatch_sparql_query(
-                raw_sparql_query=query_template, request_args=request_args)
+                raw_sparql_query=query_template, request_args=request_args, stream=True)
         except Exception as err:
-            logger.error("Unable to send query: %s", err)
-            raise HTTPException(status_code=500, detail="Unable to send query") from err
+            raise self.query_exception(err, "Unable to send query") from err
+
+        try:
+            # The response is parsed as its chunks are received
+            response = self.process_query_get_result(result, owl_class_uri, request_args,
+                                                     skip_id_framing)
+        finally:
+            if isinstance(result, StreamedResponse):
+                result.close()
+        self.cache_response(cache_key, response, generation)
+        return response
+
+    def refresh_response(self, cache_key: Hashable, query_template: str, owl_class_uri: str,
+                         request_args: dict, skip_id_framing=False):
+        """Replace a stale cached response. Run in the background by run_query_get, see
+        fetch_response"""
+        try:
+            self.fetch_response(cache_key, query_template, owl_class_uri, request_args,
+                                skip_id_framing)
+        except Exception:
+            logger.warning("Unable to refresh the cached response", exc_info=True)
+        finally:
+            self.response_cache.end_refresh(cache_key)
+
+    def response_cache_key(self, raw_sparql_query: str, owl_class_uri: str, request_args: dict,
+                           skip_id_framing=False) -> Union[Hashable, None]:
+        """Key of the framed response of a GET query in the response cache: the rewritten query,
+        the named graph (None if the template reads every graph) and the framing of the response
+
+        Returns:
+            Union[Hashable, None]: the key, None if the cache is disabled or the query can not be
+                rewritten
+        """
+        if not self.response_cache.enabled:
+            return None
+        return self.response_key(raw_sparql_query, owl_class_uri, request_args, skip_id_framing)
+
+    def response_key(self, raw_sparql_query: str, owl_class_uri: str, request_args: dict,
+                     skip_id_framing=False) -> Union[Hashable, None]:
+        """Key of the framed response of a GET query, see response_cache_key. Used by the response
+        cache and the coalescing of the identical queries
+
+        Returns:
+            Union[Hashable, None]: the key, None if both are disabled or the query can not be
+                rewritten
+        """
+        if not self.response_cache.enabled and not self.single_flight.enabled:
+            return None
+        query_template = self.get_query_template(raw_sparql_query)
+        try:
+            rewritten_query = query_template.rewrite(request_args)
+        except Exception:
+            return None
+        graph = None
+        if SPARQL_GRAPH_TYPE_VARIABLE in query_template.parameters:
+            graph = request_args.get(SPARQL_GRAPH_TYPE_VARIABLE)
+        resource = None if skip_id_framing else request_args.get("resource")
+        if isinstance(resource, list):
+            resource = tuple(resource)
+        return rewritten_query, graph, owl_class_uri, resource
+
+    def flight_key(self, key: Hashable, request_args: dict) -> Union[Hashable, None]:
+        """Key of the coalescing of a GET query: the key of its response and whether it is read
+        from the primary
+
+        Args:
+            key (Hashable): the key returned by response_key
+            request_args (dict): The arguments of the query
+        """
+        if key is None:
+            return None
+        return key, self.reads_from_primary(request_args)
+
+    def get_cached_response(self, cache_key: Hashable) -> Tuple[object, bool]:
+        """Return a copy of the cached framed response
+
+        Args:
+            cache_key (Hashable): the key returned by response_cache_key
+
+        Returns:
+            Tuple[object, bool]: the framed response (None if it is not cached) and True if it has
+                expired but it is still within the stale TTL
+        """
+        if cache_key is None:
+            return None, False
+        response, stale = self.response_cache.lookup(cache_key)
+        if response is None:
+            return None, False
+        return json.loads(response), stale
+
+    def cache_response(self, cache_key: Hashable, response, generation: int):
+        """Store the framed response serialized to JSON, so each hit returns a new copy
+
+        Args:
+            cache_key (Hashable): the key returned by response_cache_key
+            response: the framed response
+            generation (int): the generation of the cache before sending the query
+        """
+        if cache_key is None:
+            return
+        serialized = json.dumps(response)
+        self.response_cache.put(cache_key, serialized, graph=cache_key[1], size=len(serialized),
+                                generation=generation)
+
+    @staticmethod
+    def hedging_policy(hedge_percentile: float, hedge_budget: float) -> Union[HedgingPolicy, None]:
+        """The hedging policy of the queries, None if hedge_percentile is None"""
+        if hedge_percentile is None:
+            return None
+        return HedgingPolicy(percentile=hedge_percentile, budget=hedge_budget)
+
+    def record_write(self, username: str):
+        """Remove the cached responses of the graph of a user and send its queries to the primary
+        during read_your_writes_ttl seconds, as the replicas may not have the write yet
 
+        Args:
+            username (str): the user whose graph was modified
+        """
+        self.invalidate_response_cache(username)
+        # The queries in progress may have been sent before the write
+        self.single_flight.invalidate()
+        if self.read_your_writes_ttl <= 0:
+            return
+        now = time.monotonic()
+        with self.pinned_graphs_lock:
+            for graph in [graph for graph, until in self.pinned_graphs.items() if until <= now]:
+                del self.pinned_graphs[graph]
+            self.pinned_graphs[self.generate_graph(username)] = now + self.read_your_writes_ttl
+
+    def reads_from_primary(self, request_args: dict) -> bool:
+        """Indicates if the query must be sent to the primary: its graph has been written recently
+
+        Args:
+            request_args (dict): The arguments of the query
+        """
+        if not self.pinned_graphs:
+            return False
+        with self.pinned_graphs_lock:
+            until = self.pinned_graphs.get(request_args.get(SPARQL_GRAPH_TYPE_VARIABLE))
+        return until is not None and until > time.monotonic()
+
+    @staticmethod
+    def query_exception(error: Exception, detail: str) -> HTTPException:
+        """The HTTPException of a query that failed: 503 if the circuit breaker rejected it, else
+        500
+
+        Args:
+            error (Exception): the error of the query
+            detail (str): the detail of the 500 response
+        """
+        logger.error("Unable to send query: %s", error)
+        if isinstance(error, CircuitOpenError):
+            return HTTPException(status_code=503, detail="The SPARQL endpoint is unavailable")
+        return HTTPException(status_code=500, detail=detail)
+
+    def invalidate_response_cache(self, username: str):
+        """Remove the cached responses and totals of the graph of a user, and the ones of every
+        graph
+
+        Args:
+            username (str): the user whose graph was modified
+        """
+        graph = self.generate_graph(username)
+        if self.response_cache.enabled:
+            removed = self.response_cache.invalidate_graph(graph)
+            logger.debug("Removed %s cached responses of %s", removed, username)
+        if self.count_cache.enabled:
+            removed = self.count_cache.invalidate_graph(graph)
+            logger.debug("Removed %s cached totals of %s", removed, username)
+
+    @staticmethod
+    def add_offset(request_args: dict):
+        """Compute the offset of the query from the page and the number of items per page
+
+        Args:
+            request_args (dict): The arguments of the query
+        """
+        if PAGE_KEY in request_args and PER_PAGE_KEY in request_args:
+            request_args["offset"] = (request_args[PAGE_KEY] -
+                                      1) * request_args[PER_PAGE_KEY]
+
+    def process_query_get_result(self, result, owl_class_uri: str, request_args: dict,
+                                 skip_id_framing=False):
+        """Frame the response of the endpoint to a GET query
+
+        Args:
+            result (bytes): The response of the endpoint
+            owl_class_uri (str): The uri of the class
+            request_args (dict): The arguments of the query
+            skip_id_framing (bool, optional): Indicates if the id framing must be skipped. Defaults to False.
+
+        Returns:
+            The framed resources
+        """
         logger.debug("response: %s", result)
         if result is None:
             raise HTTPException(status_code=404, detail="Resource not found")
@@ -417,21 +1258,29 @@ class QueryManager:
                 endpoint_context[key] = value
 
     def frame_results(self,
-                      response: str,
+                      response: Union[str, bytes, Iterable[bytes]],
                       owl_class_uri: str,
-                      owl_resource_iri: str = None):
+                      owl_resource_iri: Union[str, List[str]] = None):
         """Frame the results of the query
 
         Args:
-            response (str): The response from the endpoint. The format is JSON-LD
+            response (Union[str, bytes, Iterable[bytes]]): The response from the endpoint. The
+                format is JSON-LD. The chunks of a streamed response are parsed as they are read,
+                see JSONLDStreamParser
             owl_class_uri (str): The uri of the class
-            owl_resource_iri (str, optional): The resource uri. Defaults to None.
+            owl_resource_iri (Union[str, List[str]], optional): The resource uri or a list of uris.
+                Defaults to None.
 
         Returns:
             [type]: [description]
         """
         try:
-            response_dict = json.loads(response)
+            if isinstance(response, dict):
+                response_dict = response
+            elif is_stream(response):
+                response_dict = parse_stream(response)
+            else:
+                response_dict = json.loads(response)
         except Exception as exception:
             logger.error("json serialize failed", exc_info=True)
             raise exception
@@ -451,27 +1300,29 @@ class QueryManager:
         else:
             response_graph = response_dict
 
-        frame = {"@context": response_context, "@type": owl_class_uri}
+        # The frame only depends on the class and the context returned by the endpoint
+        frame_key = (owl_class_uri, fingerprint(response_context))
+        cached_frame = self.frame_cache.get(frame_key)
+        if cached_frame is None:
+            response_context, frame = self.build_frame(response_context, owl_class_uri)
+            cached_frame = response_context, frame, Framer(response_context, frame)
+            self.frame_cache.put(frame_key, cached_frame)
+        response_context, frame, framer = cached_frame
+        if '@context' in response_graph:
+            response_graph['@context'] = response_context
         # if owl_resource_iri is set, the user is requesting a specific resource and we must add it to the frame
         if owl_resource_iri is not None:
+            frame = dict(frame)
             frame['@id'] = owl_resource_iri
-        frame["@context"][ID_KEY] = "@id"
-
-        # we must force that the type is a list
-        frame["@context"]["type"] = {"@container": "@set", "@id": "@type"}
-        # we must force that all the properties are lists
-        for prop in frame["@context"].keys():
-            if isinstance(frame["@context"][prop], dict):
-                frame["@context"][prop]["@container"] = "@set"
 
         # TODO: I don't know why but the following line is needed to avoid the error:
         if 'id' in response_graph:
             del response_graph[ID_KEY]
 
-        # Context (returned by the endpoint) does not contain information about the classes
-        # so we must add it to the frame
-        self.overwrite_endpoint_context(frame["@context"])
-        frame["@context"] = {**self.class_context, **frame["@context"]}
+        try:
+            return framer.frame(response_graph, owl_resource_iri)
+        except UnsupportedJSONLD as error:
+            logger.debug("Framing the results with pyld: %s", error)
 
         framed = jsonld.frame(
             {
@@ -486,60 +1337,70 @@ class QueryManager:
                 del framed['@context']
             return framed
 
+    def build_frame(self, response_context: dict, owl_class_uri: str) -> Tuple[dict, dict]:
+        """Build the frame of the resources of a class. The frames are cached by frame_results:
+        the frame and the context must not be modified
+
+        Args:
+            response_context (dict): The context returned by the endpoint. It is modified
+            owl_class_uri (str): The uri of the class
+
+        Returns:
+            Tuple[dict, dict]: the context of the response and the frame
+        """
+        frame = {"@context": response_context, "@type": owl_class_uri}
+        frame["@context"][ID_KEY] = "@id"
+
+        # we must force that the type is a list
+        frame["@context"]["type"] = {"@container": "@set", "@id": "@type"}
+        # we must force that all the properties are lists
+        for prop in frame["@context"].keys():
+            if isinstance(frame["@context"][prop], dict):
+                frame["@context"][prop]["@container"] = "@set"
+
+        # Context (returned by the endpoint) does not contain information about the classes
+        # so we must add it to the frame
+        self.overwrite_endpoint_context(frame["@context"])
+        frame["@context"] = {**self.class_context, **frame["@context"]}
+        return response_context, frame
+
     # UPDATE METHODS
 
-    def traverse_obj(self, body, username):
-        '''
-        Utils method to insert nested resources
-        Parameters
-        ----------
-        body : JSON with the resource (and nested resources) to insert
-        username : named graph where to insert the resource
+    def flatten_resources(self, body: dict) -> List[dict]:
+        """Flatten a resource and its nested resources (recursive) in one pass. The nested objects
+        without id get a new id and are replaced by a reference to their id: the flattened nodes
+        describe the same triples as the resource with the nested objects embedded. The nested
+        dicts stay embedded (a nested dict without id is a blank node).
 
-        Returns
-        -------
+        Args:
+            body (dict): the resource to insert
 
-        '''
-        for key, value in body.items():
-            if key != "openapi_types" and key != "attribute_map":
-                if isinstance(value, list):
-                    for inner_values in value:
-                        if not (isinstance(inner_values, primitives.__args__)
-                                or isinstance(inner_values, dict)):
-                            list_of_obj = self.get_all_complex_objects(
-                                inner_values)
-                            if len(list_of_obj) != 0:
-                                self.traverse_obj(inner_values, username)
-
-                            if inner_values.id is None:
-                                inner_values.id = generate_new_id()
-                                self.insert_all_resources(
-                                    inner_values, username)
-                elif isinstance(value, dict):
-                    pass
-
-    def get_all_complex_objects(self, body: dict) -> list:
-        """Get all the complex objects in a dictionary (recursive)
-        A complex object is an object that has an id and a type
-
-        Args:
-            body (dict): The dictionary to be traversed
-
-        Returns:
-            list: a list of complex objects
-        """
-        l = []
-        for key, value in body.__dict__.items():
-            if key != "openapi_types" and key != "attribute_map":
-                if isinstance(value, list):
-                    for inner_values in value:
-                        if not isinstance(inner_values,
-                                          str) and not isinstance(
-                                              inner_values, dict):
-                            l.append(inner_values)
-                elif isinstance(value, dict):
-                    pass
-        return l
+        Returns:
+            List[dict]: the nodes of the JSON-LD graph. The resource is the last one
+        """
+        nodes = []
+
+        def flatten_value(value):
+            if isinstance(value, list):
+                return [flatten_value(inner_value) for inner_value in value]
+            if value is None or isinstance(value, primitives.__args__):
+                return value
+            if isinstance(value, dict):
+                return flatten_dict(value)
+            if value.id is None:
+                value.id = generate_new_id()
+            # The nested object keeps its id, the node and the reference use its URI
+            uri = self.build_instance_uri(value.id)
+            nodes.append(dict(flatten_dict(value.dict()), **{ID_KEY: uri}))
+            return {ID_KEY: uri}
+
+        def flatten_dict(resource: dict) -> dict:
+            return {key: flatten_value(value) for key, value in resource.items()
+                    if key != "openapi_types" and key != "attribute_map"}
+
+        body[ID_KEY] = self.build_instance_uri(body[ID_KEY])
+        nodes.append(flatten_dict(body))
+        return nodes
 
     def json_to_jsonld(self, resource: dict) -> dict:
         """Convert a JSON to JSON-LD (recursive). Used by POST and PUT
@@ -552,10 +1413,54 @@ class QueryManager:
         """
         resource_dict = resource
         resource_dict["id"] = self.build_instance_uri(resource_dict["id"])
-        resource_dict['@context'] = self.context
+        resource_dict['@context'] = self.trim_context([resource_dict])
         resource_json = json.dumps(resource_dict)
         return resource_json
 
+    def trim_context(self, nodes: List[dict]) -> dict:
+        """Build a context with only the terms that can be used by the resources: the keys and the
+        values of the resources that are terms or prefixes of compact IRIs, and the terms used by
+        their definitions. The resources have the same triples with the trimmed context and with
+        the whole context
+
+        Args:
+            nodes (List[dict]): the resources
+
+        Returns:
+            dict: the context
+        """
+        context = self.context[CONTEXT_KEY]
+        names = set()
+        pending = list(nodes)
+        while pending:
+            value = pending.pop()
+            if isinstance(value, dict):
+                pending.extend(value.keys())
+                pending.extend(value.values())
+            elif isinstance(value, list):
+                pending.extend(value)
+            elif isinstance(value, str):
+                names.add(value)
+                names.add(value.split(':', 1)[0])
+
+        trimmed = {name: definition for name, definition in context.items()
+                   if name.startswith('@')}
+        pending = [name for name in names if name in context]
+        while pending:
+            name = pending.pop()
+            if name in trimmed:
+                continue
+            definition = trimmed[name] = context[name]
+            if isinstance(definition, dict):
+                references = [definition.get('@id'), definition.get('@type')]
+            else:
+                references = [definition]
+            for reference in references:
+                if isinstance(reference, str):
+                    pending.extend(term for term in (reference, reference.split(':', 1)[0])
+                                   if term in context)
+        return {CONTEXT_KEY: trimmed}
+
     # RUN QUERY METHODS
 
     def run_query_insert(self, request_args: dict):
@@ -565,9 +1470,7 @@ class QueryManager:
             request_args (dict): The request arguments (from the request)
 
         """
-        query_string = f'{request_args["prefixes"]}' \
-            f'INSERT DATA {{ GRAPH <{request_args["g"]}> ' \
-            f'{{ {request_args["triples"]} }} }}'
+        query_string = self.build_query_insert_data(request_args)
         try:
             self.sparql.update(query_string)
         except Exception as err:
@@ -575,6 +1478,73 @@ class QueryManager:
             logger.error(query_string)
             raise err
 
+    @staticmethod
+    def build_query_insert_data(request_args: dict) -> str:
+        """Build the INSERT DATA query
+
+        Args:
+            request_args (dict): The prefixes, the triples and the graph (see
+                build_insert_request_args)
+
+        Returns:
+            str: the query
+        """
+        return f'{request_args["prefixes"]}' \
+            f'INSERT DATA {{ GRAPH <{request_args["g"]}> ' \
+            f'{{ {request_args["triples"]} }} }}'
+
+    @staticmethod
+    def build_queries_delete(request_args: dict) -> List[str]:
+        """Build the DELETE queries of a resource
+
+        Args:
+            request_args (dict): The resource, the graph and if the incoming relations must be
+                deleted
+
+        Returns:
+            List[str]: the queries
+        """
+        queries = [f'' \
+            f'DELETE WHERE {{ GRAPH <{request_args["g"]}> ' \
+            f'{{ <{request_args["resource"]}> ?p ?o . }} }}']
+        if request_args["delete_incoming_relations"]:
+            queries.append(f'' \
+                f'DELETE WHERE {{ GRAPH <{request_args["g"]}> ' \
+                f'{{ ?s ?p <{request_args["resource"]}>  }} }}')
+        return queries
+
+    @staticmethod
+    def build_query_replace(request_args_delete: dict, request_args_insert: dict) -> str:
+        """Build one update request that deletes a resource and inserts its new version
+
+        Args:
+            request_args_delete (dict): The arguments of the delete queries (see
+                build_queries_delete)
+            request_args_insert (dict): The arguments of the insert query (see
+                build_insert_request_args)
+
+        Returns:
+            str: the update request
+        """
+        operations = QueryManager.build_queries_delete(request_args_delete)
+        operations.append(QueryManager.build_query_insert_data(dict(request_args_insert,
+                                                                    prefixes="")))
+        return f'{request_args_insert["prefixes"]}\n' + ' ;\n'.join(operations)
+
+    def run_query_update(self, query_string: str):
+        """Send an update request
+
+        Args:
+            query_string (str): The update request
+        """
+        try:
+            logger.debug("updating: %s", query_string)
+            self.sparql.update(query_string)
+        except Exception as exception:
+            logger.error("Exception occurred", exc_info=True)
+            logger.error(query_string)
+            raise HTTPException(status_code=500, detail=str(exception)) from exception
+
     def run_query_delete(self, request_args: str):
         """Delete a resource
 
@@ -584,9 +1554,7 @@ class QueryManager:
         Returns:
             [type]: A tuple (message, http_code, response)
         """
-        query_string = f'' \
-            f'DELETE WHERE {{ GRAPH <{request_args["g"]}> ' \
-            f'{{ <{request_args["resource"]}> ?p ?o . }} }}'
+        query_string, *query_string_reverse = self.build_queries_delete(request_args)
         try:
             logger.info("deleting %s", request_args["resource"])
             logger.debug("deleting: %s", query_string)
@@ -595,19 +1563,34 @@ class QueryManager:
             logger.error("Exception occurred", exc_info=True)
             raise HTTPException(status_code=500, detail=str(exception)) from exception
 
-        if request_args["delete_incoming_relations"]:
-            query_string_reverse = f'' \
-                f'DELETE WHERE {{ GRAPH <{request_args["g"]}> ' \
-                f'{{ ?s ?p <{request_args["resource"]}>  }} }}'
+        if query_string_reverse:
             try:
                 logger.info("deleting incoming relations %s", request_args["resource"])
-                logger.debug("deleting: %s", query_string_reverse)
-                self.sparql.update(query_string_reverse)
+                logger.debug("deleting: %s", query_string_reverse[0])
+                self.sparql.update(query_string_reverse[0])
             except Exception as exception:
                 logger.error("Exception occurred", exc_info=True)
                 raise HTTPException(
                     status_code=500, detail=str(exception)) from exception
 
+    def serialize_resources(self, nodes: List[dict]) -> Tuple[List[str], List[str]]:
+        """Convert the resources to the prefixes and the triples to be inserted. The resources are
+        serialized to N-Triples by the NTriplesSerializer. The resources that use JSON-LD features
+        not supported by the serializer are converted by rdflib (see build_query_insert)
+
+        Args:
+            nodes (List[dict]): the resources, with the full URI as id
+
+        Returns:
+            Tuple[List[str], List[str]]: the prefixes and the triples
+        """
+        try:
+            return [], self.ntriples_serializer.serialize(nodes)
+        except UnsupportedJSONLD as err:
+            logger.debug("Converting the resources with rdflib: %s", err)
+            return self.build_query_insert(json.dumps({'@context': self.trim_context(nodes),
+                                                       '@graph': nodes}))
+
     def build_query_insert(self, resource_json: str):
         """Convert the JSON-LD to triple to be inserted"""
         prefixes = []
@@ -697,17 +1680,174 @@ class QueryManager:
                     queries[key_name] = reader.read()
         return queries
 
-    def insert_all_resources(self, body, username):
-        body_json = self.json_to_jsonld(body)
-        prefixes, triples = self.build_query_insert(body_json)
+    def load_query_templates(self, queries_list: List[Dict[str, str]]) -> Dict[str, QueryTemplate]:
+        """Compile the query templates. If the artifact cache is enabled, the templates are
+        compiled only if the cache does not contain them
+
+        Args:
+            queries_list (List[Dict[str, str]]): the queries returned by read_template
+
+        Returns:
+            Dict[str, QueryTemplate]: the compiled templates indexed by the text of the query
+        """
+        sources = sorted(set(query_sparql for queries in queries_list
+                             for query_sparql in queries.values()))
+        if self.artifact_cache is not None:
+            key = ArtifactCache.key(*sources)
+            query_templates = self.artifact_cache.load("templates", key)
+            if query_templates is not None:
+                return query_templates
+
+        query_templates = {query_sparql: QueryTemplate(query_sparql, self.endpoint)
+                           for query_sparql in sources}
+        if self.artifact_cache is not None:
+            self.artifact_cache.store("templates", key, query_templates)
+        return query_templates
+
+    def check_list_templates(self, queries_by_class: Dict[str, Dict[str, str]],
+                             reject_unbounded: bool = False):
+        """Check that the number of items selected by the get_all templates is limited (see
+        QueryTemplate.bounded)
+
+        Args:
+            queries_by_class (Dict[str, Dict[str, str]]): the queries returned by read_template,
+                indexed by class
+            reject_unbounded (bool, optional): raise an error instead of logging a warning.
+                Defaults to False.
+
+        Raises:
+            ValueError: a get_all template can not be paginated and reject_unbounded is True
+        """
+        unbounded = sorted(f"{owl_class}/{query_name}"
+                           for owl_class, queries in queries_by_class.items()
+                           for query_name, query_sparql in queries.items()
+                           if query_name.startswith(QUERY_TYPE_GET_ALL)
+                           and not self.get_query_template(query_sparql).bounded)
+        if not unbounded:
+            return
+        message = f"The templates {', '.join(unbounded)} return all the items: the items must " \
+                  "be selected by a subquery of one variable (e.g., SELECT DISTINCT ?item) or " \
+                  "limited with LIMIT"
+        if reject_unbounded:
+            raise ValueError(message)
+        logger.warning(message)
+
+    def load_contexts(self, context_dir: Path) -> Tuple[dict, dict, dict]:
+        """Read and process the context files. If the artifact cache is enabled, the contexts are
+        processed only if the cache does not contain them
+
+        Args:
+            context_dir (Path): the directory where the context are
+
+        Returns:
+            Tuple[dict, dict, dict]: the context (with the snake_case keys), the class context and
+                the overwrite context
+        """
+        try:
+            context_source = self.read_context(context_dir / CONTEXT_FILE)
+            context_class_source = self.read_context(context_dir / CONTEXT_CLASS_FILE)
+        except FileNotFoundError:
+            logging.error("The context file does not exists", exc_info=True)
+            exit(1)
+
+        try:
+            context_overwrite_source = self.read_context(context_dir /
+                                                         CONTEXT_OVERWRITE_CLASS_FILE)
+        except FileNotFoundError:
+            context_overwrite_source = None
+
+        if self.artifact_cache is not None:
+            key = ArtifactCache.key(context_source, context_class_source, context_overwrite_source)
+            contexts = self.artifact_cache.load("contexts", key)
+            if contexts is not None:
+                return contexts
+
+        temp_context = json.loads(context_source)[CONTEXT_KEY]
+        tmp_context_class = json.loads(context_class_source)[CONTEXT_KEY]
+        if context_overwrite_source is not None:
+            context_overwrite = json.loads(context_overwrite_source)[CONTEXT_KEY]
+        else:
+            context_overwrite = {}
+
+        remove_jsonld_key(tmp_context_class, CONTEXT_TYPE_KEY)
+        remove_jsonld_key(tmp_context_class, CONTEXT_ID_KEY)
+
+        self.context = temp_context.copy()
+        self.convert_snake_dict(temp_context)
+        contexts = ({CONTEXT_KEY: self.context}, tmp_context_class.copy(), context_overwrite)
+        if self.artifact_cache is not None:
+            self.artifact_cache.store("contexts", key, contexts)
+        return contexts
+
+    def get_query_template(self, raw_sparql_query: str) -> QueryTemplate:
+        """Obtain the compiled template of a query. Queries that are not templates are parsed on
+        demand
+
+        Args:
+            raw_sparql_query (str): the raw query
+
+        Returns:
+            QueryTemplate: the compiled template
+        """
+        try:
+            return self.query_templates[raw_sparql_query]
+        except KeyError:
+            return QueryTemplate(raw_sparql_query, self.endpoint)
+
+    def insert_resources(self, nodes: List[dict], username: str,
+                         chunk_size: int = INSERT_CHUNK_SIZE):
+        """Insert the nodes returned by flatten_resources with one INSERT DATA query by chunk
+
+        Args:
+            nodes (List[dict]): the nodes to insert
+            username (str): the user who is inserting the resources
+            chunk_size (int, optional): the maximum number of nodes by query. Defaults to 500.
+        """
+        for request_args in self.build_insert_requests_args(nodes, username, chunk_size):
+            self.run_query_insert(request_args=request_args)
+
+    def build_insert_requests_args(self, nodes: List[dict], username: str,
+                                   chunk_size: int) -> List[Dict[str, str]]:
+        """Convert the nodes to the arguments of the insert queries, one by chunk of nodes
+
+        Args:
+            nodes (List[dict]): the nodes to insert
+            username (str): the user who is inserting the resources
+            chunk_size (int): the maximum number of nodes by query
+
+        Returns:
+            List[Dict[str, str]]: the prefixes, the triples and the graph of each insert query
+        """
+        graph = self.generate_graph(username)
+        requests_args = []
+        for start in range(0, len(nodes), chunk_size):
+            prefixes, triples = self.serialize_resources(nodes[start:start + chunk_size])
+            requests_args.append({
+                "prefixes": '\n'.join(prefixes),
+                "triples": '\n'.join(triples),
+                "g": graph
+            })
+        return requests_args
+
+    def build_insert_request_args(self, body, username) -> Dict[str, str]:
+        """Convert the resource to the arguments of the insert query
+
+        Args:
+            body: the resource to insert
+            username (str): the user who is inserting the resource
+
+        Returns:
+            Dict[str, str]: the prefixes, the triples and the graph of the insert query
+        """
+        body[ID_KEY] = self.build_instance_uri(body[ID_KEY])
+        prefixes, triples = self.serialize_resources([body])
         prefixes = '\n'.join(prefixes)
         triples = '\n'.join(triples)
-        request_args: Dict[str, str] = {
+        return {
             "prefixes": prefixes,
             "triples": triples,
             "g": self.generate_graph(username)
         }
-        self.run_query_insert(request_args=request_args)
 
     @staticmethod
     def parse_request_arguments(**kwargs) -> Tuple[str, str, str]:
@@ -724,12 +1864,15 @@ class QueryManager:
         resource_type_uri = kwargs["rdf_type_uri"]
         return owl_class_name, resource_type_uri, username
 
-    def dispatch_sparql_query(self, raw_sparql_query: str, request_args: str):
+    def dispatch_sparql_query(self, raw_sparql_query: str, request_args: str,
+                              stream: bool = False):
         """Replace the variables in the query with the request arguments and send it
 
         Args:
             raw_sparql_query (str): the raw query
             request_args (str): the request arguments to be replaced
+            stream (bool, optional): return the response without reading its body (a
+                StreamedResponse to close). Defaults to False.
 
         Raises:
             e: [description]
@@ -738,24 +1881,22 @@ class QueryManager:
             dict: JSON-LD response
         """
 
-        query_metadata = gquery.get_metadata(raw_sparql_query, self.endpoint)
-        rewritten_query = query_metadata['query']
-        # Rewrite query using parameter values
-        if query_metadata['type'] == 'SelectQuery' or query_metadata[
-                'type'] == 'ConstructQuery':
-            try:
-                rewritten_query = gquery.rewrite_query(
-                    query_metadata['original_query'],
-                    query_metadata['parameters'], request_args)
-            except Exception as exception:
-                logger.error("Parameters expected: %s",  query_metadata['parameters'])
-                logger.error("Parameters given %s ", request_args)
-                raise exception
-
-        if PER_PAGE_KEY in request_args and "offset" in request_args:
-            rewritten_query = rewritten_query.replace(
-                "LIMIT 100", "LIMIT {}".format(request_args[PER_PAGE_KEY]))
-            rewritten_query = rewritten_query.replace(
-                "OFFSET 0", "OFFSET {}".format(request_args["offset"]))
+        rewritten_query = self.rewrite_sparql_query(raw_sparql_query, request_args)
         logger.info(rewritten_query)
-        return self.sparql.query(rewritten_query)
+        primary = self.reads_from_primary(request_args)
+        if stream:
+            return self.sparql.query_stream(rewritten_query, primary=primary)
+        return self.sparql.query(rewritten_query, primary=primary)
+
+    def rewrite_sparql_query(self, raw_sparql_query: str, request_args: dict) -> str:
+        """Replace the variables and the pagination of the query with the request arguments
+
+        Args:
+            raw_sparql_query (str): the raw query
+            request_args (dict): the request arguments to be replaced
+
+        Returns:
+            str: the query ready to be sent
+        """
+        query_template = self.get_query_template(raw_sparql_query)
+        return query_template.rewrite(request_args)
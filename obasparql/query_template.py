@@ -0,0 +1,101 @@
+import logging
+from typing import Optional
+
+from obasparql import gquery
+
+logger = logging.getLogger('fastapi')
+
+REWRITABLE_QUERY_TYPES = ('SelectQuery', 'ConstructQuery')
+
+
+class QueryTemplate:
+    """A SPARQL query template parsed once and reused by every request
+
+    Parsing a template (YAML decorators, pyparsing, algebra translation and the detection of the
+    parameters) is expensive, so it is done when the template is loaded. The template is compiled
+    into static fragments and typed slots (see gquery.compile_query), so a request only joins the
+    fragments with the values of the parameters and the pagination.
+    """
+
+    def __init__(self, raw_query: str, endpoint: str = None):
+        """Constructor of the QueryTemplate class
+
+        Args:
+            raw_query (str): the text of the query (the contents of the .rq file)
+            endpoint (str, optional): the endpoint used to resolve the enumerations of the
+                template. Defaults to None.
+        """
+        self.raw_query = raw_query
+        self.metadata = gquery.get_metadata(raw_query, endpoint)
+        self.type = self.metadata['type']
+        self.query = self.metadata['query']
+        self.original_query = self.metadata['original_query']
+        self.parameters = self.metadata.get('parameters', {})
+        self._count_template = None
+        if self.rewritable:
+            self.fragments = gquery.compile_query(self.original_query, self.parameters,
+                                                  pagination=True, values=True)
+        else:
+            self.fragments = gquery.compile_query(self.query, {}, pagination=True)
+
+    @property
+    def rewritable(self) -> bool:
+        """Indicates if the parameters of the template can be replaced"""
+        return self.type in REWRITABLE_QUERY_TYPES
+
+    @property
+    def supports_values(self) -> bool:
+        """Indicates if the parameters of the template can be bound to multiple values"""
+        return any(isinstance(fragment, gquery.Slot) and fragment.kind == gquery.SLOT_VALUES
+                   for fragment in self.fragments)
+
+    @property
+    def supports_keyset(self) -> bool:
+        """Indicates if the pagination of the template can continue after a cursor (see
+        gquery.compile_query)"""
+        return any(isinstance(fragment, gquery.Slot) and fragment.kind == gquery.SLOT_LIMIT and
+                   fragment.suffix for fragment in self.fragments)
+
+    @property
+    def bounded(self) -> bool:
+        """Indicates if the number of items selected by the template is limited (see
+        gquery.compile_query)"""
+        return self.limit is not None
+
+    @property
+    def limit(self) -> Optional[int]:
+        """The number of items selected by the template without per_page, None if it is not
+        limited"""
+        for fragment in self.fragments:
+            if isinstance(fragment, gquery.Slot) and fragment.kind == gquery.SLOT_LIMIT:
+                return int(fragment.original.split()[1])
+        return None
+
+    @property
+    def count_template(self) -> Optional['QueryTemplate']:
+        """The template that counts the items selected by the template (see
+        gquery.derive_count_query), None if they can not be counted. It is compiled the first
+        time it is used"""
+        if self._count_template is None and self.rewritable:
+            count_query = gquery.derive_count_query(self.original_query)
+            # False: the items can not be counted
+            self._count_template = QueryTemplate(count_query) if count_query is not None else False
+        return self._count_template or None
+
+    def rewrite(self, request_args: dict) -> str:
+        """Replace the parameters and the pagination of the template with the request arguments
+
+        Args:
+            request_args (dict): the values of the parameters, per_page and offset
+
+        Returns:
+            str: the query ready to be sent
+        """
+        if self.rewritable:
+            try:
+                gquery.check_required_parameters(self.parameters, request_args)
+            except Exception as exception:
+                logger.error("Parameters expected: %s", self.parameters)
+                logger.error("Parameters given %s ", request_args)
+                raise exception
+        return gquery.render_query(self.fragments, request_args)
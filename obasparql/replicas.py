@@ -0,0 +1,192 @@
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+from obasparql.connection_pool import ConnectionPool
+from obasparql.resilience import CircuitBreaker, CircuitOpenError
+
+DEFAULT_HEDGE_PERCENTILE = 95
+DEFAULT_HEDGE_BUDGET = 0.05
+DEFAULT_HEDGE_MIN_DELAY = 0.01
+DEFAULT_HEDGE_WINDOW = 1000
+DEFAULT_HEDGE_MIN_SAMPLES = 20
+# Hedged requests that can be sent in a burst
+DEFAULT_HEDGE_MAX_TOKENS = 10
+# Threads that send the hedged queries of SPARQLConnector
+DEFAULT_HEDGE_WORKERS = 64
+
+
+class Replica:
+    """A query endpoint: its circuit breaker (shared by the endpoints of the same server) and the
+    number of requests in flight"""
+
+    def __init__(self, url: str, breaker: CircuitBreaker):
+        self.url = url
+        self.breaker = breaker
+        self.outstanding = 0
+
+    def __repr__(self):
+        return f"Replica({self.url!r})"
+
+
+class ReplicaSet:
+    """Thread-safe set of the query endpoints of the replicas of a triple store, and of the primary
+
+    acquire selects the replica with the fewest requests in flight (least outstanding requests)
+    whose circuit breaker is closed: the replicas that fail are ejected until their circuit breaker
+    probes them again.
+    """
+
+    def __init__(self, urls: Sequence[str], primary_url: str,
+                 breaker_for: Callable[[str], CircuitBreaker]):
+        """Constructor of the ReplicaSet class
+
+        Args:
+            urls (Sequence[str]): the query endpoints of the replicas
+            primary_url (str): the query endpoint of the primary, which can be one of the replicas
+            breaker_for (Callable[[str], CircuitBreaker]): returns the circuit breaker of an
+                endpoint
+        """
+        self.replicas = [Replica(url, breaker_for(url)) for url in urls]
+        self.primary = next((replica for replica in self.replicas if replica.url == primary_url),
+                            None)
+        if self.primary is None:
+            self.primary = Replica(primary_url, breaker_for(primary_url))
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, exclude: Sequence[Replica] = ()) -> Replica:
+        """Reserve the healthy replica with the fewest requests in flight. The replicas of exclude
+        (e.g., the ones that have failed the request) are only used if no other replica is healthy.
+        Release it with release
+
+        Raises:
+            CircuitOpenError: every replica is ejected
+        """
+        with self._lock:
+            count = len(self.replicas)
+            start = self._next
+            self._next = (self._next + 1) % count
+            # The replicas with the same number of requests are selected in turn
+            candidates = sorted(range(count), key=lambda i: (self.replicas[i] in exclude,
+                                                             self.replicas[i].outstanding,
+                                                             (i - start) % count))
+        for position, i in enumerate(candidates):
+            replica = self.replicas[i]
+            last = position == count - 1
+            if not last and not replica.breaker.available():
+                continue
+            try:
+                replica.breaker.before_request()
+            except CircuitOpenError:
+                if last:
+                    raise
+                continue
+            with self._lock:
+                replica.outstanding += 1
+            return replica
+
+    def acquire_primary(self) -> Replica:
+        """Reserve the primary. Release it with release
+
+        Raises:
+            CircuitOpenError: the primary is ejected
+        """
+        self.primary.breaker.before_request()
+        with self._lock:
+            self.primary.outstanding += 1
+        return self.primary
+
+    def release(self, replica: Replica):
+        with self._lock:
+            replica.outstanding -= 1
+
+    def stats(self) -> List[Dict[str, object]]:
+        """The requests in flight and the state of the circuit breaker of each replica"""
+        with self._lock:
+            outstanding = [(replica.url, replica.outstanding, replica.breaker)
+                           for replica in self.replicas]
+        return [{"url": url, "outstanding": count, "circuit_state": breaker.state}
+                for url, count, breaker in outstanding]
+
+
+def server_key(url: str) -> Tuple[str, str, int]:
+    """The scheme, host and port of an endpoint: the endpoints of the same server share their
+    health"""
+    return ConnectionPool._key(urlsplit(url))
+
+
+class HedgingPolicy:
+    """When a query has no response after the percentile of the recent latencies, the connector
+    sends it to another replica and takes the first response. The hedged requests are capped to
+    budget times the queries (e.g., 0.05 adds at most 5% of requests)
+    """
+
+    def __init__(self,
+                 percentile: float = DEFAULT_HEDGE_PERCENTILE,
+                 budget: float = DEFAULT_HEDGE_BUDGET,
+                 min_delay: float = DEFAULT_HEDGE_MIN_DELAY,
+                 window: int = DEFAULT_HEDGE_WINDOW,
+                 min_samples: int = DEFAULT_HEDGE_MIN_SAMPLES):
+        """Constructor of the HedgingPolicy class
+
+        Args:
+            percentile (float, optional): the percentile of the latencies after which a query is
+                hedged. Defaults to 95.
+            budget (float, optional): the maximum ratio of hedged queries. Defaults to 0.05.
+            min_delay (float, optional): the minimum delay before hedging, in seconds. Defaults to
+                0.01.
+            window (int, optional): the number of recent latencies kept. Defaults to 1000.
+            min_samples (int, optional): the queries are not hedged until that many latencies are
+                known. Defaults to 20.
+        """
+        self.percentile = percentile
+        self.budget = budget
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.hedged = 0
+        self.hedge_wins = 0
+        self._latencies = deque(maxlen=window)
+        self._delay = None
+        # Each query adds budget tokens, each hedged request spends one
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, latency: float):
+        """Record the time to the response of a query"""
+        with self._lock:
+            self._latencies.append(latency)
+            self._delay = None
+
+    def delay(self) -> Optional[float]:
+        """Seconds to wait before hedging a query, None if it must not be hedged. Each query adds
+        to the budget"""
+        with self._lock:
+            self._tokens = min(self._tokens + self.budget, DEFAULT_HEDGE_MAX_TOKENS)
+            if len(self._latencies) < self.min_samples:
+                return None
+            if self._delay is None:
+                latencies = sorted(self._latencies)
+                index = min(len(latencies) - 1, int(len(latencies) * self.percentile / 100))
+                self._delay = max(self.min_delay, latencies[index])
+            return self._delay
+
+    def try_hedge(self) -> bool:
+        """Spend the budget of a hedged request, False if it has been spent"""
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            self.hedged += 1
+            return True
+
+    def record_win(self):
+        """The hedged request answered first"""
+        with self._lock:
+            self.hedge_wins += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hedged": self.hedged, "hedge_wins": self.hedge_wins,
+                    "hedge_delay": self._delay}
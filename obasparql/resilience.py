@@ -0,0 +1,179 @@
+import asyncio
+import http.client
+import logging
+import random
+import socket
+import threading
+import time
+from urllib.error import HTTPError
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 120.0
+# The queries are retried twice, the updates are not retried
+DEFAULT_QUERY_RETRIES = 2
+DEFAULT_RETRY_BACKOFF = 0.1
+DEFAULT_RETRY_MAX_BACKOFF = 2.0
+DEFAULT_CIRCUIT_FAILURE_THRESHOLD = 5
+DEFAULT_CIRCUIT_RESET_TIMEOUT = 30.0
+
+# The endpoint is overloaded or restarting: the same request can succeed later
+TRANSIENT_STATUSES = (502, 503, 504)
+TIMEOUT_ERRORS = (socket.timeout, TimeoutError, asyncio.TimeoutError)
+TRANSIENT_ERRORS = TIMEOUT_ERRORS + (OSError, http.client.HTTPException,
+                                     asyncio.IncompleteReadError)
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half-open"
+
+
+class CircuitOpenError(Exception):
+    """The circuit breaker rejected the request: the endpoint is unhealthy"""
+
+
+def is_transient(error: BaseException) -> bool:
+    """Indicates if the error is a failure of the endpoint or of the network (a timeout, a
+    connection error or a 502, 503 or 504 response), not of the request"""
+    if isinstance(error, HTTPError):
+        return error.code in TRANSIENT_STATUSES
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+class RetryPolicy:
+    """Number of retries of a query and the delay before each retry: a random delay between 0 and
+    backoff * 2 ** attempt seconds, at most max_backoff (full jitter)
+    """
+
+    def __init__(self,
+                 retries: int = DEFAULT_QUERY_RETRIES,
+                 backoff: float = DEFAULT_RETRY_BACKOFF,
+                 max_backoff: float = DEFAULT_RETRY_MAX_BACKOFF):
+        """Constructor of the RetryPolicy class
+
+        Args:
+            retries (int, optional): the maximum number of retries. 0 disables them. Defaults to 2.
+            backoff (float, optional): the base of the delay in seconds. Defaults to 0.1.
+            max_backoff (float, optional): the maximum delay in seconds. Defaults to 2.
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def should_retry(self, error: BaseException, attempt: int) -> bool:
+        """Indicates if the request must be retried after the failure of attempt (0 for the first
+        request)"""
+        return attempt < self.retries and is_transient(error)
+
+    def delay(self, attempt: int) -> float:
+        """Seconds to wait before retrying after the failure of attempt"""
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """Thread-safe circuit breaker of an endpoint
+
+    After failure_threshold consecutive transient failures, the circuit opens and the requests are
+    rejected with CircuitOpenError during reset_timeout seconds. Then one request at a time probes
+    the endpoint (half-open): the circuit closes if it succeeds and opens again if it fails.
+    """
+
+    def __init__(self,
+                 failure_threshold: int = DEFAULT_CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout: float = DEFAULT_CIRCUIT_RESET_TIMEOUT):
+        """Constructor of the CircuitBreaker class
+
+        Args:
+            failure_threshold (int, optional): consecutive failures that open the circuit. 0
+                disables the circuit breaker. Defaults to 5.
+            reset_timeout (float, optional): seconds before probing an open circuit. Defaults to
+                30.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CIRCUIT_CLOSED
+        self.consecutive_failures = 0
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.failure_threshold > 0
+
+    def available(self) -> bool:
+        """Indicates if before_request would accept a request, without reserving it"""
+        if not self.enabled:
+            return True
+        with self._lock:
+            if self.state == CIRCUIT_OPEN:
+                return time.monotonic() - self._opened_at >= self.reset_timeout
+            return self.state == CIRCUIT_CLOSED or not self._probing
+
+    def before_request(self):
+        """Reserve the request
+
+        Raises:
+            CircuitOpenError: the circuit is open, or half-open and probed by another request
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            elapsed = time.monotonic() - self._opened_at
+            if self.state == CIRCUIT_OPEN and elapsed >= self.reset_timeout:
+                self.state = CIRCUIT_HALF_OPEN
+            if self.state == CIRCUIT_CLOSED:
+                return
+            if self.state == CIRCUIT_HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            self.rejected += 1
+        raise CircuitOpenError("The SPARQL endpoint is unavailable")
+
+    def record_success(self):
+        """The endpoint answered the request"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.consecutive_failures = 0
+            self._probing = False
+            if self.state != CIRCUIT_CLOSED:
+                log.info("The SPARQL endpoint has recovered, closing the circuit")
+                self.state = CIRCUIT_CLOSED
+
+    def record_failure(self):
+        """The request failed with a transient error"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            self._probing = False
+            threshold = self.consecutive_failures >= self.failure_threshold
+            if self.state == CIRCUIT_HALF_OPEN or (self.state == CIRCUIT_CLOSED and threshold):
+                log.warning("The SPARQL endpoint is unavailable, "
+                            "opening the circuit for %s seconds", self.reset_timeout)
+                self.state = CIRCUIT_OPEN
+                self.opened += 1
+                self._opened_at = time.monotonic()
+
+    def record_error(self, error: BaseException):
+        """Record the outcome of a request that raised error. A request cancelled before the
+        response releases the probe without changing the state"""
+        if is_transient(error):
+            self.record_failure()
+        elif isinstance(error, Exception):
+            # The endpoint answered (e.g., a 400 response)
+            self.record_success()
+        else:
+            with self._lock:
+                self._probing = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"circuit_state": self.state, "circuit_opened": self.opened,
+                    "failures": self.failures, "rejected": self.rejected}
@@ -1,11 +1,22 @@
+import functools
 import logging
-from typing import Optional, TYPE_CHECKING, Tuple
-from urllib.request import urlopen, Request
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, TYPE_CHECKING, Tuple, Union
+from urllib.request import Request
 from urllib.parse import urlencode
 from urllib.error import HTTPError
 import base64
 from rdflib import BNode
 
+from obasparql.connection_pool import Cancellation, ConnectionPool, DEFAULT_POOL_MAXSIZE, \
+    DEFAULT_POOL_IDLE_TIMEOUT
+from obasparql.replicas import HedgingPolicy, Replica, ReplicaSet, server_key, \
+    DEFAULT_HEDGE_WORKERS
+from obasparql.resilience import CircuitBreaker, CircuitOpenError, RetryPolicy, \
+    DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT, TIMEOUT_ERRORS
+
 log = logging.getLogger(__name__)
 
 if TYPE_CHECKING:
@@ -27,6 +38,12 @@ _response_mime_types = {
 }
 
 
+def close_response(future: Future):
+    """Close the response of a request that lost the race with its hedged request"""
+    if not future.cancelled() and future.exception() is None and hasattr(future.result(), "close"):
+        future.result().close()
+
+
 class SPARQLConnector(object):
     """
     this class deals with nitty gritty details of talking to a SPARQL server
@@ -34,24 +51,79 @@ class SPARQLConnector(object):
 
     def __init__(
         self,
-        query_endpoint: Optional[str] = None,
+        query_endpoint: Union[str, List[str], None] = None,
         update_endpoint: Optional[str] = None,
         returnFormat: str = "xml",
         method: "te.Literal['GET', 'POST', 'POST_FORM']" = "GET",
         auth: Optional[Tuple[str, str]] = None,
+        pool: Optional[ConnectionPool] = None,
+        pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+        pool_idle_timeout: float = DEFAULT_POOL_IDLE_TIMEOUT,
+        connect_timeout: Optional[float] = DEFAULT_CONNECT_TIMEOUT,
+        read_timeout: Optional[float] = DEFAULT_READ_TIMEOUT,
+        retry_policy: Optional[RetryPolicy] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        primary_query_endpoint: Optional[str] = None,
+        hedging: Optional[HedgingPolicy] = None,
         **kwargs,
     ):
         """
         auth, if present, must be a tuple of (username, password) used for Basic Authentication
 
+        The query and update requests are sent using the persistent connections of pool. If pool is
+        not set, a new one is created with pool_maxsize idle connections by endpoint, evicted after
+        pool_idle_timeout seconds, and the connect_timeout and read_timeout of its sockets (None
+        waits forever).
+
+        The queries that fail with a timeout, a connection error or a 502, 503 or 504 response are
+        retried according to retry_policy (default RetryPolicy()); the updates are not retried.
+        circuit_breaker (default CircuitBreaker()) rejects the requests with CircuitOpenError while
+        the endpoint is unhealthy.
+
+        query_endpoint can be a list of the query endpoints of replicas: each query is sent to the
+        healthy replica with the fewest requests in flight, and retried on another one. Each server
+        has its own circuit breaker, circuit_breaker is the one of the primary: the server of
+        update_endpoint (or of the first query endpoint). The queries with primary=True are sent to
+        primary_query_endpoint (default the first query endpoint). With hedging and several query
+        endpoints, a query without response after the delay of hedging is also sent to another
+        replica and the first response is returned.
+
         Any additional keyword arguments will be passed to to the request, and can be used to setup timesouts etc.
         """
 
         self.returnFormat = returnFormat
-        self.query_endpoint = query_endpoint
+        if isinstance(query_endpoint, str):
+            query_endpoints = [query_endpoint]
+        else:
+            query_endpoints = list(query_endpoint or [])
+        self.query_endpoints = query_endpoints
+        self.query_endpoint = query_endpoints[0] if query_endpoints else None
+        self.primary_query_endpoint = primary_query_endpoint or self.query_endpoint
         self.update_endpoint = update_endpoint
         self.kwargs = kwargs
         self.method = method
+        if pool is None:
+            pool = ConnectionPool(maxsize=pool_maxsize, idle_timeout=pool_idle_timeout,
+                                  connect_timeout=connect_timeout, read_timeout=read_timeout)
+        self.pool = pool
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.circuit_breaker = circuit_breaker if circuit_breaker is not None else CircuitBreaker()
+        primary = update_endpoint or self.primary_query_endpoint
+        self.circuit_breakers: Dict[Tuple[str, str, int], CircuitBreaker] = {}
+        if primary:
+            self.circuit_breakers[server_key(primary)] = self.circuit_breaker
+        self.replicas = None
+        if query_endpoints:
+            self.replicas = ReplicaSet(query_endpoints, self.primary_query_endpoint,
+                                       self.circuit_breaker_for)
+        self.hedging = hedging
+        # The thread pool of the hedged requests is created by the first hedged request
+        self.hedging_executor = None
+        self._hedging_lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.timeouts = 0
+        self._stats_lock = threading.Lock()
         if auth is not None:
             if type(auth) != tuple:
                 raise SPARQLConnectorException("auth must be a tuple")
@@ -75,82 +147,274 @@ class SPARQLConnector(object):
 
         self._method = method
 
-    def query(self, query, default_graph: str = None, named_graph: str = None):
+    def close(self):
+        """Stop the thread pool of the hedged requests and close the idle connections. The thread
+        pool is created again by the next hedged request"""
+        with self._hedging_lock:
+            executor, self.hedging_executor = self.hedging_executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+        self.pool.clear()
+
+    def stats(self) -> dict:
+        """Counters of the requests sent to the endpoint: the requests (including the retries), the
+        retries, the timeouts, the transient failures, the requests rejected by the circuit
+        breaker, the number of times the circuit has opened and its state"""
+        with self._stats_lock:
+            stats = {"requests": self.requests, "retries": self.retries, "timeouts": self.timeouts}
+        stats.update(self.circuit_breaker.stats())
+        if self.hedging is not None:
+            stats.update(self.hedging.stats())
+        return stats
+
+    def circuit_breaker_for(self, url: str) -> CircuitBreaker:
+        """The circuit breaker of the server of an endpoint, with the settings of the primary
+        one"""
+        key = server_key(url)
+        if key not in self.circuit_breakers:
+            self.circuit_breakers[key] = CircuitBreaker(self.circuit_breaker.failure_threshold,
+                                                        self.circuit_breaker.reset_timeout)
+        return self.circuit_breakers[key]
+
+    @property
+    def hedged(self) -> bool:
+        """Indicates if the queries are hedged: there is a hedging policy and several query
+        endpoints"""
+        return self.hedging is not None and self.replicas is not None and \
+            len(self.replicas.replicas) > 1
+
+    def replica_stats(self) -> List[Dict[str, object]]:
+        """The requests in flight and the state of the circuit breaker of each query endpoint"""
+        return self.replicas.stats() if self.replicas is not None else []
+
+    def _count(self, counter: str):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _after_error(self, error: BaseException, breaker: CircuitBreaker):
+        if isinstance(error, TIMEOUT_ERRORS):
+            self._count("timeouts")
+        breaker.record_error(error)
+
+    def _open(self, request: Request, urlopen, breaker: CircuitBreaker):
+        """Send a request with urlopen. The request has been accepted by breaker, which records its
+        outcome"""
+        self._count("requests")
+        try:
+            response = urlopen(request)
+        except BaseException as error:
+            self._after_error(error, breaker)
+            raise
+        breaker.record_success()
+        return response
+
+    def _acquire(self, failed: List[Replica], primary: bool) -> Replica:
+        """Reserve the replica of a query: the primary, or the least loaded replica that has not
+        failed"""
+        return self.replicas.acquire_primary() if primary else self.replicas.acquire(failed)
+
+    def _open_replica(self, replica: Replica, requests: Callable[[str], Request], urlopen):
+        """Send a query to a reserved replica and release it"""
+        start = time.monotonic()
+        try:
+            response = self._open(requests(replica.url), urlopen, replica.breaker)
+        finally:
+            self.replicas.release(replica)
+        if self.hedging is not None:
+            self.hedging.record(time.monotonic() - start)
+        return response
+
+    def _hedge_replica(self, replica: Replica, failed: List[Replica]) -> Optional[Replica]:
+        """Reserve another replica to hedge a query sent to replica, None if the budget is spent or
+        there is no other healthy replica"""
+        if not self.hedging.try_hedge():
+            return None
+        try:
+            other = self.replicas.acquire(failed + [replica])
+        except CircuitOpenError:
+            return None
+        if other is replica:
+            self.replicas.release(other)
+            return None
+        return other
+
+    def _submit_hedge(self, replica: Replica, requests: Callable[[str], Request],
+                      urlopen) -> Future:
+        """Send a hedged request to replica in the thread pool of the hedged requests"""
+        with self._hedging_lock:
+            if self.hedging_executor is None:
+                self.hedging_executor = ThreadPoolExecutor(max_workers=DEFAULT_HEDGE_WORKERS,
+                                                           thread_name_prefix="obasparql-hedging")
+            return self.hedging_executor.submit(self._open_replica, replica, requests, urlopen)
+
+    def _start_replica(self, replica: Replica, requests: Callable[[str], Request],
+                       urlopen) -> Future:
+        """Send the first request of a hedged query to replica in its own thread, so the queries in
+        flight are not bounded by the thread pool of the hedged requests and the delay of hedging
+        starts with the request"""
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(self._open_replica(replica, requests, urlopen))
+            except BaseException as error:
+                future.set_exception(error)
+
+        threading.Thread(target=run, name="obasparql-query", daemon=True).start()
+        return future
+
+    def _open_hedged(self, replica: Replica, failed: List[Replica],
+                     requests: Callable[[str], Request], urlopen):
+        """Send a query to replica and, if it has not answered after the delay of the hedging
+        policy, to another replica. Return the first successful response and cancel the other
+        request: its connection is shut down, or its response is closed if it has already
+        arrived"""
+        delay = self.hedging.delay()
+        if delay is None:
+            return self._open_replica(replica, requests, urlopen)
+        cancellations = [Cancellation(), Cancellation()]
+        first = self._start_replica(replica, requests,
+                                    functools.partial(urlopen, cancellation=cancellations[0]))
+        done, _ = wait([first], timeout=delay)
+        other = None if done else self._hedge_replica(replica, failed)
+        if other is None:
+            return first.result()
+        log.debug("Hedging the query to %s with %s", replica.url, other.url)
+        hedge = self._submit_hedge(other, requests,
+                                   functools.partial(urlopen, cancellation=cancellations[1]))
+        futures = [first, hedge]
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = next((future for future in futures
+                           if future in done and future.exception() is None), None)
+            if winner is not None:
+                for future, cancellation in zip(futures, cancellations):
+                    if future is not winner:
+                        cancellation.cancel()
+                        future.add_done_callback(close_response)
+                if winner is not first:
+                    self.hedging.record_win()
+                return winner.result()
+        return first.result()
+
+    def _open_query(self, requests: Callable[[str], Request], urlopen, primary: bool = False):
+        """Send a query with urlopen to a replica, retrying the transient failures on another
+        replica
 
+        Args:
+            requests (Callable[[str], Request]): builds the request of the query for an endpoint
+            urlopen: sends the request
+            primary (bool, optional): send the query to the primary. Defaults to False.
+        """
+        # A query does not change the dataset: it is sent again if a reused connection fails
+        urlopen = functools.partial(urlopen, idempotent=True)
+        attempt = 0
+        failed = []
+        while True:
+            replica = self._acquire(failed, primary)
+            try:
+                if primary or not self.hedged:
+                    return self._open_replica(replica, requests, urlopen)
+                return self._open_hedged(replica, failed, requests, urlopen)
+            except Exception as error:
+                if not self.retry_policy.should_retry(error, attempt):
+                    raise
+                failed.append(replica)
+                delay = self.retry_policy.delay(attempt)
+                log.debug("Retrying the query in %.3f seconds: %s", delay, error)
+            self._count("retries")
+            time.sleep(delay)
+            attempt += 1
+
+    def query_requests(self, query, default_graph: str = None,
+                       return_format: Optional[str] = None) -> Callable[[str], Request]:
+        """Return a function that builds the HTTP request of a SPARQL query for a query endpoint.
+        See query_request"""
         if not self.query_endpoint:
             raise SPARQLConnectorException("Query endpoint not set!")
+        return lambda endpoint: self.query_request(query, default_graph, return_format, endpoint)
+
+    def _request_args(self, headers: dict, params: dict = None) -> dict:
+        """Merge the params and headers of the request with the ones of the connector"""
+        args = dict(self.kwargs)
+        args["params"] = dict(args.get("params", {}))
+        args["params"].update(params or {})
+        args["headers"] = dict(args.get("headers", {}))
+        args["headers"].update(headers)
+        return args
+
+    def query_request(self, query, default_graph: str = None, return_format: Optional[str] = None,
+                      endpoint: Optional[str] = None) -> Request:
+        """Build the HTTP request of a SPARQL query
+
+        Args:
+            query (str): the query to send to the endpoint
+            default_graph (str, optional): The default graph. Defaults to None.
+            return_format (Optional[str], optional): the format of the response (e.g., "json" for
+                the results of a SELECT query). Defaults to None (the returnFormat of the
+                connector).
+            endpoint (Optional[str], optional): the query endpoint. Defaults to None (the first
+                one).
+
+        Returns:
+            Request: the request
+        """
+        endpoint = endpoint or self.query_endpoint
+        if not endpoint:
+            raise SPARQLConnectorException("Query endpoint not set!")
 
         params = {}
         # this test ensures we don't have a useless (BNode) default graph URI, which calls to Graph().query() will add
         if default_graph is not None and type(default_graph) != BNode:
             params["default-graph-uri"] = default_graph
 
-        headers = {"Accept": _response_mime_types[self.returnFormat]}
-
-        args = dict(self.kwargs)
-
-        # merge params/headers dicts
-        args.setdefault("params", {})
-
-        args.setdefault("headers", {})
-        args["headers"].update(headers)
+        headers = {"Accept": _response_mime_types[return_format or self.returnFormat]}
 
         if self.method == "GET":
             params["query"] = query
-            args["params"].update(params)
+            args = self._request_args(headers, params)
             qsa = "?" + urlencode(args["params"])
-            try:
-                res = urlopen(
-                    Request(self.query_endpoint + qsa,
-                            headers=args["headers"]))
-            except Exception as e:
-                raise ValueError(
-                    "You did something wrong formulating either the URI or your SPARQL query"
-                )
+            return Request(endpoint + qsa, headers=args["headers"])
         elif self.method == "POST":
-            args["headers"].update(
-                {"Content-Type": "application/sparql-query"})
+            headers["Content-Type"] = "application/sparql-query"
+            args = self._request_args(headers)
             qsa = "?" + urlencode(params)
-            try:
-                res = urlopen(
-                    Request(
-                        self.query_endpoint + qsa,
-                        data=query.encode(),
-                        headers=args["headers"],
-                    ))
-            except HTTPError as e:
-                return e.code, str(e), None
+            return Request(endpoint + qsa, data=query.encode(), headers=args["headers"])
         elif self.method == "POST_FORM":
             params["query"] = query
-            args["params"].update(params)
-            try:
-                res = urlopen(
-                    Request(
-                        self.query_endpoint,
-                        data=urlencode(args["params"]).encode(),
-                        headers=args["headers"],
-                    ))
-            except HTTPError as e:
-                return e.code, str(e), None
+            args = self._request_args(headers, params)
+            return Request(endpoint, data=urlencode(args["params"]).encode(),
+                           headers=args["headers"])
         else:
             raise SPARQLConnectorException("Unknown method %s" % self.method)
-        return res.read()
 
-    def update(
-        self,
-        query,
-        default_graph: Optional[str] = None,
-        named_graph: Optional[str] = None,
-    ):
-        """Method to send a SPARQL update query to the endpoint.
+    def query_error(self, error: Exception):
+        """Handle the error of a query request
+
+        Returns:
+            tuple: (code, message, None) if the endpoint returned an HTTP error and the method is
+                POST or POST_FORM
+        """
+        if self.method == "GET":
+            raise ValueError(
+                "You did something wrong formulating either the URI or your SPARQL query"
+            ) from error
+        if isinstance(error, HTTPError):
+            return error.code, str(error), None
+        raise error
+
+    def update_request(self, query, default_graph: Optional[str] = None,
+                       named_graph: Optional[str] = None) -> Request:
+        """Build the HTTP request of a SPARQL update
 
         Args:
             query (str): the query to send to the endpoint
             default_graph (Optional[str], optional): The default named graph. Defaults to None.
             named_graph (Optional[str], optional): The named graph. Defaults to None.
 
-        Raises:
-            SPARQLConnectorException: Connection error
+        Returns:
+            Request: the request
         """
         if not self.update_endpoint:
             raise SPARQLConnectorException("Query endpoint not set!")
@@ -168,15 +432,80 @@ class SPARQLConnector(object):
             "Content-Type": "application/sparql-update",
         }
 
-        args = dict(self.kwargs)  # other QSAs
+        args = self._request_args(headers, params)
+        qsa = "?" + urlencode(args["params"])
+        return Request(self.update_endpoint + qsa, data=query.encode(), headers=args["headers"])
 
-        args.setdefault("params", {})
-        args["params"].update(params)
-        args.setdefault("headers", {})
-        args["headers"].update(headers)
+    def query(self, query, default_graph: str = None, named_graph: str = None,
+              return_format: Optional[str] = None, primary: bool = False):
+        """Method to send a SPARQL query to the endpoint.
 
-        qsa = "?" + urlencode(args["params"])
-        res = urlopen(
-            Request(self.update_endpoint + qsa,
-                    data=query.encode(),
-                    headers=args["headers"]))
+        Args:
+            query (str): the query to send to the endpoint
+            default_graph (str, optional): The default graph. Defaults to None.
+            named_graph (str, optional): The named graph. Defaults to None.
+            return_format (Optional[str], optional): the format of the response. Defaults to None
+                (the returnFormat of the connector).
+            primary (bool, optional): send the query to the primary instead of a replica. Defaults
+                to False.
+
+        Raises:
+            CircuitOpenError: the endpoint is unhealthy
+
+        Returns:
+            bytes: the body of the response
+        """
+        requests = self.query_requests(query, default_graph, return_format)
+        try:
+            res = self._open_query(requests, self.pool.urlopen, primary)
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            return self.query_error(e)
+        return res.read()
+
+    def query_stream(self, query, default_graph: str = None, named_graph: str = None,
+                     return_format: Optional[str] = None, primary: bool = False):
+        """Send a SPARQL query to the endpoint without reading the response.
+
+        Args:
+            query (str): the query to send to the endpoint
+            default_graph (str, optional): The default graph. Defaults to None.
+            named_graph (str, optional): The named graph. Defaults to None.
+            return_format (Optional[str], optional): the format of the response. Defaults to None
+                (the returnFormat of the connector).
+            primary (bool, optional): send the query to the primary instead of a replica. Defaults
+                to False.
+
+        Returns:
+            StreamedResponse: the response, whose chunks are read when it is iterated. It must be
+                closed.
+        """
+        requests = self.query_requests(query, default_graph, return_format)
+        try:
+            return self._open_query(requests, self.pool.urlopen_stream, primary)
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            return self.query_error(e)
+
+    def update(
+        self,
+        query,
+        default_graph: Optional[str] = None,
+        named_graph: Optional[str] = None,
+    ):
+        """Method to send a SPARQL update query to the endpoint.
+
+        Args:
+            query (str): the query to send to the endpoint
+            default_graph (Optional[str], optional): The default named graph. Defaults to None.
+            named_graph (Optional[str], optional): The named graph. Defaults to None.
+
+        Raises:
+            SPARQLConnectorException: Connection error
+            CircuitOpenError: the endpoint is unhealthy
+        """
+        request = self.update_request(query, default_graph, named_graph)
+        self.circuit_breaker.before_request()
+        self._open(request, self.pool.urlopen, self.circuit_breaker)
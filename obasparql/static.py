@@ -31,6 +31,27 @@ SPARQL_ID_TYPE_VARIABLE = "resource"
 
 SKIP_ID_FRAMING_KEY = "skip_id_framing"
 
+# Binds the parameters of a query to multiple values (VALUES block)
+SPARQL_VALUES_KEY = "_values"
+# Number of items by page of the templates without LIMIT (see gquery.compile_query)
+DEFAULT_PER_PAGE = 100
+# Keyset pagination: the opaque cursor of the API and the IRI after which the page of the query
+# starts
+CURSOR_KEY = "cursor"
+SPARQL_AFTER_KEY = "_after"
+# Keyset pagination: the option of the API and the number of items selected after the page to know
+# if it is the last
+HAS_NEXT_KEY = "has_next"
+SPARQL_LOOKAHEAD_KEY = "_lookahead"
+# Total number of items of get_all: the argument of the API and the variable of the count query
+COUNT_KEY = "count"
+SPARQL_COUNT_VARIABLE = "count"
+# Maximum number of ids by query of QueryManager.get_resources
+IDS_CHUNK_SIZE = 100
+# Maximum number of resources (including the nested ones) by INSERT DATA query of
+# QueryManager.post_resource
+INSERT_CHUNK_SIZE = 500
+
 CONTEXT_FILE = "context.json"
 CONTEXT_CLASS_FILE = "context_class.json"
 CONTEXT_OVERWRITE_CLASS_FILE = "context_overwrite.json"
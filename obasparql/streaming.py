@@ -0,0 +1,279 @@
+import codecs
+import json
+import re
+from typing import Dict, Iterable, List, Union
+
+from obasparql.ntriples import JSONLD_ID
+
+JSONLD_GRAPH = "@graph"
+JSON_WHITESPACE = " \t\n\r"
+
+# States of the parser: the next token expected
+_START = "start"
+_FIRST_KEY = "first key"
+_KEY = "key"
+_COLON = "colon"
+_VALUE = "value"
+_FIRST_NODE = "first node"
+_NODE = "node"
+_AFTER_NODE = "after node"
+_AFTER_VALUE = "after value"
+_END = "end"
+# The value is not complete in the buffer
+_INCOMPLETE = object()
+_STRUCTURE = re.compile(r'[\[\]{}"]')
+_STRING_END = re.compile(r'["\\]')
+
+
+class _ValueScanner:
+    """Find the end of a JSON object, array or string received in pieces. The state of the scan is
+    kept between the pieces, so each character is scanned once"""
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+
+    def scan(self, text: str, position: int = 0) -> int:
+        """Return the position after the end of the value in text, -1 if it continues after text"""
+        while True:
+            if self.in_string:
+                if self.escape:
+                    if position >= len(text):
+                        return -1
+                    position += 1
+                    self.escape = False
+                match = _STRING_END.search(text, position)
+                if match is None:
+                    return -1
+                position = match.end()
+                if match.group() == "\\":
+                    self.escape = True
+                    continue
+                self.in_string = False
+                if self.depth == 0:
+                    return position
+                continue
+            match = _STRUCTURE.search(text, position)
+            if match is None:
+                return -1
+            position = match.end()
+            char = match.group()
+            if char == '"':
+                self.in_string = True
+            elif char in "[{":
+                self.depth += 1
+            else:
+                self.depth -= 1
+                if self.depth == 0:
+                    return position
+
+
+class JSONLDStreamParser:
+    """Incremental parser of the JSON-LD documents returned by the endpoint to the CONSTRUCT
+    queries
+
+    The chunks of the response are fed as they arrive. The nodes of @graph are decoded one at a
+    time and grouped by subject (the nodes with the same @id are merged), so the whole text of the
+    response is never held in memory. The other members of the document (@context, or the
+    properties of a document with one node) are decoded as a whole. The text of a value that spans
+    several chunks is kept in pieces and scanned as they arrive, and it is decoded once complete.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._buffer = ""
+        self._position = 0
+        self._state = _START
+        self._key = None
+        # The pieces of an incomplete object, array or string, and the scan of its end
+        self._pending: List[str] = []
+        self._scanner = None
+        self.members: Dict[str, object] = {}
+        self.graph: List[object] = []
+        self._subjects: Dict[str, dict] = {}
+        self.has_graph = False
+
+    def feed(self, data: bytes):
+        """Parse a chunk of the response
+
+        Raises:
+            ValueError: the document is not valid
+        """
+        text = self._decoder.decode(data)
+        if self._scanner is not None:
+            self._pending.append(text)
+            if self._scanner.scan(text) < 0:
+                return
+            self._scanner = None
+            text, self._pending = "".join(self._pending), []
+        self._buffer = self._buffer[self._position:] + text
+        self._position = 0
+        self._parse(final=False)
+
+    def close(self):
+        """Parse the end of the response
+
+        Raises:
+            ValueError: the document is not valid or it is truncated
+        """
+        text = "".join(self._pending) + self._decoder.decode(b"", final=True)
+        self._scanner, self._pending = None, []
+        self._buffer = self._buffer[self._position:] + text
+        self._position = 0
+        self._parse(final=True)
+        if self._state != _END:
+            raise ValueError("Truncated JSON-LD document")
+
+    def document(self) -> dict:
+        """The parsed document, as returned by json.loads except that the nodes of @graph are
+        grouped by subject"""
+        document = dict(self.members)
+        if self.has_graph:
+            document[JSONLD_GRAPH] = self.graph
+        return document
+
+    def _next_char(self):
+        """Skip the whitespace and return the next character, None if the buffer has been
+        consumed"""
+        buffer = self._buffer
+        position = self._position
+        while position < len(buffer) and buffer[position] in JSON_WHITESPACE:
+            position += 1
+        self._position = position
+        return buffer[position] if position < len(buffer) else None
+
+    def _expect(self, char: str, expected: str):
+        if char not in expected:
+            raise ValueError(f"Invalid JSON-LD document: unexpected {char!r} at {self._position}")
+        self._position += 1
+        return char
+
+    def _decode(self, final: bool):
+        """Decode the JSON value at the position of the buffer. An incomplete object, array or
+        string is moved to the pending pieces until the chunk that completes it"""
+        try:
+            value, end = self._json.raw_decode(self._buffer, self._position)
+        except json.JSONDecodeError as error:
+            if final:
+                raise ValueError(f"Invalid JSON-LD document: {error}") from error
+            if self._buffer[self._position] in '{["':
+                scanner = _ValueScanner()
+                if scanner.scan(self._buffer, self._position) < 0:
+                    self._scanner = scanner
+                    self._pending = [self._buffer[self._position:]]
+                    self._buffer, self._position = "", 0
+                    return _INCOMPLETE
+                # The value is complete but not valid
+                raise ValueError(f"Invalid JSON-LD document: {error}") from error
+            return _INCOMPLETE
+        # A number or a literal at the end of the buffer can continue in the next chunk
+        if end == len(self._buffer) and not final and self._buffer[self._position] not in '{["':
+            return _INCOMPLETE
+        self._position = end
+        return value
+
+    def _parse(self, final: bool):
+        while True:
+            char = self._next_char()
+            if char is None:
+                return
+            state = self._state
+            if state == _START:
+                self._expect(char, "{")
+                self._state = _FIRST_KEY
+            elif state in (_FIRST_KEY, _KEY):
+                if state == _FIRST_KEY and char == "}":
+                    self._position += 1
+                    self._state = _END
+                    continue
+                if char != '"':
+                    self._expect(char, '"')
+                key = self._decode(final)
+                if key is _INCOMPLETE:
+                    return
+                self._key = key
+                self._state = _COLON
+            elif state == _COLON:
+                self._expect(char, ":")
+                self._state = _VALUE
+            elif state == _VALUE:
+                if self._key == JSONLD_GRAPH and char == "[":
+                    self._position += 1
+                    self.has_graph = True
+                    self._state = _FIRST_NODE
+                    continue
+                value = self._decode(final)
+                if value is _INCOMPLETE:
+                    return
+                if self._key == JSONLD_GRAPH:
+                    self.has_graph = True
+                    self.add_nodes(value if isinstance(value, list) else [value])
+                else:
+                    self.members[self._key] = value
+                self._state = _AFTER_VALUE
+            elif state in (_FIRST_NODE, _NODE):
+                if state == _FIRST_NODE and char == "]":
+                    self._position += 1
+                    self._state = _AFTER_VALUE
+                    continue
+                node = self._decode(final)
+                if node is _INCOMPLETE:
+                    return
+                self.add_nodes([node])
+                self._state = _AFTER_NODE
+            elif state == _AFTER_NODE:
+                self._state = _NODE if self._expect(char, ",]") == "," else _AFTER_VALUE
+            elif state == _AFTER_VALUE:
+                self._state = _KEY if self._expect(char, ",}") == "," else _END
+            else:
+                raise ValueError(f"Invalid JSON-LD document: extra data at {self._position}")
+
+    def add_nodes(self, nodes: Iterable[object]):
+        """Add nodes to the graph, merging the nodes with the same @id"""
+        for node in nodes:
+            subject = node.get(JSONLD_ID) if isinstance(node, dict) else None
+            if not isinstance(subject, str):
+                self.graph.append(node)
+                continue
+            group = self._subjects.get(subject)
+            if group is None:
+                self._subjects[subject] = node
+                self.graph.append(node)
+                continue
+            for key, value in node.items():
+                if key == JSONLD_ID:
+                    continue
+                if key not in group:
+                    group[key] = value
+                else:
+                    group[key] = _as_list(group[key]) + _as_list(value)
+
+
+def _as_list(value) -> list:
+    return value if isinstance(value, list) else [value]
+
+
+def parse_stream(chunks: Iterable[bytes]) -> dict:
+    """Parse the chunks of a JSON-LD response with JSONLDStreamParser
+
+    Args:
+        chunks (Iterable[bytes]): the chunks of the response
+
+    Raises:
+        ValueError: the document is not valid
+
+    Returns:
+        dict: the document (see JSONLDStreamParser.document)
+    """
+    parser = JSONLDStreamParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+    parser.close()
+    return parser.document()
+
+
+def is_stream(response: Union[str, bytes, dict, Iterable[bytes]]) -> bool:
+    """Indicates if the response of the endpoint is an iterable of chunks"""
+    return not isinstance(response, (str, bytes, bytearray, dict))
@@ -53,5 +53,10 @@ setup(
         "webencodings==0.5.1",
         "starlette==0.20.4",
         "PyLD>=2.0.3",
-    ]
+    ],
+    entry_points={
+        "console_scripts": [
+            "obasparql-build-cache=obasparql.cli:build_cache",
+        ]
+    }
 )
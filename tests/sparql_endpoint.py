@@ -0,0 +1,77 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class SPARQLRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.endpoint.lock:
+            self.server.endpoint.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle_request(self):
+        endpoint = self.server.endpoint
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode() if length else ""
+        url = urlsplit(self.path)
+        if self.command == "GET":
+            body = parse_qs(url.query).get("query", [""])[0]
+        request = {"method": self.command, "path": url.path, "headers": self.headers, "body": body}
+        with endpoint.lock:
+            endpoint.requests.append(request)
+        result = endpoint.responder(request)
+        if result is None:
+            # The request is processed but the connection is lost before the response
+            self.close_connection = True
+            return
+        status, content_type, response = result
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+        if endpoint.close_after_response:
+            # Close without announcing it: the client believes the connection is still alive
+            self.close_connection = True
+
+    do_GET = handle_request
+    do_POST = handle_request
+
+
+def default_responder(request):
+    return 200, "application/ld+json", b'{"@graph": []}'
+
+
+class SPARQLEndpoint:
+    """Local stand-in of a SPARQL endpoint. It records the requests and the number of
+    connections, and answers with responder(request) -> (status, content type, body), or closes
+    the connection without answering if the responder returns None"""
+
+    def __init__(self, responder=default_responder):
+        self.responder = responder
+        self.requests = []
+        self.connections = 0
+        self.close_after_response = False
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), SPARQLRequestHandler)
+        self.server.daemon_threads = True
+        self.server.endpoint = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/ds"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,75 @@
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from obasparql import QueryManager
+from obasparql.artifact_cache import ArtifactCache
+from obasparql.cli import build_cache
+from tests.settings import model_catalog_queries, model_catalog_context, model_catalog_endpoint, \
+    model_catalog_graph_base, model_catalog_prefix
+
+
+class TestArtifactCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def build_query_manager(self, context_dir=model_catalog_context):
+        return QueryManager(queries_dir=model_catalog_queries,
+                            context_dir=context_dir,
+                            endpoint=model_catalog_endpoint,
+                            named_graph_base=model_catalog_graph_base,
+                            uri_prefix=model_catalog_prefix,
+                            cache_dir=self.cache_dir)
+
+    def test_warm_start(self):
+        cold = self.build_query_manager()
+        with mock.patch("obasparql.gquery.get_metadata") as get_metadata, \
+                mock.patch("obasparql.query_manager.QueryManager.convert_snake_dict") as convert_snake_dict:
+            warm = self.build_query_manager()
+            get_metadata.assert_not_called()
+            convert_snake_dict.assert_not_called()
+        self.assertEqual(cold.context, warm.context)
+        self.assertEqual(cold.class_context, warm.class_context)
+        self.assertEqual(cold.context_overwrite, warm.context_overwrite)
+        self.assertEqual(set(cold.query_templates), set(warm.query_templates))
+        for raw_query, template in cold.query_templates.items():
+            self.assertEqual(template.fragments, warm.query_templates[raw_query].fragments)
+
+    def test_modified_context(self):
+        self.build_query_manager()
+        context_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, context_dir)
+        shutil.copytree(model_catalog_context, context_dir, dirs_exist_ok=True)
+        with open(context_dir / "context_class.json", "w") as writer:
+            writer.write('{"@context": {"Model": {"@id": "https://w3id.org/okn/o/sdm#Model"}}}')
+        query_manager = self.build_query_manager(context_dir)
+        self.assertEqual(query_manager.class_context, {"Model": {"@id": "https://w3id.org/okn/o/sdm#Model"}})
+
+    def test_corrupted_artifact(self):
+        self.build_query_manager()
+        for path in Path(self.cache_dir).glob("*.pickle"):
+            path.write_bytes(b"corrupted")
+        query_manager = self.build_query_manager()
+        self.assertTrue(query_manager.query_templates)
+        self.assertIn("id", query_manager.context["@context"])
+
+    def test_key(self):
+        self.assertEqual(ArtifactCache.key("a", "b"), ArtifactCache.key("a", "b"))
+        self.assertNotEqual(ArtifactCache.key("ab", ""), ArtifactCache.key("a", "b"))
+        self.assertNotEqual(ArtifactCache.key("a", None), ArtifactCache.key("a"))
+
+    def test_build_cache_cli(self):
+        build_cache(["--queries-dir", str(model_catalog_queries),
+                     "--context-dir", str(model_catalog_context),
+                     "--cache-dir", self.cache_dir])
+        kinds = sorted(path.name.split("-")[0] for path in Path(self.cache_dir).glob("*.pickle"))
+        self.assertEqual(kinds, ["contexts", "templates"])
+
+
+if __name__ == '__main__':
+    unittest.main()
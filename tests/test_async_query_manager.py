@@ -0,0 +1,160 @@
+import asyncio
+import json
+import threading
+import time
+import unittest
+from unittest import mock
+
+from starlette.exceptions import HTTPException
+
+from obasparql import AsyncQueryManager
+from tests.settings import model_catalog_queries, model_catalog_context, model_catalog_graph_base, \
+    model_catalog_prefix
+from tests.sparql_endpoint import SPARQLEndpoint
+
+REGION_URI = "https://w3id.org/okn/o/sdm#Region"
+TRAVIS = {
+    "@graph": [{
+        "@id": "https://w3id.org/okn/i/mint/Travis",
+        "@type": REGION_URI,
+        "label": "Travis",
+        "partOf": "https://w3id.org/okn/i/mint/Texas"
+    }, {
+        "@id": "https://w3id.org/okn/i/mint/Texas",
+        "@type": REGION_URI,
+        "label": "Texas (USA)"
+    }],
+    "@context": {
+        "label": {"@id": "http://www.w3.org/2000/01/rdf-schema#label"},
+        "partOf": {"@id": "https://w3id.org/okn/o/sdm#partOf", "@type": "@id"}
+    }
+}
+
+
+class Body:
+    """Stand-in of the models of the OBA server"""
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def dict(self):
+        return dict(self.__dict__)
+
+
+class TestAsyncQueryManager(unittest.TestCase):
+    def setUp(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.delay = 0
+        self.lock = threading.Lock()
+        self.endpoint = SPARQLEndpoint(self.respond).__enter__()
+        self.addCleanup(self.endpoint.__exit__)
+        self.query_manager = AsyncQueryManager(queries_dir=model_catalog_queries,
+                                               context_dir=model_catalog_context,
+                                               endpoint=self.endpoint.url,
+                                               named_graph_base=model_catalog_graph_base,
+                                               uri_prefix=model_catalog_prefix,
+                                               max_concurrency=2)
+
+    def respond(self, request):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self.lock:
+            self.in_flight -= 1
+        if request["path"].endswith("/update"):
+            return 200, "text/plain", b""
+        return 200, "application/ld+json", json.dumps(TRAVIS).encode()
+
+    def get_travis(self):
+        return self.query_manager.get_resource(id="Travis",
+                                               username="mint@isi.edu",
+                                               rdf_type_uri=REGION_URI,
+                                               rdf_type_name="Region")
+
+    def test_get_resource(self):
+        resource = asyncio.run(self.get_travis())
+        self.assertEqual(resource["id"], "https://w3id.org/okn/i/mint/Travis")
+        self.assertEqual(resource["partOf"][0]["label"], ["Texas (USA)"])
+        query = self.endpoint.requests[0]["body"]
+        self.assertIn("<https://w3id.org/okn/i/mint/Travis>", query)
+
+    def test_framing_does_not_block_the_event_loop(self):
+        threads = []
+        process = self.query_manager.process_query_get_result
+
+        def process_query_get_result(*args):
+            threads.append(threading.current_thread())
+            return process(*args)
+
+        self.query_manager.process_query_get_result = process_query_get_result
+        resource = asyncio.run(self.get_travis())
+        self.assertEqual(resource["id"], "https://w3id.org/okn/i/mint/Travis")
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+
+    def test_no_sync_connector(self):
+        with mock.patch("obasparql.query_manager.SPARQLConnector") as connector_class:
+            AsyncQueryManager(queries_dir=model_catalog_queries,
+                              context_dir=model_catalog_context,
+                              endpoint=self.endpoint.url,
+                              named_graph_base=model_catalog_graph_base,
+                              uri_prefix=model_catalog_prefix)
+        connector_class.assert_not_called()
+
+    def test_concurrency_limit(self):
+        self.delay = 0.05
+
+        async def get_all():
+            return await asyncio.gather(*[self.get_travis() for _ in range(8)])
+
+        resources = asyncio.run(get_all())
+        self.assertEqual(len(resources), 8)
+        self.assertLessEqual(self.max_in_flight, 2)
+        self.assertLessEqual(self.endpoint.connections, 2)
+
+    def test_connections_are_reused(self):
+        async def get_sequentially():
+            for _ in range(5):
+                await self.get_travis()
+
+        asyncio.run(get_sequentially())
+        self.assertEqual(self.endpoint.connections, 1)
+
+    def test_post_resource(self):
+        body = Body(id=None, type=None, label=["Austin"])
+        response = asyncio.run(self.query_manager.post_resource("mint@isi.edu", body, REGION_URI))
+        self.assertNotIn("@context", response)
+        update = self.endpoint.requests[0]
+        self.assertEqual(update["path"], "/ds/update")
+        self.assertIn("INSERT DATA", update["body"])
+        self.assertIn(response["id"], update["body"])
+        self.assertIn('"Austin"', update["body"])
+
+    def test_put_resource(self):
+        body = Body(id="Travis", type=[REGION_URI], label=["Travis County"])
+        resource = asyncio.run(self.query_manager.put_resource("Travis", "mint@isi.edu", body, REGION_URI,
+                                                               rdf_type_name="Region"))
+        self.assertEqual(resource["id"], "https://w3id.org/okn/i/mint/Travis")
+        updates = [request["body"] for request in self.endpoint.requests if request["path"].endswith("/update")]
+        self.assertEqual(len(updates), 2)
+        self.assertTrue(updates[0].startswith("DELETE WHERE"))
+        self.assertIn("INSERT DATA", updates[1])
+
+    def test_delete_resource(self):
+        asyncio.run(self.query_manager.delete_resource("Travis", "mint@isi.edu", REGION_URI, "Region"))
+        updates = [request["body"] for request in self.endpoint.requests if request["path"].endswith("/update")]
+        self.assertEqual(len(updates), 2)
+        self.assertIn("<https://w3id.org/okn/i/mint/Travis> ?p ?o", updates[0])
+        self.assertIn("?s ?p <https://w3id.org/okn/i/mint/Travis>", updates[1])
+
+    def test_http_error(self):
+        self.endpoint.responder = lambda request: (500, "text/plain", b"error")
+        with self.assertRaises(HTTPException) as context:
+            asyncio.run(self.get_travis())
+        self.assertEqual(context.exception.status_code, 500)
+
+
+if __name__ == '__main__':
+    unittest.main()
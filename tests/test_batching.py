@@ -0,0 +1,187 @@
+import asyncio
+import json
+import re
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from obasparql import AsyncQueryManager, QueryManager
+from obasparql.batching import AsyncBatchLoader, BatchLoader
+from tests.settings import model_catalog_queries, model_catalog_context, model_catalog_graph_base, \
+    model_catalog_prefix
+from tests.sparql_endpoint import SPARQLEndpoint
+from tests.test_get_resources import MISSING, REGION_URI, respond_regions
+
+USER = "mint@isi.edu"
+IDS = ["Travis", "Austin", "Travis", MISSING]
+TEXAS_URI = "https://w3id.org/okn/i/mint/Texas"
+# The triples of the get_one query of each region, and of its nested regions
+REGIONS = {
+    "https://w3id.org/okn/i/mint/Travis": {"label": "Travis", "partOf": TEXAS_URI},
+    TEXAS_URI: {"label": "Texas", "description": "The second largest state"},
+}
+
+
+def respond_related(request):
+    """Return the union of the graphs of the get_one queries of the regions requested by the query (in the
+    VALUES block or in the graph pattern): a region has every property, a nested region only its label"""
+    nodes = {}
+    for uri in re.findall(r"<(https://w3id.org/okn/i/mint/[^>]+)>", request["body"]):
+        nodes.setdefault(uri, {"@id": uri, "@type": REGION_URI}).update(REGIONS[uri])
+        if "partOf" in REGIONS[uri]:
+            nested = REGIONS[uri]["partOf"]
+            nodes.setdefault(nested, {"@id": nested, "@type": REGION_URI})["label"] = REGIONS[nested]["label"]
+    body = {
+        "@graph": list(nodes.values()),
+        "@context": {
+            "label": {"@id": "http://www.w3.org/2000/01/rdf-schema#label"},
+            "description": {"@id": "https://w3id.org/okn/o/sdm#description"},
+            "partOf": {"@id": "https://w3id.org/okn/o/sdm#partOf", "@type": "@id"}
+        }
+    }
+    return 200, "application/ld+json", json.dumps(body).encode()
+
+
+class TestBatchLoader(unittest.TestCase):
+    def setUp(self):
+        self.batches = []
+
+    def load_batch(self, key, items):
+        self.batches.append((key, items))
+        if "error" in items:
+            raise ValueError("error")
+        return {item: {"id": item} for item in items if item != "missing"}
+
+    def load(self, loader, keys_items):
+        with ThreadPoolExecutor(len(keys_items)) as executor:
+            futures = [executor.submit(loader.load, key, item) for key, item in keys_items]
+            return [future.result() for future in futures]
+
+    def test_batches(self):
+        loader = BatchLoader(self.load_batch, max_size=10, wait=0.2)
+        results = self.load(loader, [("a", "1"), ("a", "2"), ("a", "1"), ("b", "1"), ("a", "missing")])
+        self.assertEqual(results, [{"id": "1"}, {"id": "2"}, {"id": "1"}, {"id": "1"}, None])
+        # The callers of the same item have their own copy
+        self.assertIsNot(results[0], results[2])
+        self.assertEqual(sorted(self.batches), [("a", ["1", "2", "missing"]), ("b", ["1"])])
+        self.assertEqual(loader.stats(), {"loads": 5, "batches": 2})
+
+    def test_max_size(self):
+        loader = BatchLoader(self.load_batch, max_size=2, wait=5)
+        results = self.load(loader, [("a", "1"), ("a", "2")])
+        self.assertEqual(results, [{"id": "1"}, {"id": "2"}])
+        self.assertEqual(len(self.batches), 1)
+
+    def test_error(self):
+        loader = BatchLoader(self.load_batch, max_size=2, wait=5)
+        with ThreadPoolExecutor(2) as executor:
+            futures = [executor.submit(loader.load, "a", item) for item in ["1", "error"]]
+            for future in futures:
+                with self.assertRaises(ValueError):
+                    future.result()
+
+    def test_async(self):
+        async def load_batch(key, items):
+            return self.load_batch(key, items)
+
+        loader = AsyncBatchLoader(load_batch, max_size=10, wait=0.05)
+
+        async def main():
+            callers = [asyncio.ensure_future(loader.load("a", item)) for item in ["1", "2", "3"]]
+            await asyncio.sleep(0)
+            # A cancelled caller does not cancel the batch
+            callers[0].cancel()
+            return await asyncio.gather(*callers[1:])
+
+        self.assertEqual(asyncio.run(main()), [{"id": "2"}, {"id": "3"}])
+        self.assertEqual(self.batches, [("a", ["1", "2", "3"])])
+
+
+class TestQueryManagerBatching(unittest.TestCase):
+    def setUp(self):
+        self.endpoint = SPARQLEndpoint(respond_regions).__enter__()
+        self.addCleanup(self.endpoint.__exit__)
+
+    def query_manager(self, query_manager_class=QueryManager, **kwargs):
+        return query_manager_class(queries_dir=model_catalog_queries,
+                                   context_dir=model_catalog_context,
+                                   endpoint=self.endpoint.url,
+                                   named_graph_base=model_catalog_graph_base,
+                                   uri_prefix=model_catalog_prefix,
+                                   coalesce_queries=False,
+                                   **kwargs)
+
+    @staticmethod
+    def get_resource(query_manager, _id, username=USER):
+        return query_manager.get_resource(rdf_type_uri=REGION_URI, rdf_type_name="Region", id=_id,
+                                          username=username)
+
+    def get_resources(self, query_manager, ids, username=USER):
+        with ThreadPoolExecutor(len(ids)) as executor:
+            futures = [executor.submit(self.get_resource, query_manager, _id, username) for _id in ids]
+            return [future.result() for future in futures]
+
+    def test_batch(self):
+        expected = self.get_resources(self.query_manager(), IDS)
+        self.assertEqual(len(self.endpoint.requests), len(IDS))
+        self.endpoint.requests.clear()
+
+        query_manager = self.query_manager(batch_wait=0.2)
+        self.assertEqual(self.get_resources(query_manager, IDS), expected)
+        self.assertEqual(len(self.endpoint.requests), 1)
+        self.assertIn("VALUES", self.endpoint.requests[0]["body"])
+        self.assertEqual(expected[0]["label"], ["Travis"])
+        self.assertEqual(expected[-1], {})
+
+    def test_graphs(self):
+        query_manager = self.query_manager(batch_wait=0.2, batch_max_size=2)
+        with ThreadPoolExecutor(4) as executor:
+            futures = [executor.submit(self.get_resource, query_manager, _id, username)
+                       for _id, username in [("Travis", USER), ("Austin", "other@isi.edu"), ("Dallas", USER),
+                                             ("Houston", USER)]]
+            resources = [future.result() for future in futures]
+        self.assertEqual([resource["label"] for resource in resources],
+                         [["Travis"], ["Austin"], ["Dallas"], ["Houston"]])
+        # One batch of the other graph, two batches of 2 ids of the user's graph
+        self.assertEqual(len(self.endpoint.requests), 3)
+
+    def test_cache(self):
+        query_manager = self.query_manager(batch_wait=0.01, response_cache_size=10)
+        self.get_resource(query_manager, "Travis")
+        self.assertEqual(self.get_resource(query_manager, "Travis")["label"], ["Travis"])
+        self.assertEqual(len(self.endpoint.requests), 1)
+
+    def test_related_resources(self):
+        self.endpoint.responder = respond_related
+        ids = ["Travis", "Texas"]
+        expected = self.get_resources(self.query_manager(), ids)
+        self.assertEqual(expected[0]["partOf"][0]["label"], ["Texas"])
+        self.assertNotIn("description", expected[0]["partOf"][0])
+        self.endpoint.requests.clear()
+
+        # The batch embeds the description of Texas in Travis: Travis and Texas are requested again
+        query_manager = self.query_manager(batch_wait=0.2, response_cache_size=10)
+        self.assertEqual(self.get_resources(query_manager, ids), expected)
+        self.assertEqual(len(self.endpoint.requests), 3)
+        self.assertEqual([self.get_resource(query_manager, _id) for _id in ids], expected)
+
+        query_manager = self.query_manager(AsyncQueryManager, batch_wait=0.05)
+
+        async def main():
+            return await asyncio.gather(*[self.get_resource(query_manager, _id) for _id in ids])
+
+        self.assertEqual(asyncio.run(main()), expected)
+
+    def test_async(self):
+        query_manager = self.query_manager(AsyncQueryManager, batch_wait=0.05)
+
+        async def main():
+            return await asyncio.gather(*[self.get_resource(query_manager, _id) for _id in IDS])
+
+        resources = asyncio.run(main())
+        self.assertEqual([resource.get("label") for resource in resources],
+                         [["Travis"], ["Austin"], ["Travis"], None])
+        self.assertEqual(len(self.endpoint.requests), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+import asyncio
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from obasparql import AsyncQueryManager, QueryManager
+from obasparql.coalescing import AsyncSingleFlight, SingleFlight
+from tests.settings import model_catalog_queries, model_catalog_context, model_catalog_graph_base, \
+    model_catalog_prefix
+from tests.sparql_endpoint import SPARQLEndpoint
+from tests.test_post_resource import Body
+from tests.test_response_cache import REGION_URI, TRAVIS_URI, USER, respond
+
+CALLERS = 5
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_shared_call(self):
+        single_flight = SingleFlight()
+        released = threading.Event()
+        calls = []
+
+        def call():
+            calls.append(1)
+            released.wait(5)
+            return {"label": ["Travis County"]}
+
+        with ThreadPoolExecutor(CALLERS) as executor:
+            futures = [executor.submit(single_flight.do, "key", call) for _ in range(CALLERS)]
+            while single_flight.stats()["shared"] < CALLERS - 1:
+                threading.Event().wait(0.01)
+            released.set()
+            results = [future.result() for future in futures]
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{"label": ["Travis County"]}] * CALLERS)
+        # Each caller has its own copy
+        self.assertEqual(len({id(result) for result in results}), CALLERS)
+        self.assertEqual(single_flight.stats(), {"calls": 1, "shared": CALLERS - 1, "in_flight": 0})
+
+    def test_error(self):
+        single_flight = SingleFlight()
+        with self.assertRaises(ValueError):
+            single_flight.do("key", lambda: int("a"))
+        self.assertEqual(single_flight.do("key", lambda: 1), 1)
+
+    def test_invalidate(self):
+        single_flight = SingleFlight()
+        calls = []
+
+        def call():
+            calls.append(1)
+            if len(calls) == 1:
+                single_flight.invalidate()
+                # The call is not joined after the invalidation
+                self.assertEqual(single_flight.do("key", call), 2)
+            return len(calls)
+
+        single_flight.do("key", call)
+        self.assertEqual(len(calls), 2)
+
+    def test_async(self):
+        single_flight = AsyncSingleFlight()
+        calls = []
+
+        async def call():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {"label": ["Travis County"]}
+
+        async def main():
+            callers = [asyncio.ensure_future(single_flight.do("key", call)) for _ in range(CALLERS)]
+            # A cancelled caller does not cancel the call of the others
+            await asyncio.sleep(0)
+            callers[0].cancel()
+            return await asyncio.gather(*callers[1:])
+
+        results = asyncio.run(main())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{"label": ["Travis County"]}] * (CALLERS - 1))
+        self.assertEqual(len({id(result) for result in results}), CALLERS - 1)
+
+
+class TestQueryManagerCoalescing(unittest.TestCase):
+    def setUp(self):
+        # The endpoint answers when released
+        self.released = threading.Event()
+        self.endpoint = SPARQLEndpoint(self.respond).__enter__()
+        self.addCleanup(self.endpoint.__exit__)
+        self.addCleanup(self.released.set)
+
+    def respond(self, request):
+        if not request["path"].endswith("/update"):
+            self.released.wait(5)
+        return respond(request)
+
+    def query_manager(self, query_manager_class=QueryManager, coalesce_queries=True, **kwargs):
+        return query_manager_class(queries_dir=model_catalog_queries,
+                                   context_dir=model_catalog_context,
+                                   endpoint=self.endpoint.url,
+                                   named_graph_base=model_catalog_graph_base,
+                                   uri_prefix=model_catalog_prefix,
+                                   coalesce_queries=coalesce_queries,
+                                   **kwargs)
+
+    def get_resources(self, query_manager, ids, requests):
+        with ThreadPoolExecutor(len(ids)) as executor:
+            futures = [executor.submit(query_manager.get_resource, rdf_type_uri=REGION_URI, rdf_type_name="Region",
+                                       id=_id, username=USER) for _id in ids]
+            # Every caller has sent the query or joined an identical one
+            while len(self.endpoint.requests) < requests or \
+                    query_manager.single_flight.stats()["shared"] < len(ids) - requests:
+                threading.Event().wait(0.01)
+            self.released.set()
+            return [future.result() for future in futures]
+
+    def test_identical_queries(self):
+        query_manager = self.query_manager()
+        resources = self.get_resources(query_manager, ["Travis"] * CALLERS + ["Austin"], 2)
+        self.assertEqual(len(self.endpoint.requests), 2)
+        self.assertEqual([resource["id"] for resource in resources[:CALLERS]], [TRAVIS_URI] * CALLERS)
+        self.assertEqual(len({id(resource) for resource in resources}), CALLERS + 1)
+        self.assertEqual(query_manager.single_flight.stats()["shared"], CALLERS - 1)
+
+    def test_disabled(self):
+        # Disabled by default
+        query_manager = QueryManager(queries_dir=model_catalog_queries,
+                                     context_dir=model_catalog_context,
+                                     endpoint=self.endpoint.url,
+                                     named_graph_base=model_catalog_graph_base,
+                                     uri_prefix=model_catalog_prefix)
+        self.get_resources(query_manager, ["Travis"] * CALLERS, CALLERS)
+        self.assertEqual(len(self.endpoint.requests), CALLERS)
+
+    def test_write(self):
+        query_manager = self.query_manager()
+        generation = query_manager.single_flight.generation
+        self.released.set()
+        query_manager.post_resource(USER, Body(id=None, type=None, label=["Austin"]), REGION_URI,
+                                    rdf_type_name="Region")
+        self.assertEqual(query_manager.single_flight.generation, generation + 1)
+
+    def test_async(self):
+        query_manager = self.query_manager(AsyncQueryManager)
+
+        async def main():
+            callers = [query_manager.get_resource(rdf_type_uri=REGION_URI, rdf_type_name="Region", id="Travis",
+                                                  username=USER) for _ in range(CALLERS)]
+            return await asyncio.gather(*callers)
+
+        self.released.set()
+        resources = asyncio.run(main())
+        self.assertEqual(len(self.endpoint.requests), 1)
+        self.assertEqual([resource["id"] for resource in resources], [TRAVIS_URI] * CALLERS)
+        self.assertEqual(len({id(resource) for resource in resources}), CALLERS)
+
+
+if __name__ == '__main__':
+    unittest.main()
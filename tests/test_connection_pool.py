@@ -0,0 +1,126 @@
+import asyncio
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.request import Request
+
+from obasparql import QueryManager
+from obasparql.async_sparqlconnector import AsyncConnectionPool
+from obasparql.connection_pool import ConnectionPool
+from obasparql.sparqlconnector import SPARQLConnector
+from tests.settings import model_catalog_queries, model_catalog_context, model_catalog_graph_base, \
+    model_catalog_prefix
+from tests.sparql_endpoint import SPARQLEndpoint
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.endpoint = SPARQLEndpoint().__enter__()
+        self.addCleanup(self.endpoint.__exit__)
+
+    def connector(self, **kwargs):
+        return SPARQLConnector(query_endpoint=self.endpoint.url,
+                               update_endpoint=f"{self.endpoint.url}/update",
+                               method="POST",
+                               returnFormat="json-ld",
+                               **kwargs)
+
+    def test_query_and_update_reuse_the_connection(self):
+        sparql = self.connector()
+        for _ in range(5):
+            self.assertEqual(sparql.query("CONSTRUCT WHERE { ?s ?p ?o }"), b'{"@graph": []}')
+            sparql.update("INSERT DATA { <http://e/s> <http://e/p> <http://e/o> }")
+        self.assertEqual(len(self.endpoint.requests), 10)
+        self.assertEqual(self.endpoint.connections, 1)
+        self.assertEqual(sparql.pool.connections_created, 1)
+        update = self.endpoint.requests[1]
+        self.assertEqual(update["path"], "/ds/update")
+        self.assertEqual(update["headers"]["Content-Type"], "application/sparql-update")
+
+    def test_idle_connections_are_evicted(self):
+        sparql = self.connector(pool_idle_timeout=0.05)
+        sparql.query("CONSTRUCT WHERE { ?s ?p ?o }")
+        self.assertEqual(sparql.pool.idle_connections(self.endpoint.url), 1)
+        time.sleep(0.1)
+        self.assertEqual(sparql.pool.idle_connections(self.endpoint.url), 0)
+        sparql.query("CONSTRUCT WHERE { ?s ?p ?o }")
+        self.assertEqual(self.endpoint.connections, 2)
+
+    def test_maxsize(self):
+        sparql = self.connector(pool_maxsize=2)
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            list(executor.map(lambda _: sparql.query("CONSTRUCT WHERE { ?s ?p ?o }"), range(30)))
+        self.assertLessEqual(sparql.pool.idle_connections(self.endpoint.url), 2)
+
+    def test_connection_closed_by_the_server(self):
+        self.endpoint.close_after_response = True
+        sparql = self.connector()
+        for _ in range(3):
+            self.assertEqual(sparql.query("CONSTRUCT WHERE { ?s ?p ?o }"), b'{"@graph": []}')
+        self.assertEqual(len(self.endpoint.requests), 3)
+
+    def drop_second_request(self):
+        """Answer the first request and close the connection after receiving the second one"""
+        responses = [(200, "text/plain", b"ok"), None]
+        ok = (200, "text/plain", b"ok")
+        self.endpoint.responder = lambda request: responses.pop(0) if responses else ok
+
+    def test_update_is_not_resent_on_a_lost_connection(self):
+        self.drop_second_request()
+        pool = ConnectionPool()
+        pool.urlopen(Request(self.endpoint.url, data=b"update"))
+        with self.assertRaises(ConnectionError):
+            pool.urlopen(Request(self.endpoint.url, data=b"update"))
+        self.assertEqual(len(self.endpoint.requests), 2)
+
+    def test_query_is_resent_on_a_lost_connection(self):
+        self.drop_second_request()
+        pool = ConnectionPool()
+        pool.urlopen(Request(self.endpoint.url))
+        self.assertEqual(pool.urlopen(Request(self.endpoint.url)).read(), b"ok")
+        self.assertEqual(len(self.endpoint.requests), 3)
+        self.assertEqual(pool.connections_created, 2)
+        # A POST query of the connector is idempotent too
+        self.drop_second_request()
+        self.assertEqual(self.connector().query("CONSTRUCT WHERE { ?s ?p ?o }"), b"ok")
+
+    def test_async_update_is_not_resent_on_a_lost_connection(self):
+        pool = AsyncConnectionPool()
+
+        async def run(idempotent):
+            await pool.urlopen(Request(self.endpoint.url, data=b"request"))
+            return await pool.urlopen(Request(self.endpoint.url, data=b"request"), idempotent)
+
+        self.drop_second_request()
+        with self.assertRaises(asyncio.IncompleteReadError):
+            asyncio.run(run(None))
+        self.assertEqual(len(self.endpoint.requests), 2)
+        self.drop_second_request()
+        self.assertEqual(asyncio.run(run(True)).read(), b"ok")
+        self.assertEqual(len(self.endpoint.requests), 5)
+
+    def test_http_error(self):
+        self.endpoint.responder = lambda request: (500, "text/plain", b"error")
+        pool = ConnectionPool()
+        with self.assertRaises(HTTPError) as context:
+            pool.urlopen(Request(self.endpoint.url, data=b"query"))
+        self.assertEqual(context.exception.code, 500)
+        self.assertEqual(context.exception.read(), b"error")
+        # The connection is still usable
+        self.assertEqual(pool.idle_connections(self.endpoint.url), 1)
+
+    def test_query_manager_pool_settings(self):
+        query_manager = QueryManager(queries_dir=model_catalog_queries,
+                                     context_dir=model_catalog_context,
+                                     endpoint=self.endpoint.url,
+                                     named_graph_base=model_catalog_graph_base,
+                                     uri_prefix=model_catalog_prefix,
+                                     pool_maxsize=3,
+                                     pool_idle_timeout=5)
+        self.assertEqual(query_manager.sparql.pool.maxsize, 3)
+        self.assertEqual(query_manager.sparql.pool.idle_timeout, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import asyncio
+import json
+import re
+import unittest
+
+from rdflib.plugins.sparql.parser import parseQuery
+from starlette.exceptions import HTTPException
+
+from obasparql import AsyncQueryManager, QueryManager
+from obasparql.pagination import ResourcePage
+from tests.settings import model_catalog_queries, model_catalog_context, model_catalog_graph_base, \
+    model_catalog_prefix
+from tests.sparql_endpoint import SPARQLEndpoint
+from tests.test_post_resource import Body
+
+REGION_URI = "https://w3id.org/okn/o/sdm#Region"
+REGIONS = [f"https://w3id.org/okn/i/mint/Region_{i:02}" for i in range(25)]
+USER = "mint@isi.edu"
+CONTEXT = {
+    "label": {"@id": "http://www.w3.org/2000/01/rdf-schema#label"}
+}
+
+
+class TestCount(unittest.TestCase):
+    query_manager_class = QueryManager
+
+    def setUp(self):
+        self.regions = list(REGIONS)
+        self.endpoint = SPARQLEndpoint(self.respond).__enter__()
+        self.addCleanup(self.endpoint.__exit__)
+        self.query_manager = self.query_manager_class(queries_dir=model_catalog_queries,
+                                                      context_dir=model_catalog_context,
+                                                      endpoint=self.endpoint.url,
+                                                      named_graph_base=model_catalog_graph_base,
+                                                      uri_prefix=model_catalog_prefix)
+
+    def respond(self, request):
+        """Count the regions, or return the regions of the page"""
+        if request["path"].endswith("/update"):
+            self.regions.append(f"https://w3id.org/okn/i/mint/Region_{len(self.regions):02}")
+            return 200, "text/plain", b""
+        if request["headers"]["Accept"] == "application/sparql-results+json":
+            bindings = [{"count": {"type": "literal", "value": str(len(self.regions)),
+                                   "datatype": "http://www.w3.org/2001/XMLSchema#integer"}}]
+            return 200, "application/sparql-results+json", json.dumps({
+                "head": {"vars": ["count"]}, "results": {"bindings": bindings}}).encode()
+        limit = int(re.search(r"LIMIT (\d+)", request["body"]).group(1))
+        offset = int(re.search(r"OFFSET (\d+)", request["body"]).group(1))
+        graph = [{"@id": iri, "@type": REGION_URI, "label": iri.rsplit("/", 1)[1]}
+                 for iri in self.regions[offset:offset + limit]]
+        return 200, "application/ld+json", json.dumps({"@graph": graph, "@context": CONTEXT}).encode()
+
+    def call(self, response):
+        return response
+
+    def get_resource(self, rdf_type_name="Region", **kwargs):
+        return self.call(self.query_manager.get_resource(rdf_type_uri=REGION_URI, rdf_type_name=rdf_type_name,
+                                                         **kwargs))
+
+    def count_queries(self):
+        return [request["body"] for request in self.endpoint.requests
+                if request["headers"]["Accept"] == "application/sparql-results+json"]
+
+    def test_count(self):
+        page = self.get_resource(username=USER, page=2, per_page=10, count=True)
+        self.assertIsInstance(page, ResourcePage)
+        self.assertEqual(page.total, 25)
+        self.assertEqual(sorted(resource["id"] for resource in page), REGIONS[10:20])
+
+        queries = self.count_queries()
+        self.assertEqual(len(queries), 1)
+        self.assertIn("SELECT (COUNT(DISTINCT ?item) AS ?count)", queries[0])
+        self.assertIn("GRAPH <http://endpoint.mint.isi.edu/modelCatalog-1.8.0/data/mint@isi.edu>", queries[0])
+        self.assertNotIn("LIMIT", queries[0])
+        parseQuery(queries[0])
+
+        # The total is cached by query and graph
+        self.assertEqual(self.get_resource(username=USER, page=3, per_page=10, count=True).total, 25)
+        self.assertEqual(self.get_resource(count=True).total, 25)
+        self.assertEqual(len(self.count_queries()), 2)
+        self.assertEqual(len(self.endpoint.requests), 5)
+
+    def test_count_with_cursor(self):
+        page = self.get_resource(username=USER, cursor="", per_page=10, count=True)
+        self.assertEqual(page.total, 25)
+        self.assertIsNotNone(page.next_cursor)
+
+    def test_without_count(self):
+        self.assertNotIsInstance(self.get_resource(username=USER, page=1, per_page=10), ResourcePage)
+        self.assertEqual(self.count_queries(), [])
+
+    def test_write_invalidates_the_count(self):
+        self.get_resource(username=USER, count=True)
+        self.get_resource(count=True)
+        body = Body(id=None, type=None, label=["Austin"])
+        self.call(self.query_manager.post_resource("other@isi.edu", body, REGION_URI, rdf_type_name="Region"))
+        # The total of the user's graph is still cached, the total of every graph is removed
+        self.assertEqual(self.get_resource(username=USER, count=True).total, 25)
+        self.assertEqual(self.get_resource(count=True).total, 26)
+        self.assertEqual(len(self.count_queries()), 3)
+
+    def test_bad_request(self):
+        # The custom query has no subquery that selects the items
+        with self.assertRaises(HTTPException) as context:
+            self.get_resource(rdf_type_name="custom", custom_query_name="custom_modelconfigurations",
+                              username=USER, count=True)
+        self.assertEqual(context.exception.status_code, 400)
+        self.assertEqual(self.endpoint.requests, [])
+
+
+class TestAsyncCount(TestCount):
+    query_manager_class = AsyncQueryManager
+
+    def call(self, response):
+        return asyncio.run(response)
+
+
+if __name__ == '__main__':
+    unittest.main()
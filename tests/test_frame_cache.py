@@ -0,0 +1,71 @@
+import json
+import unittest
+
+from obasparql import QueryManager
+from obasparql.caching import LRUCache
+from tests.settings import model_catalog_queries, model_catalog_context, model_catalog_endpoint, \
+    model_catalog_graph_base, model_catalog_prefix, path
+
+MODEL_URI = "https://w3id.org/okn/o/sdm#Model"
+CYCLES = "https://w3id.org/okn/i/mint/CYCLES"
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.stats(), {"hits": 3, "misses": 1, "size": 2, "maxsize": 2})
+
+    def test_disabled(self):
+        cache = LRUCache(0)
+        cache.put("a", 1)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+
+class TestFrameCache(unittest.TestCase):
+    def setUp(self):
+        with open(path / "tests/inputs/input.json") as reader:
+            self.response = reader.read()
+
+    def query_manager(self, **kwargs) -> QueryManager:
+        return QueryManager(queries_dir=model_catalog_queries,
+                            context_dir=model_catalog_context,
+                            endpoint=model_catalog_endpoint,
+                            named_graph_base=model_catalog_graph_base,
+                            uri_prefix=model_catalog_prefix,
+                            **kwargs)
+
+    def test_frame_is_reused(self):
+        query_manager = self.query_manager()
+        uncached = self.query_manager(frame_cache_size=0)
+        expected = uncached.frame_results(self.response, MODEL_URI, CYCLES)
+        self.assertEqual(expected["id"], CYCLES)
+
+        for _ in range(3):
+            self.assertEqual(query_manager.frame_results(self.response, MODEL_URI, CYCLES), expected)
+        self.assertEqual(query_manager.frame_results(self.response, MODEL_URI),
+                         uncached.frame_results(self.response, MODEL_URI))
+        self.assertEqual(query_manager.frame_cache.stats(), {"hits": 3, "misses": 1, "size": 1, "maxsize": 128})
+
+    def test_key(self):
+        query_manager = self.query_manager(frame_cache_size=2)
+        query_manager.frame_results(self.response, MODEL_URI)
+        query_manager.frame_results(self.response, "https://w3id.org/okn/o/sdm#Theory-GuidedModel")
+        response = json.loads(self.response)
+        # Same context with another order of the keys
+        response["@context"] = dict(reversed(list(response["@context"].items())))
+        query_manager.frame_results(json.dumps(response), MODEL_URI)
+        response["@context"]["other"] = {"@id": "https://example.org/other"}
+        query_manager.frame_results(json.dumps(response), MODEL_URI)
+        self.assertEqual(query_manager.frame_cache.stats(), {"hits": 1, "misses": 3, "size": 2, "maxsize": 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import copy
+import json
+import unittest
+
+from pyld import jsonld
+
+from obasparql import QueryManager
+from obasparql.framing import Framer
+from obasparql.ntriples import UnsupportedJSONLD
+from obasparql.static import EMBED_OPTION
+from tests.settings import model_catalog_queries, model_catalog_context, model_catalog_endpoint, \
+    model_catalog_graph_base, model_catalog_prefix, path
+
+SD = "https://w3id.org/okn/o/sd#"
+SDM = "https://w3id.org/okn/o/sdm#"
+MODEL_URI = SDM + "Model"
+PERSON_URI = SD + "Person"
+CYCLES = "https://w3id.org/okn/i/mint/CYCLES"
+ARMEN = "https://w3id.org/okn/i/mint/kemanian_armen"
+XSD_DATE_TIME = "http://www.w3.org/2001/XMLSchema#dateTime"
+
+
+def read_json(name: str):
+    with open(path / "tests/inputs" / name) as reader:
+        return json.load(reader)
+
+
+class TestFramer(unittest.TestCase):
+    """The output of the Framer must be the output of pyld, including the order of the keys and the values"""
+
+    def setUp(self):
+        self.query_manager = QueryManager(queries_dir=model_catalog_queries,
+                                          context_dir=model_catalog_context,
+                                          endpoint=model_catalog_endpoint,
+                                          named_graph_base=model_catalog_graph_base,
+                                          uri_prefix=model_catalog_prefix)
+        self.response = read_json("input.json")
+
+    def frame(self, response: dict, owl_class_uri: str, owl_resource_iri=None):
+        """Frame the response with the Framer and with pyld, as QueryManager.frame_results"""
+        response_context, frame = self.query_manager.build_frame(copy.deepcopy(response["@context"]), owl_class_uri)
+        framer = Framer(response_context, frame)
+        self.assertTrue(framer.supported, framer.reason)
+        framed = framer.frame(copy.deepcopy(response["@graph"]), owl_resource_iri)
+
+        if owl_resource_iri is not None:
+            frame = dict(frame, **{"@id": owl_resource_iri})
+        expected = jsonld.frame({"@graph": copy.deepcopy(response["@graph"]), "@context": response_context}, frame,
+                                {"embed": EMBED_OPTION})
+        expected = expected.get("@graph", {key: value for key, value in expected.items() if key != "@context"})
+        return framed, expected
+
+    def assert_same_output(self, response: dict, owl_class_uri: str, owl_resource_iri=None):
+        framed, expected = self.frame(response, owl_class_uri, owl_resource_iri)
+        self.assertEqual(json.dumps(framed), json.dumps(expected))
+        return framed
+
+    def test_input(self):
+        framed = self.assert_same_output(self.response, MODEL_URI, CYCLES)
+        self.assertEqual(framed["id"], CYCLES)
+        for author in framed["author"]:
+            self.assertIsInstance(author, dict)
+
+        self.assertEqual(len(self.assert_same_output(self.response, PERSON_URI)), 4)
+        self.assertEqual(len(self.assert_same_output(self.response, MODEL_URI, [CYCLES, ARMEN])), 2)
+        self.assertEqual(self.assert_same_output(self.response, MODEL_URI, "https://w3id.org/okn/i/mint/none"), {})
+        self.assertEqual(self.assert_same_output(self.response, SD + "Unknown"), {})
+
+    def test_framed(self):
+        """The frame of tests/inputs/frame.json has a typed context: the values that do not match the type of
+        their term use compact IRIs"""
+        frame = read_json("frame.json")
+        frame["@context"] = frame["@context"]["@context"]
+        framer = Framer(self.response["@context"], frame)
+        self.assertTrue(framer.supported, framer.reason)
+        framed = framer.frame(self.response["@graph"])
+        self.assertEqual(framed, read_json("framed.json")["@graph"][0])
+        self.assertEqual(framed["sd:dateCreated"], "2016")
+
+    def test_page(self):
+        """A page of get_all with resources that reference each other and typed values"""
+        cycles = next(node for node in self.response["@graph"] if node["@id"] == CYCLES)
+        response = copy.deepcopy(self.response)
+        response["@context"]["dateCreated"]["@type"] = XSD_DATE_TIME
+        for i in range(100):
+            model = copy.deepcopy(cycles)
+            model["@id"] = f"{CYCLES}_{i}"
+            model["label"] = [f"Cycles {i}", f"Cycles {i}"]
+            model["dateCreated"] = [{"@value": "2016", "@type": SD + "year"}, "2020-01-01T00:00:00"]
+            model["hasVersion"] = [f"{CYCLES}_{i ^ 1}"] if i else [f"{CYCLES}_1", model["@id"]]
+            model["hasMinimumAcceptedValue"] = [1, True, 1.5]
+            response["@graph"].append(model)
+        self.assertEqual(len(self.assert_same_output(response, MODEL_URI)), 101)
+        framed = self.assert_same_output(response, MODEL_URI, f"{CYCLES}_0")
+        # The parent is embedded again, the other ancestors are references
+        versions = framed["hasVersion"]
+        self.assertEqual(versions[0]["hasVersion"], [f"{CYCLES}_0"])
+        self.assertEqual(versions[1]["id"], f"{CYCLES}_0")
+        self.assertEqual(versions[1]["hasVersion"][0]["id"], f"{CYCLES}_1")
+        self.assertEqual(versions[1]["hasVersion"][1], f"{CYCLES}_0")
+
+    def test_unsupported(self):
+        response_context, frame = self.query_manager.build_frame(copy.deepcopy(self.response["@context"]),
+                                                                 MODEL_URI)
+        framer = Framer(response_context, frame)
+        for graph in [[{"@type": MODEL_URI, "label": "blank node"}],
+                      [{"@id": "_:b0", "@type": MODEL_URI}],
+                      [{"@id": "relative", "@type": MODEL_URI}],
+                      [{"@id": CYCLES, "@type": MODEL_URI, "label": {"@value": "Cycles", "@language": "en"}}],
+                      [{"@id": CYCLES, "@type": MODEL_URI, "label": {"@list": ["a", "b"]}}],
+                      [{"@id": CYCLES, "@type": MODEL_URI, "author": 1}]]:
+            with self.subTest(graph=graph):
+                with self.assertRaises(UnsupportedJSONLD):
+                    framer.frame(graph)
+
+        for context in [{"@vocab": SD}, {"label": {"@id": "rdfs:label", "@language": "en"}},
+                        {"hasParameter": {"@id": SD + "hasParameter", "@container": "@list"}}]:
+            with self.subTest(context=context):
+                framer = Framer(context, frame)
+                self.assertFalse(framer.supported)
+                with self.assertRaises(UnsupportedJSONLD):
+                    framer.frame(self.response["@graph"])
+
+    def test_query_manager_fallback(self):
+        response = copy.deepcopy(self.response)
+        response["@graph"][1]["label"] = {"@value": "Cycles", "@language": "en"}
+        framed = self.query_manager.frame_results(json.dumps(response), MODEL_URI, CYCLES)
+        self.assertEqual(framed["label"], [{"@language": "en", "@value": "Cycles"}])
+        self.assertEqual(framed["author"], self.query_manager.frame_results(json.dumps(self.response), MODEL_URI,
+                                                                            CYCLES)["author"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import asyncio
+import json
+import re
+import unittest
+
+from obasparql import AsyncQueryManager, QueryManager
+from tests.settings import model_catalog_queries, model_catalog_context, model_catalog_graph_base, \
+    model_catalog_prefix
+from tests.sparql_endpoint import SPARQLEndpoint
+
+REGION_URI = "https://w3id.org/okn/o/sdm#Region"
+MISSING = "https://w3id.org/okn/i/mint/Missing"
+
+
+def respond_regions(request):
+    """Return the regions requested by the query (in the VALUES block or in the graph pattern)"""
+    uris = set(re.findall(r"<(https://w3id.org/okn/i/mint/[^>]+)>", request["body"]))
+    graph = [{
+        "@id": uri,
+        "@type": REGION_URI,
+        "label": uri.rsplit("/", 1)[1],
+        "partOf": "https://w3id.org/okn/i/mint/Texas"
+    } for uri in sorted(uris) if uri != MISSING]
+    graph.append({"@id": "https://w3id.org/okn/i/mint/Texas", "@type": REGION_URI, "label": "Texas"})
+    body = {
+        "@graph": graph,
+        "@context": {
+            "label": {"@id": "http://www.w3.org/2000/01/rdf-schema#label"},
+            "partOf": {"@id": "https://w3id.org/okn/o/sdm#partOf", "@type": "@id"}
+        }
+    }
+    return 200, "application/ld+json", json.dumps(body).encode()
+
+
+class TestGetResources(unittest.TestCase):
+    query_manager_class = QueryManager
+
+    def setUp(self):
+        self.endpoint = SPARQLEndpoint(respond_regions).__enter__()
+        self.addCleanup(self.endpoint.__exit__)
+        self.query_manager = self.query_manager_class(queries_dir=model_catalog_queries,
+                                                      context_dir=model_catalog_context,
+                                                      endpoint=self.endpoint.url,
+                                                      named_graph_base=model_catalog_graph_base,
+                                                      uri_prefix=model_catalog_prefix)
+
+    def get_resources(self, ids, **kwargs):
+        return self.query_manager.get_resources(ids=ids,
+                                                rdf_type_uri=REGION_URI,
+                                                rdf_type_name="Region",
+                                                username="mint@isi.edu",
+                                                **kwargs)
+
+    def test_one_query(self):
+        ids = ["Travis", "Austin", "https://w3id.org/okn/i/mint/Dallas"]
+        resources = self.get_resources(ids)
+        self.assertEqual(list(resources), ids)
+        self.assertEqual(resources["Travis"]["id"], "https://w3id.org/okn/i/mint/Travis")
+        self.assertEqual(resources["Austin"]["label"], ["Austin"])
+        self.assertEqual(resources["https://w3id.org/okn/i/mint/Dallas"]["partOf"][0]["label"], ["Texas"])
+        self.assertEqual(len(self.endpoint.requests), 1)
+        query = self.endpoint.requests[0]["body"]
+        self.assertIn("VALUES ?_resource_iri { <https://w3id.org/okn/i/mint/Travis> "
+                      "<https://w3id.org/okn/i/mint/Austin> <https://w3id.org/okn/i/mint/Dallas> }", query)
+        self.assertIn("GRAPH <{}mint@isi.edu>".format(model_catalog_graph_base), query)
+
+    def test_missing_resource(self):
+        resources = self.get_resources(["Travis", "Missing"])
+        self.assertIsNone(resources["Missing"])
+        self.assertIsNotNone(resources["Travis"])
+
+    def test_chunks(self):
+        ids = [f"Region{i}" for i in range(7)]
+        resources = self.get_resources(ids + ["Region0"], chunk_size=3)
+        self.assertEqual(list(resources), ids)
+        self.assertTrue(all(resources.values()))
+        self.assertEqual(len(self.endpoint.requests), 3)
+
+
+class TestAsyncGetResources(TestGetResources):
+    query_manager_class = AsyncQueryManager
+
+    def get_resources(self, ids, **kwargs):
+        return asyncio.run(super().get_resources(ids, **kwargs))
+
+
+if __name__ == '__main__':
+    unittest.main()
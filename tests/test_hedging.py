@@ -0,0 +1,146 @@
+import asyncio
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from obasparql import QueryManager
+from obasparql.async_sparqlconnector import AsyncSPARQLConnector
+from obasparql.replicas import DEFAULT_HEDGE_WORKERS, HedgingPolicy
+from obasparql.sparqlconnector import SPARQLConnector
+from tests.settings import model_catalog_queries, model_catalog_context, model_catalog_graph_base, \
+    model_catalog_prefix
+from tests.sparql_endpoint import SPARQLEndpoint
+
+QUERY = "CONSTRUCT WHERE { ?s ?p ?o }"
+RESPONSE = b'{"@graph": []}'
+
+
+class TestHedgingPolicy(unittest.TestCase):
+    def test_delay(self):
+        policy = HedgingPolicy(percentile=90, min_delay=0.01, min_samples=10)
+        for latency in range(9):
+            policy.record(latency / 100)
+        self.assertIsNone(policy.delay())
+        policy.record(0.5)
+        self.assertEqual(policy.delay(), 0.5)
+        for _ in range(10):
+            policy.record(0)
+        self.assertEqual(policy.delay(), 0.08)
+
+    def test_budget(self):
+        policy = HedgingPolicy(budget=0.25)
+        hedged = [policy.delay() is None and policy.try_hedge() for _ in range(8)]
+        self.assertEqual(hedged, [False, False, False, True, False, False, False, True])
+        self.assertEqual(policy.stats()["hedged"], 2)
+
+
+class TestHedging(unittest.TestCase):
+    def setUp(self):
+        # The first replica answers after 0.5 seconds
+        self.replicas = [self.endpoint(0.5), self.endpoint(0)]
+
+    def endpoint(self, delay):
+        def respond(request):
+            time.sleep(delay)
+            return 200, "application/ld+json", RESPONSE
+
+        endpoint = SPARQLEndpoint(respond).__enter__()
+        self.addCleanup(endpoint.__exit__)
+        return endpoint
+
+    def connector(self, connector_class=SPARQLConnector, budget=1.0):
+        hedging = HedgingPolicy(budget=budget, min_samples=1)
+        hedging.record(0.01)
+        return connector_class(query_endpoint=[replica.url for replica in self.replicas],
+                               update_endpoint=f"{self.replicas[0].url}/update",
+                               method="POST",
+                               returnFormat="json-ld",
+                               hedging=hedging)
+
+    def test_hedged_query(self):
+        sparql = self.connector()
+        start = time.monotonic()
+        self.assertEqual(sparql.query(QUERY), RESPONSE)
+        self.assertLess(time.monotonic() - start, 0.4)
+        self.assertEqual([len(replica.requests) for replica in self.replicas], [1, 1])
+        self.assertEqual(sparql.stats()["hedged"], 1)
+        self.assertEqual(sparql.stats()["hedge_wins"], 1)
+
+    def test_losing_request_is_cancelled(self):
+        sparql = self.connector()
+        self.assertEqual(sparql.query(QUERY), RESPONSE)
+        # The request to the slow replica is aborted without waiting for its response, and it is
+        # not a failure of the replica
+        time.sleep(0.1)
+        slow = sparql.replicas.replicas[0]
+        self.assertEqual(slow.outstanding, 0)
+        self.assertEqual(slow.breaker.failures, 0)
+        self.assertEqual(sparql.pool.idle_connections(self.replicas[0].url), 0)
+
+    def test_concurrent_queries(self):
+        # The replicas answer after 1 second and record the queries in flight: they are not bounded by the threads
+        # of the hedged requests
+        in_flight = []
+        lock = threading.Lock()
+
+        def respond(request):
+            with lock:
+                in_flight.append(in_flight[-1] + 1 if in_flight else 1)
+            time.sleep(1)
+            with lock:
+                in_flight.append(in_flight[-1] - 1)
+            return 200, "application/ld+json", RESPONSE
+
+        self.replicas = []
+        for _ in range(2):
+            self.replicas.append(SPARQLEndpoint(respond).__enter__())
+            self.addCleanup(self.replicas[-1].__exit__)
+        sparql = self.connector(budget=0)
+        queries = 2 * DEFAULT_HEDGE_WORKERS
+        with ThreadPoolExecutor(queries) as executor:
+            responses = list(executor.map(lambda _: sparql.query(QUERY), range(queries)))
+        self.assertEqual(responses, [RESPONSE] * queries)
+        self.assertGreater(max(in_flight), DEFAULT_HEDGE_WORKERS)
+        self.assertIsNone(sparql.hedging_executor)
+
+    def test_close(self):
+        sparql = self.connector()
+        sparql.query(QUERY)
+        self.assertIsNotNone(sparql.hedging_executor)
+        sparql.close()
+        self.assertIsNone(sparql.hedging_executor)
+        self.assertEqual(sparql.query(QUERY), RESPONSE)
+
+    def test_budget(self):
+        sparql = self.connector(budget=0)
+        self.assertEqual(sparql.query(QUERY), RESPONSE)
+        self.assertEqual([len(replica.requests) for replica in self.replicas], [1, 0])
+        self.assertEqual(sparql.stats()["hedged"], 0)
+
+    def test_primary_is_not_hedged(self):
+        sparql = self.connector()
+        self.assertEqual(sparql.query(QUERY, primary=True), RESPONSE)
+        self.assertEqual(sparql.stats()["hedged"], 0)
+
+    def test_async(self):
+        sparql = self.connector(AsyncSPARQLConnector)
+        start = time.monotonic()
+        self.assertEqual(asyncio.run(sparql.query(QUERY)), RESPONSE)
+        self.assertLess(time.monotonic() - start, 0.4)
+        self.assertEqual(sparql.stats()["hedge_wins"], 1)
+
+    def test_query_manager(self):
+        query_manager = QueryManager(queries_dir=model_catalog_queries,
+                                     context_dir=model_catalog_context,
+                                     endpoint=self.replicas[0].url,
+                                     query_endpoints=[replica.url for replica in self.replicas],
+                                     named_graph_base=model_catalog_graph_base,
+                                     uri_prefix=model_catalog_prefix,
+                                     hedge_percentile=99)
+        self.assertEqual(query_manager.sparql.hedging.percentile, 99)
+        self.assertTrue(query_manager.sparql.hedged)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import asyncio
+import json
+import threading
+import time
+import unittest
+
+from obasparql import AsyncQueryManager, QueryManager
+from obasparql.query_manager import COUNT_EXECUTOR, PREFETCH_EXECUTOR
+from tests.settings import model_catalog_queries, model_catalog_context, model_catalog_graph_base, \
+    model_catalog_prefix
+from tests.sparql_endpoint import SPARQLEndpoint
+from tests.test_keyset_pagination import REGION_URI, REGIONS, respond
+
+
+class TestIterResources(unittest.TestCase):
+    def setUp(self):
+        # The endpoint answers the pages after the first one when released
+        self.released = threading.Event()
+        self.endpoint = SPARQLEndpoint(self.respond).__enter__()
+        self.addCleanup(self.endpoint.__exit__)
+        self.addCleanup(self.released.set)
+
+    def respond(self, request):
+        if "COUNT(" in request["body"]:
+            bindings = [{"count": {"type": "literal", "value": str(len(REGIONS))}}]
+            return 200, "application/sparql-results+json", json.dumps({"results": {"bindings": bindings}}).encode()
+        if "FILTER" in request["body"]:
+            self.released.wait(10)
+        return respond(request)
+
+    def query_manager(self, query_manager_class):
+        return query_manager_class(queries_dir=model_catalog_queries,
+                                   context_dir=model_catalog_context,
+                                   endpoint=self.endpoint.url,
+                                   named_graph_base=model_catalog_graph_base,
+                                   uri_prefix=model_catalog_prefix)
+
+    def test_iter_resources(self):
+        resources = self.query_manager(QueryManager).iter_resources(REGION_URI, "Region", page_size=10)
+        ids = [next(resources)["id"]]
+        # The second page is requested while the first one is consumed
+        ids.extend(next(resources)["id"] for _ in range(9))
+        deadline = time.monotonic() + 10
+        while len(self.endpoint.requests) < 2:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        self.released.set()
+        ids.extend(resource["id"] for resource in resources)
+        # Each region is yielded once, the nested regions of the next page are skipped
+        self.assertEqual(ids, REGIONS)
+        self.assertEqual(len(self.endpoint.requests), 3)
+        for request in self.endpoint.requests:
+            self.assertIn("LIMIT 11", request["body"])
+
+    def test_async_iter_resources(self):
+        query_manager = self.query_manager(AsyncQueryManager)
+        self.released.set()
+
+        async def run():
+            return [resource["id"] async for resource in query_manager.iter_resources(REGION_URI, "Region",
+                                                                                     username="mint@isi.edu",
+                                                                                     page_size=10)]
+
+        self.assertEqual(asyncio.run(run()), REGIONS)
+        self.assertEqual(len(self.endpoint.requests), 3)
+
+    def test_close(self):
+        resources = self.query_manager(QueryManager).iter_resources(REGION_URI, "Region", page_size=10)
+        next(resources)
+        resources.close()
+        self.released.set()
+        self.assertLessEqual(len(self.endpoint.requests), 2)
+
+    def test_thread_pools(self):
+        self.released.set()
+        self.assertEqual(self.query_manager(AsyncQueryManager).executors, {})
+        with self.query_manager(QueryManager) as query_manager:
+            self.assertEqual(query_manager.executors, {})
+            list(query_manager.iter_resources(REGION_URI, "Region", page_size=10))
+            query_manager.get_resource(rdf_type_uri=REGION_URI, rdf_type_name="Region", per_page=10, count=True)
+            # The count queries do not wait for the prefetch of the pages
+            self.assertEqual(sorted(query_manager.executors), [COUNT_EXECUTOR, PREFETCH_EXECUTOR])
+            executors = list(query_manager.executors.values())
+        self.assertEqual(query_manager.executors, {})
+        self.assertTrue(all(executor._shutdown for executor in executors))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+import asyncio
+import json
+import re
+import unittest
+
+from rdflib.plugins.sparql.parser import parseQuery
+from starlette.exceptions import HTTPException
+
+from obasparql import AsyncQueryManager, QueryManager
+from obasparql.pagination import ResourcePage, build_page, decode_cursor, encode_cursor
+from tests.settings import model_catalog_queries, model_catalog_context, model_catalog_graph_base, \
+    model_catalog_prefix
+from tests.sparql_endpoint import SPARQLEndpoint
+
+REGION_URI = "https://w3id.org/okn/o/sdm#Region"
+REGIONS = [f"https://w3id.org/okn/i/mint/Region_{i:02}" for i in range(25)]
+CONTEXT = {
+    "label": {"@id": "http://www.w3.org/2000/01/rdf-schema#label"},
+    "partOf": {"@id": "https://w3id.org/okn/o/sdm#partOf", "@type": "@id"}
+}
+
+
+def respond(request):
+    """Select the regions after the IRI of the FILTER, as the triple store. Each region is part of the
+    next one, which is returned as a nested resource"""
+    after = re.search(r'FILTER\(STR\(\?item\) > "([^"]*)"\)', request["body"])
+    limit = int(re.search(r"LIMIT (\d+)", request["body"]).group(1))
+    offset = int(re.search(r"OFFSET (\d+)", request["body"]).group(1))
+    items = [iri for iri in REGIONS if after is None or iri > after.group(1)][offset:offset + limit]
+    graph = []
+    for iri in items:
+        node = {"@id": iri, "@type": REGION_URI, "label": iri.rsplit("/", 1)[1]}
+        following = REGIONS.index(iri) + 1
+        if following < len(REGIONS):
+            node["partOf"] = REGIONS[following]
+            graph.append({"@id": REGIONS[following], "@type": REGION_URI})
+        graph.append(node)
+    return 200, "application/ld+json", json.dumps({"@graph": graph, "@context": CONTEXT}).encode()
+
+
+class TestCursor(unittest.TestCase):
+    def test_decode(self):
+        self.assertEqual(decode_cursor(encode_cursor(REGIONS[0])), REGIONS[0])
+        self.assertEqual(decode_cursor(""), "")
+        for cursor in ["not base64!", encode_cursor('http://example.org/" } DROP ALL #')]:
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(ValueError):
+                    decode_cursor(cursor)
+
+    def test_build_page(self):
+        resources = [{"id": REGIONS[3]}, {"id": REGIONS[0]}, {"id": REGIONS[1]}, {"id": REGIONS[2]}]
+        page = build_page(resources, "id", REGIONS[0], 2)
+        self.assertEqual(page, resources)
+        self.assertEqual(decode_cursor(page.next_cursor), REGIONS[2])
+        self.assertIsNone(build_page(resources, "id", REGIONS[0], 4).next_cursor)
+        self.assertEqual(build_page({}, "id", "", 2), [])
+        self.assertEqual(build_page({"id": REGIONS[0]}, "id", "", 2), [{"id": REGIONS[0]}])
+
+        page = build_page(resources, "id", REGIONS[0], 2, lookahead=1)
+        self.assertEqual(page, resources[1:])
+        self.assertEqual((decode_cursor(page.next_cursor), page.has_next), (REGIONS[2], True))
+        page = build_page(resources, "id", REGIONS[1], 2, lookahead=1)
+        self.assertEqual((page, page.next_cursor, page.has_next), (resources, None, False))
+
+
+class TestKeysetPagination(unittest.TestCase):
+    query_manager_class = QueryManager
+
+    def setUp(self):
+        self.endpoint = SPARQLEndpoint(respond).__enter__()
+        self.addCleanup(self.endpoint.__exit__)
+        self.query_manager = self.query_manager_class(queries_dir=model_catalog_queries,
+                                                      context_dir=model_catalog_context,
+                                                      endpoint=self.endpoint.url,
+                                                      named_graph_base=model_catalog_graph_base,
+                                                      uri_prefix=model_catalog_prefix)
+
+    def get_resource(self, rdf_type_name="Region", **kwargs):
+        return self.query_manager.get_resource(rdf_type_uri=REGION_URI, rdf_type_name=rdf_type_name, **kwargs)
+
+    def test_pages(self):
+        pages = []
+        cursor = ""
+        while cursor is not None:
+            page = self.get_resource(username="mint@isi.edu", cursor=cursor, per_page=10)
+            self.assertIsInstance(page, ResourcePage)
+            pages.append(sorted(resource["id"] for resource in page))
+            cursor = page.next_cursor
+        # Each page has the selected regions and the nested region that follows them
+        self.assertEqual(pages, [REGIONS[:11], REGIONS[10:21], REGIONS[20:]])
+
+        queries = [request["body"] for request in self.endpoint.requests]
+        self.assertNotIn("FILTER", queries[0])
+        self.assertIn(f'FILTER(STR(?item) > "{REGIONS[9]}")', queries[1])
+        self.assertIn(f'FILTER(STR(?item) > "{REGIONS[19]}")', queries[2])
+        for query in queries:
+            self.assertIn("ORDER BY STR(?item) LIMIT 10", query)
+            self.assertIn("OFFSET 0", query)
+            parseQuery(query)
+
+    def test_has_next(self):
+        pages = []
+        cursor = ""
+        while cursor is not None:
+            page = self.get_resource(cursor=cursor, per_page=10, has_next=True)
+            pages.append((sorted(resource["id"] for resource in page), page.has_next))
+            cursor = page.next_cursor
+        self.assertEqual(pages, [(REGIONS[:10], True), (REGIONS[10:20], True), (REGIONS[20:], False)])
+        for request in self.endpoint.requests:
+            self.assertIn("ORDER BY STR(?item) LIMIT 11", request["body"])
+
+        # The last page is full: without has_next it has a cursor
+        self.assertIsNotNone(self.get_resource(cursor=encode_cursor(REGIONS[19]), per_page=5).next_cursor)
+        page = self.get_resource(cursor=encode_cursor(REGIONS[19]), per_page=5, has_next=True)
+        self.assertEqual((len(page), page.has_next, page.next_cursor), (5, False, None))
+
+    def test_page_is_ignored(self):
+        page = self.get_resource(cursor=encode_cursor(REGIONS[19]), page=3, per_page=10)
+        self.assertEqual(sorted(resource["id"] for resource in page), REGIONS[20:])
+        self.assertIsNone(page.next_cursor)
+        self.assertIn("OFFSET 0", self.endpoint.requests[0]["body"])
+
+    def test_offset_pagination(self):
+        page = self.get_resource(page=2, per_page=10)
+        self.assertNotIsInstance(page, ResourcePage)
+        query = self.endpoint.requests[0]["body"]
+        # The pages are ordered as with has_next
+        self.assertIn("ORDER BY STR(?item) LIMIT 10", query)
+        self.assertIn("OFFSET 10", query)
+        parseQuery(query)
+
+    def test_offset_has_next(self):
+        pages = [self.get_resource(page=page, per_page=10, has_next=True) for page in [1, 2, 3]]
+        self.assertEqual([(sorted(resource["id"] for resource in page), page.has_next, page.next_cursor)
+                          for page in pages],
+                         [(REGIONS[:10], True, None), (REGIONS[10:20], True, None), (REGIONS[20:], False, None)])
+        for page, request in enumerate(self.endpoint.requests):
+            self.assertIn("ORDER BY STR(?item) LIMIT 11", request["body"])
+            self.assertIn(f"OFFSET {page * 10}", request["body"])
+            parseQuery(request["body"])
+
+        # The last page is full
+        page = self.get_resource(page=5, per_page=5, has_next=True)
+        self.assertEqual((len(page), page.has_next), (5, False))
+
+    def test_bad_request(self):
+        with self.assertRaises(HTTPException) as context:
+            self.get_resource(cursor="not base64!")
+        self.assertEqual(context.exception.status_code, 400)
+        # The custom query has no SELECT
+        with self.assertRaises(HTTPException) as context:
+            self.get_resource(rdf_type_name="custom", custom_query_name="custom_modelconfigurations",
+                              username="mint@isi.edu", cursor="")
+        self.assertEqual(context.exception.status_code, 400)
+        # has_next needs the order of the items
+        with self.assertRaises(HTTPException) as context:
+            self.get_resource(rdf_type_name="custom", custom_query_name="custom_modelconfigurations",
+                              username="mint@isi.edu", page=2, per_page=10, has_next=True)
+        self.assertEqual(context.exception.status_code, 400)
+        self.assertEqual(self.endpoint.requests, [])
+
+
+class TestAsyncKeysetPagination(TestKeysetPagination):
+    query_manager_class = AsyncQueryManager
+
+    def get_resource(self, **kwargs):
+        return asyncio.run(super().get_resource(**kwargs))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+import json
+import unittest
+
+from rdflib import Graph
+from rdflib.compare import isomorphic, graph_diff
+
+from obasparql import QueryManager
+from obasparql.ntriples import NTriplesSerializer, UnsupportedJSONLD
+from tests.settings import model_catalog_context, dbpedia_context, model_catalog_queries, model_catalog_endpoint, \
+    model_catalog_graph_base, dbpedia_queries, dbpedia_endpoint
+
+PREFIX = "https://w3id.org/okn/i/mint/"
+SDM = "https://w3id.org/okn/o/sdm#"
+SD = "https://w3id.org/okn/o/sd#"
+
+MODEL_CATALOG_RESOURCES = [
+    [{
+        "id": f"{PREFIX}Travis",
+        "type": [f"{SDM}Region"],
+        "label": ["Travis", "Travis County", 'with "quotes", \\ and\nnew lines\t\x01', "Größe 東京"],
+        "description": None
+    }],
+    [{
+        "id": "CYCLES",
+        "type": [f"{SDM}Model", "sdm:Theory-GuidedModel"],
+        "hasParameter": [
+            {"id": None, "label": ["parameter without id"], "hasDefaultValue": [0.5, 2, True, "3"]},
+            {"id": "existing_parameter"},
+            "sd:compact",
+            f"{PREFIX}absolute"
+        ],
+        "hasMinimumAcceptedValue": [1, 1.5, 1e-07, 1e21],
+        "hasFixedValue": [False, "x"],
+        "dateCreated": ["2020-01-01T00:00:00"],
+        "latitude": [30.2, 30],
+        "position": [1, "2", True],
+        "hasDownloadURL": ["https://example.org/cycles.zip"],
+        "description": ["typed string", 5],
+        "unknownKey": ["ignored"],
+        "https://example.org/property": ["absolute property"],
+        "sd:author": [f"{PREFIX}author"],
+        "type_key": []
+    }],
+    [{
+        "id": f"{PREFIX}config",
+        "type": [f"{SDM}ModelConfiguration"],
+        "hasInput": [{
+            "id": f"{PREFIX}input",
+            "type": [f"{SD}DatasetSpecification"],
+            "hasPresentation": [{"id": None, "label": ["nested blank node"]}, {"id": None}]
+        }],
+        "label": [{"@value": "English", "@language": "en"},
+                  {"@value": "typed", "@type": "http://www.w3.org/2001/XMLSchema#token"},
+                  {"@value": None}]
+    }, {
+        "id": f"{PREFIX}other",
+        "label": ["second resource of the graph"]
+    }],
+]
+
+
+def rdflib_graph(context: dict, nodes: list) -> Graph:
+    return Graph().parse(data=json.dumps({"@context": context, "@graph": nodes}), format="json-ld",
+                         publicID=PREFIX)
+
+
+def read_context(context_dir):
+    with open(context_dir / "context.json") as reader:
+        return json.load(reader)
+
+
+class TestNTriplesSerializer(unittest.TestCase):
+    def assert_isomorphic(self, context: dict, nodes: list):
+        triples = NTriplesSerializer(context, PREFIX).serialize(nodes)
+        graph = Graph().parse(data="\n".join(triples), format="nt")
+        expected = rdflib_graph(context, nodes)
+        _, only_serializer, only_rdflib = graph_diff(graph, expected)
+        self.assertTrue(isomorphic(graph, expected),
+                        f"only serializer: {sorted(only_serializer)}\nonly rdflib: {sorted(only_rdflib)}")
+        self.assertTrue(len(graph) > 0)
+
+    def test_model_catalog(self):
+        context = read_context(model_catalog_context)
+        for nodes in MODEL_CATALOG_RESOURCES:
+            with self.subTest(nodes=nodes[0]["id"]):
+                self.assert_isomorphic(context, nodes)
+
+    def test_dbpedia(self):
+        context = read_context(dbpedia_context)
+        # id and type are properties of the dbpedia ontology
+        nodes = [{
+            "@id": "http://dbpedia.org/resource/Pink_Floyd",
+            "@type": ["http://dbpedia.org/ontology/Band"],
+            "id": ["Pink_Floyd"],
+            "type": ["http://dbpedia.org/resource/Rock_band"],
+            "label": ["Pink Floyd"],
+            "activeYearsStartYear": ["1965"],
+            "bandMember": ["http://dbpedia.org/resource/David_Gilmour"],
+            "abstract": [{"@value": "Pink Floyd were an English rock band", "@language": "en"}]
+        }]
+        self.assert_isomorphic(context, nodes)
+
+    def test_compact_context(self):
+        context = {
+            "@context": {
+                "id": "@id",
+                "type": "@type",
+                "ex": "http://example.org/",
+                "name": "ex:name",
+                "knows": {"@id": "ex:knows", "@type": "@id"},
+                "age": {"@id": "ex:age", "@type": "ex:years"},
+                "Person": "ex:Person"
+            }
+        }
+        nodes = [{"id": "ex:alice", "type": "Person", "name": "Alice", "age": 30, "knows": ["bob", "ex:carol"]}]
+        self.assert_isomorphic(context, nodes)
+
+    def test_unsupported(self):
+        context = read_context(model_catalog_context)
+        serializer = NTriplesSerializer(context, PREFIX)
+        for nodes in [[{"id": "_:b0", "label": ["blank node identifier"]}],
+                      [{"id": "with space", "label": ["invalid IRI"]}],
+                      [{"id": "../relative", "label": ["relative IRI"]}],
+                      [{"id": PREFIX + "list", "label": {"@list": ["a", "b"]}}],
+                      [{"id": PREFIX + "nested", "label": [["a"]]}],
+                      [{"@context": {}, "id": PREFIX + "context"}]]:
+            with self.subTest(nodes=nodes):
+                with self.assertRaises(UnsupportedJSONLD):
+                    serializer.serialize(nodes)
+
+        serializer = NTriplesSerializer({"@vocab": "http://example.org/", "name": "http://example.org/name"}, PREFIX)
+        with self.assertRaises(UnsupportedJSONLD):
+            serializer.serialize([{"name": "vocab"}])
+        serializer = NTriplesSerializer({"tags": {"@id": "http://example.org/tags", "@container": "@list"}}, PREFIX)
+        with self.assertRaises(UnsupportedJSONLD):
+            serializer.serialize([{"@id": PREFIX + "x", "tags": ["a"]}])
+
+    def test_query_manager_fallback(self):
+        query_manager = QueryManager(queries_dir=model_catalog_queries,
+                                     context_dir=model_catalog_context,
+                                     endpoint=model_catalog_endpoint,
+                                     named_graph_base=model_catalog_graph_base,
+                                     uri_prefix=PREFIX)
+        prefixes, triples = query_manager.serialize_resources(MODEL_CATALOG_RESOURCES[0])
+        self.assertEqual(prefixes, [])
+        self.assertIn(f'<{PREFIX}Travis> <http://www.w3.org/2000/01/rdf-schema#label> "Travis" .', triples)
+        # Converted by rdflib
+        nodes = [{"id": f"{PREFIX}list", "label": {"@list": ["a", "b"]}}]
+        prefixes, triples = query_manager.serialize_resources(nodes)
+        graph = Graph().parse(data="\n".join(prefixes + triples), format="turtle")
+        self.assertTrue(isomorphic(graph, rdflib_graph(query_manager.context, nodes)))
+
+    def test_trim_context(self):
+        query_manager = QueryManager(queries_dir=dbpedia_queries,
+                                     context_dir=dbpedia_context,
+                                     endpoint=dbpedia_endpoint,
+                                     named_graph_base=None,
+                                     uri_prefix="http://dbpedia.org/resource/")
+        nodes = [{
+            "@id": "http://dbpedia.org/resource/Pink_Floyd",
+            "@type": ["http://dbpedia.org/ontology/Band"],
+            "active_years_start_year": ["1965"],
+            "bandMember": ["http://dbpedia.org/resource/David_Gilmour"],
+            "label": [{"@value": "Pink Floyd", "@language": "en"}],
+            "genre": [{"@id": "Progressive_rock", "label": ["Progressive rock"]}]
+        }]
+        context = query_manager.trim_context(nodes)
+        self.assertEqual(sorted(context["@context"]), ["active_years_start_year", "bandMember", "genre", "label"])
+        self.assertTrue(isomorphic(rdflib_graph(context, nodes), rdflib_graph(query_manager.context, nodes)))
+
+        compact = [{"id": "ex:alice", "type": "Person", "knows": "ex:bob"}]
+        query_manager.context = {"@context": {
+            "id": "@id", "type": "@type", "ex": "http://example.org/", "ns": "http://example.org/ns#",
+            "knows": {"@id": "ns:knows", "@type": "@id"}, "Person": "ex:Person", "unused": "ex:unused"
+        }}
+        context = query_manager.trim_context(compact)
+        self.assertEqual(sorted(context["@context"]), ["Person", "ex", "id", "knows", "ns", "type"])
+        self.assertTrue(isomorphic(rdflib_graph(context, compact), rdflib_graph(query_manager.context, compact)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import asyncio
+import json
+import unittest
+
+from rdflib import Graph
+from rdflib.compare import isomorphic
+
+from obasparql import AsyncQueryManager, QueryManager
+from tests.settings import model_catalog_queries, model_catalog_context, model_catalog_graph_base, \
+    model_catalog_prefix
+from tests.sparql_endpoint import SPARQLEndpoint
+
+MODEL_CONFIGURATION_URI = "https://w3id.org/okn/o/sdm#ModelConfiguration"
+PARAMETER_URI = "https://w3id.org/okn/o/sd#Parameter"
+
+
+class Body:
+    """Stand-in of the models of the OBA server"""
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def dict(self):
+        return dict(self.__dict__)
+
+
+def update_graph(update: str) -> Graph:
+    """Parse the triples of an INSERT DATA query"""
+    prefixes, _, data = update.partition("INSERT DATA { GRAPH <")
+    triples = data.split("> {", 1)[1].rstrip()[:-len("} }")]
+    return Graph().parse(data=prefixes + triples, format="turtle")
+
+
+class TestPostResource(unittest.TestCase):
+    query_manager_class = QueryManager
+
+    def setUp(self):
+        self.endpoint = SPARQLEndpoint(lambda request: (200, "text/plain", b"")).__enter__()
+        self.addCleanup(self.endpoint.__exit__)
+        self.query_manager = self.query_manager_class(queries_dir=model_catalog_queries,
+                                                      context_dir=model_catalog_context,
+                                                      endpoint=self.endpoint.url,
+                                                      named_graph_base=model_catalog_graph_base,
+                                                      uri_prefix=model_catalog_prefix)
+
+    def post_resource(self, body, **kwargs):
+        return self.query_manager.post_resource("mint@isi.edu", body, MODEL_CONFIGURATION_URI, **kwargs)
+
+    def new_body(self):
+        self.parameters = [Body(id=None, type=[PARAMETER_URI], label=[f"parameter {i}"],
+                                hasDefaultValue=[str(i)]) for i in range(40)]
+        self.parameters.append(Body(id="https://w3id.org/okn/i/mint/existing", type=[PARAMETER_URI], label=["x"]))
+        return Body(id=None, type=None, label=["Configuration"], hasParameter=self.parameters,
+                    hasOutput=[{"id": None, "label": ["embedded output"]}])
+
+    def expected_graph(self, body: dict) -> Graph:
+        """Graph of the resource with the nested objects embedded"""
+        resource = dict(body, hasParameter=[parameter.dict() for parameter in self.parameters])
+        resource["@context"] = self.query_manager.context
+        return Graph().parse(data=json.dumps(resource), format="json-ld",
+                             publicID=self.query_manager.uri_prefix)
+
+    def updates(self):
+        return [request["body"] for request in self.endpoint.requests]
+
+    def test_one_update(self):
+        body = self.post_resource(self.new_body())
+        self.assertNotIn("@context", body)
+        self.assertTrue(body["id"].startswith(model_catalog_prefix))
+        self.assertEqual(len({parameter.id for parameter in self.parameters}), 41)
+        updates = self.updates()
+        self.assertEqual(len(updates), 1)
+        self.assertIn(f"GRAPH <{model_catalog_graph_base}mint@isi.edu>", updates[0])
+        self.assertTrue(isomorphic(update_graph(updates[0]), self.expected_graph(body)))
+
+    def test_nested_ids(self):
+        body = self.post_resource(self.new_body())
+        # The new nested resources keep a short id in the response, as the existing ones
+        new_ids = [parameter.id for parameter in body["hasParameter"][:-1]]
+        self.assertFalse(any(_id.startswith(model_catalog_prefix) for _id in new_ids))
+        self.assertEqual(body["hasParameter"][-1].id, "https://w3id.org/okn/i/mint/existing")
+        self.assertIn(f"<{model_catalog_prefix}{new_ids[0]}>", self.updates()[0])
+
+    def test_chunks(self):
+        self.query_manager.insert_resources = self.chunked(self.query_manager.insert_resources)
+        body = self.post_resource(self.new_body())
+        updates = self.updates()
+        self.assertEqual(len(updates), 3)
+        graph = Graph()
+        for update in updates:
+            graph += update_graph(update)
+        self.assertTrue(isomorphic(graph, self.expected_graph(body)))
+
+    @staticmethod
+    def chunked(insert_resources):
+        return lambda nodes, username: insert_resources(nodes, username, chunk_size=20)
+
+
+class TestAsyncPostResource(TestPostResource):
+    query_manager_class = AsyncQueryManager
+
+    def post_resource(self, body, **kwargs):
+        return asyncio.run(super().post_resource(body, **kwargs))
+
+
+if __name__ == '__main__':
+    unittest.main()
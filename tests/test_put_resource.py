@@ -0,0 +1,82 @@
+import asyncio
+import json
+import unittest
+
+from rdflib.plugins.sparql.parser import parseUpdate
+
+from obasparql import AsyncQueryManager, QueryManager
+from tests.settings import model_catalog_queries, model_catalog_context, model_catalog_graph_base, \
+    model_catalog_prefix
+from tests.sparql_endpoint import SPARQLEndpoint
+from tests.test_post_resource import Body
+
+REGION_URI = "https://w3id.org/okn/o/sdm#Region"
+TRAVIS = {
+    "@graph": [{
+        "@id": "https://w3id.org/okn/i/mint/Travis",
+        "@type": REGION_URI,
+        "label": "Travis County"
+    }],
+    "@context": {
+        "label": {"@id": "http://www.w3.org/2000/01/rdf-schema#label"}
+    }
+}
+
+
+def respond(request):
+    if request["path"].endswith("/update"):
+        return 200, "text/plain", b""
+    return 200, "application/ld+json", json.dumps(TRAVIS).encode()
+
+
+class TestPutResource(unittest.TestCase):
+    query_manager_class = QueryManager
+
+    def setUp(self):
+        self.endpoint = SPARQLEndpoint(respond).__enter__()
+        self.addCleanup(self.endpoint.__exit__)
+        self.query_manager = self.query_manager_class(queries_dir=model_catalog_queries,
+                                                      context_dir=model_catalog_context,
+                                                      endpoint=self.endpoint.url,
+                                                      named_graph_base=model_catalog_graph_base,
+                                                      uri_prefix=model_catalog_prefix)
+
+    def put_resource(self, **kwargs):
+        body = Body(id="Travis", type=[REGION_URI], label=["Travis County"])
+        return self.query_manager.put_resource("Travis", "mint@isi.edu", body, REGION_URI,
+                                               rdf_type_name="Region", **kwargs)
+
+    def test_put_resource(self):
+        resource = self.put_resource()
+        self.assertEqual(resource["id"], "https://w3id.org/okn/i/mint/Travis")
+        paths = [request["path"] for request in self.endpoint.requests]
+        self.assertEqual(paths, ["/ds", "/ds/update", "/ds/update", "/ds"])
+
+    def test_single_request(self):
+        resource = self.put_resource(single_request=True)
+        self.assertEqual(resource["label"], ["Travis County"])
+        paths = [request["path"] for request in self.endpoint.requests]
+        self.assertEqual(paths, ["/ds/update", "/ds"])
+        update = self.endpoint.requests[0]["body"]
+        graph = f"GRAPH <{model_catalog_graph_base}mint@isi.edu>"
+        self.assertLess(update.index("DELETE WHERE { " + graph), update.index("INSERT DATA { " + graph))
+        self.assertIn("<https://w3id.org/okn/i/mint/Travis> ?p ?o", update)
+        parseUpdate(update)
+
+    def test_return_body(self):
+        resource = self.put_resource(single_request=True, return_body=True)
+        self.assertEqual(len(self.endpoint.requests), 1)
+        self.assertEqual(resource, {"id": "https://w3id.org/okn/i/mint/Travis",
+                                    "type": [REGION_URI],
+                                    "label": ["Travis County"]})
+
+
+class TestAsyncPutResource(TestPutResource):
+    query_manager_class = AsyncQueryManager
+
+    def put_resource(self, **kwargs):
+        return asyncio.run(super().put_resource(**kwargs))
+
+
+if __name__ == '__main__':
+    unittest.main()
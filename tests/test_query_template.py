@@ -0,0 +1,188 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from rdflib.plugins.sparql.parser import parseQuery
+
+from obasparql import QueryManager
+from obasparql.query_template import QueryTemplate
+from obasparql.static import QUERY_TYPE_GET_ALL_USER, QUERY_TYPE_GET_ONE_USER
+from obasparql.utils import generate_uri
+from tests.settings import model_catalog_queries, model_catalog_context, model_catalog_endpoint, \
+    model_catalog_graph_base, model_catalog_prefix
+
+graph_user = generate_uri(model_catalog_graph_base, "mint@isi.edu")
+
+
+class RecordingConnector:
+    """Stand-in of the SPARQLConnector that records the queries instead of sending them"""
+
+    def __init__(self, response=b'{}'):
+        self.response = response
+        self.queries = []
+
+    def query(self, query, *args, **kwargs):
+        self.queries.append(query)
+        return self.response
+
+
+class TestQueryTemplate(unittest.TestCase):
+    def setUp(self):
+        self.query_manager = QueryManager(queries_dir=model_catalog_queries,
+                                          context_dir=model_catalog_context,
+                                          endpoint=model_catalog_endpoint,
+                                          named_graph_base=model_catalog_graph_base,
+                                          uri_prefix=model_catalog_prefix)
+        self.query_manager.sparql = RecordingConnector()
+
+    def test_templates_compiled_at_startup(self):
+        for query_type in [QUERY_TYPE_GET_ONE_USER, QUERY_TYPE_GET_ALL_USER]:
+            raw_query = getattr(self.query_manager, "Model")[query_type]
+            template = self.query_manager.query_templates[raw_query]
+            self.assertEqual(template.type, "ConstructQuery")
+            self.assertIn("g", template.parameters)
+
+    def test_dispatch_does_not_parse_the_template(self):
+        raw_query = getattr(self.query_manager, "Model")[QUERY_TYPE_GET_ONE_USER]
+        request_args = {
+            "resource": "https://w3id.org/okn/i/mint/CYCLES",
+            "g": graph_user
+        }
+        with mock.patch("obasparql.gquery.get_metadata") as get_metadata:
+            self.query_manager.dispatch_sparql_query(raw_sparql_query=raw_query, request_args=request_args)
+            get_metadata.assert_not_called()
+        query = self.query_manager.sparql.queries[0]
+        self.assertIn("<https://w3id.org/okn/i/mint/CYCLES>", query)
+        self.assertIn("GRAPH <{}>".format(graph_user), query)
+
+    def test_rewrite_not_template(self):
+        raw_query = "SELECT ?s WHERE { ?s ?p ?_o_iri }"
+        template = QueryTemplate(raw_query)
+        self.assertEqual(template.rewrite({"o": "http://example.org/o"}),
+                         "SELECT ?s WHERE { ?s ?p <http://example.org/o> }")
+
+    def test_rewrite_prefix_sharing_variables(self):
+        template = QueryTemplate('SELECT ?s WHERE { ?s ?p ?_a . ?s ?q ?_ab_iri . ?s ?r "?_a" }')
+        self.assertEqual(template.rewrite({"a": "x", "ab": "http://example.org/ab"}),
+                         'SELECT ?s WHERE { ?s ?p "x" . ?s ?q <http://example.org/ab> . ?s ?r "?_a" }')
+
+    def test_rewrite_typed_slots(self):
+        template = QueryTemplate('SELECT ?s WHERE { ?s ?p ?_label_en . ?s ?q ?_year_integer . ?s ?r ?_name }')
+        query = template.rewrite({"label": "Cycles", "year": "2016", "name": "cycles"})
+        self.assertIn('?s ?p "Cycles"@en', query)
+        self.assertIn('?s ?q "2016"^^xsd:integer', query)
+        self.assertIn('?s ?r "cycles"', query)
+        self.assertTrue(query.startswith('PREFIX xsd:'))
+
+    def test_rewrite_pagination(self):
+        raw_query = getattr(self.query_manager, "Model")[QUERY_TYPE_GET_ALL_USER]
+        template = self.query_manager.query_templates[raw_query]
+        request_args = {"type": "https://w3id.org/okn/o/sdm#Model", "g": graph_user}
+        query = template.rewrite(request_args)
+        self.assertIn("LIMIT 100", query)
+        self.assertIn("OFFSET 0", query)
+        request_args.update({"per_page": 10, "offset": 20})
+        query = template.rewrite(request_args)
+        self.assertIn("LIMIT 10\n", query)
+        self.assertIn("OFFSET 20\n", query)
+        self.assertIn("?item a <https://w3id.org/okn/o/sdm#Model>", query)
+
+    def test_rewrite_values(self):
+        template = QueryTemplate('CONSTRUCT { ?_s_iri ?p ?o } WHERE { GRAPH ?_g_iri { ?_s_iri ?p ?o } }')
+        self.assertTrue(template.supports_values)
+        query = template.rewrite({"g": "http://example.org/g",
+                                  "_values": {"s": ["http://example.org/a", "http://example.org/b"]}})
+        self.assertIn("WHERE {\n    VALUES ?_s_iri { <http://example.org/a> <http://example.org/b> }", query)
+        self.assertIn("GRAPH <http://example.org/g> { ?_s_iri ?p ?o }", query)
+        with self.assertRaises(ValueError):
+            template.rewrite({"g": "http://example.org/g",
+                              "_values": {"s": ["http://example.org/a"], "unknown": ["x"]}})
+
+    def test_rewrite_keyset(self):
+        template = QueryTemplate("SELECT ?s WHERE { ?s ?p ?o } LIMIT 100 OFFSET 0")
+        self.assertTrue(template.supports_keyset)
+        self.assertEqual(template.rewrite({"_after": "http://example.org/a", "per_page": 5, "offset": 10}),
+                         'SELECT ?s WHERE { ?s ?p ?o  FILTER(STR(?s) > "http://example.org/a") } '
+                         'ORDER BY STR(?s) LIMIT 5 OFFSET 0')
+        # ORDER BY precedes the OFFSET before the LIMIT, with or without lookahead
+        template = QueryTemplate("SELECT ?s WHERE { ?s ?p ?o } OFFSET 0 LIMIT 100")
+        self.assertEqual(template.rewrite({"per_page": 5, "offset": 10}),
+                         'SELECT ?s WHERE { ?s ?p ?o } ORDER BY STR(?s) OFFSET 10 LIMIT 5')
+        self.assertEqual(template.rewrite({"per_page": 5, "offset": 10, "_lookahead": 1}),
+                         'SELECT ?s WHERE { ?s ?p ?o } ORDER BY STR(?s) OFFSET 10 LIMIT 6')
+        # The LIMIT does not belong to the SELECT of one variable
+        template = QueryTemplate("CONSTRUCT { ?s ?p ?o } WHERE { { SELECT ?s ?p WHERE { ?s ?p ?x } } ?s ?p ?o } "
+                                 "LIMIT 100")
+        self.assertFalse(template.supports_keyset)
+
+    def test_rewrite_structural_pagination(self):
+        # The template of ModelConfiguration has no LIMIT: the pagination is added to the subquery of ?item
+        with open(Path(model_catalog_queries) / "ModelConfiguration/get_all_user.rq") as reader:
+            template = QueryTemplate(reader.read())
+        self.assertTrue(template.bounded)
+        request_args = {"type": "https://w3id.org/okn/o/sdm#ModelConfiguration", "g": graph_user}
+        query = template.rewrite(request_args)
+        self.assertIn("}\nLIMIT 100 OFFSET 0 }", query)
+        request_args.update({"per_page": 10, "offset": 20})
+        query = template.rewrite(request_args)
+        self.assertIn("}\nORDER BY STR(?item) LIMIT 10 OFFSET 20 }", query)
+        parseQuery(query)
+
+        template = QueryTemplate("CONSTRUCT { ?s ?p ?o } WHERE { { SELECT ?s WHERE { ?s a ?t } limit 20 } ?s ?p ?o }")
+        self.assertEqual(template.limit, 20)
+        self.assertEqual(template.rewrite({"per_page": 5, "offset": 5}),
+                         "CONSTRUCT { ?s ?p ?o } WHERE { { SELECT ?s WHERE { ?s a ?t } ORDER BY STR(?s) LIMIT 5 "
+                         "OFFSET 5 } ?s ?p ?o }")
+
+    def test_count_template(self):
+        with open(Path(model_catalog_queries) / "ModelConfiguration/get_all_user.rq") as reader:
+            template = QueryTemplate(reader.read())
+        request_args = {"type": "https://w3id.org/okn/o/sdm#ModelConfiguration", "g": graph_user, "per_page": 10,
+                        "offset": 20}
+        query = template.count_template.rewrite(request_args)
+        self.assertTrue(query.startswith("PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>\n"
+                                         "SELECT (COUNT(DISTINCT ?item) AS ?count) WHERE {\n"
+                                         f"    GRAPH <{graph_user}> {{ {{"))
+        self.assertIn("FILTER NOT EXISTS", query)
+        self.assertNotIn("?predicate", query)
+        self.assertNotIn("LIMIT", query)
+        parseQuery(query)
+
+        template = QueryTemplate("CONSTRUCT { ?s ?p ?o } WHERE { { SELECT ?s WHERE { ?s a ?t } limit 20 offset 5 } "
+                                 "?s ?p ?o }")
+        self.assertEqual(template.count_template.rewrite({}),
+                         "SELECT (COUNT(DISTINCT ?s) AS ?count) WHERE {\n    { SELECT ?s WHERE { ?s a ?t } }\n}\n")
+        # The items are not counted if the subquery is optional, or if there is no subquery of one variable
+        for query in ["CONSTRUCT { ?s ?p ?o } WHERE { ?s ?p ?o OPTIONAL { SELECT ?s WHERE { ?s a ?t } } }",
+                      "CONSTRUCT { ?s ?p ?o } WHERE { { SELECT ?s ?p WHERE { ?s ?p ?t } } ?s ?p ?o }",
+                      "SELECT DISTINCT ?s WHERE { ?s a ?t }",
+                      "CONSTRUCT { ?s ?p ?o } WHERE { ?s ?p ?o }"]:
+            with self.subTest(query=query):
+                self.assertIsNone(QueryTemplate(query).count_template)
+
+    def test_unbounded_templates(self):
+        # The LIMIT of the CONSTRUCT limits the triples, not the items
+        template = QueryTemplate("CONSTRUCT { ?s ?p ?o } WHERE { ?s a ?_type_iri . ?s ?p ?o } LIMIT 100")
+        self.assertFalse(template.bounded)
+        self.assertIn("LIMIT 100", template.rewrite({"type": "http://example.org/T", "per_page": 5, "offset": 5}))
+
+        with tempfile.TemporaryDirectory() as queries_dir:
+            (Path(queries_dir) / "_default_").mkdir()
+            (Path(queries_dir) / "_default_/get_all.rq").write_text(template.raw_query)
+            kwargs = dict(queries_dir=queries_dir, context_dir=model_catalog_context, endpoint=model_catalog_endpoint,
+                          named_graph_base=model_catalog_graph_base, uri_prefix=model_catalog_prefix)
+            with self.assertLogs("fastapi", "WARNING") as logs:
+                QueryManager(**kwargs)
+            self.assertIn("_default_/get_all", logs.output[0])
+            with self.assertRaises(ValueError):
+                QueryManager(reject_unbounded_templates=True, **kwargs)
+
+    def test_rewrite_missing_required_parameter(self):
+        template = QueryTemplate("SELECT ?s WHERE { ?s ?p ?_o_iri }")
+        with self.assertRaises(AssertionError):
+            template.rewrite({})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import asyncio
+import unittest
+
+from obasparql import AsyncQueryManager, QueryManager
+from obasparql.replicas import ReplicaSet
+from obasparql.resilience import CircuitBreaker, CircuitOpenError, RetryPolicy
+from obasparql.sparqlconnector import SPARQLConnector
+from tests.settings import model_catalog_queries, model_catalog_context, model_catalog_graph_base, \
+    model_catalog_prefix
+from tests.sparql_endpoint import SPARQLEndpoint
+from tests.test_post_resource import Body
+
+QUERY = "CONSTRUCT WHERE { ?s ?p ?o }"
+REGION_URI = "https://w3id.org/okn/o/sdm#Region"
+USER = "mint@isi.edu"
+
+
+class TestReplicaSet(unittest.TestCase):
+    def test_least_outstanding(self):
+        replicas = ReplicaSet(["http://a/ds", "http://b/ds", "http://c/ds"], "http://p/ds",
+                              lambda url: CircuitBreaker())
+        a = replicas.acquire()
+        b = replicas.acquire()
+        c = replicas.acquire()
+        self.assertEqual({a.url, b.url, c.url}, {"http://a/ds", "http://b/ds", "http://c/ds"})
+        replicas.release(b)
+        self.assertIs(replicas.acquire(), b)
+        replicas.release(a)
+        replicas.release(c)
+        # The replicas that failed are avoided
+        self.assertIs(replicas.acquire(exclude=[a]), c)
+        self.assertEqual(replicas.acquire_primary().url, "http://p/ds")
+        self.assertEqual([stats["outstanding"] for stats in replicas.stats()], [0, 1, 1])
+
+    def test_ejection(self):
+        breakers = {}
+        replicas = ReplicaSet(["http://a/ds", "http://b/ds"], "http://a/ds",
+                              lambda url: breakers.setdefault(url, CircuitBreaker(1, 60)))
+        breakers["http://a/ds"].record_failure()
+        for _ in range(3):
+            replica = replicas.acquire()
+            self.assertEqual(replica.url, "http://b/ds")
+            replicas.release(replica)
+        self.assertIs(replicas.primary, replicas.replicas[0])
+        breakers["http://b/ds"].record_failure()
+        with self.assertRaises(CircuitOpenError):
+            replicas.acquire()
+
+
+class TestReplicas(unittest.TestCase):
+    def setUp(self):
+        self.primary = self.endpoint()
+        self.replicas = [self.endpoint(), self.endpoint()]
+
+    def endpoint(self, responder=None):
+        endpoint = SPARQLEndpoint(responder or (lambda request: (200, "application/ld+json", b'{"@graph": []}')))
+        endpoint.__enter__()
+        self.addCleanup(endpoint.__exit__)
+        return endpoint
+
+    def connector(self, **kwargs):
+        return SPARQLConnector(query_endpoint=[replica.url for replica in self.replicas],
+                               update_endpoint=f"{self.primary.url}/update",
+                               primary_query_endpoint=self.primary.url,
+                               method="POST",
+                               returnFormat="json-ld",
+                               **kwargs)
+
+    def test_balancing(self):
+        sparql = self.connector()
+        for _ in range(4):
+            sparql.query(QUERY)
+        self.assertEqual([len(replica.requests) for replica in self.replicas], [2, 2])
+        sparql.query(QUERY, primary=True)
+        sparql.update("INSERT DATA { <http://e/s> <http://e/p> <http://e/o> }")
+        self.assertEqual([request["path"] for request in self.primary.requests], ["/ds", "/ds/update"])
+
+    def test_unhealthy_replica(self):
+        self.replicas[0].responder = lambda request: (503, "text/plain", b"busy")
+        sparql = self.connector(retry_policy=RetryPolicy(1, backoff=0.01), circuit_breaker=CircuitBreaker(1, 60))
+        for _ in range(4):
+            self.assertEqual(sparql.query(QUERY), b'{"@graph": []}')
+        # The first query is retried on the other replica, then the replica is ejected
+        self.assertEqual([len(replica.requests) for replica in self.replicas], [1, 4])
+        self.assertEqual([stats["circuit_state"] for stats in sparql.replica_stats()], ["open", "closed"])
+        # The primary has its own circuit breaker
+        self.assertEqual(sparql.stats()["circuit_state"], "closed")
+
+
+class TestReadYourWrites(unittest.TestCase):
+    query_manager_class = QueryManager
+
+    def setUp(self):
+        self.primary = SPARQLEndpoint(lambda request: (200, "application/ld+json", b'{"@graph": []}')).__enter__()
+        self.replica = SPARQLEndpoint(lambda request: (200, "application/ld+json", b'{"@graph": []}')).__enter__()
+        self.addCleanup(self.primary.__exit__)
+        self.addCleanup(self.replica.__exit__)
+
+    def query_manager(self, **kwargs):
+        return self.query_manager_class(queries_dir=model_catalog_queries,
+                                        context_dir=model_catalog_context,
+                                        endpoint=self.primary.url,
+                                        query_endpoints=[self.replica.url],
+                                        named_graph_base=model_catalog_graph_base,
+                                        uri_prefix=model_catalog_prefix,
+                                        **kwargs)
+
+    def call(self, response):
+        return response
+
+    def get_resource(self, query_manager, username):
+        return self.call(query_manager.get_resource(rdf_type_uri=REGION_URI, rdf_type_name="Region",
+                                                    username=username))
+
+    def post(self, query_manager):
+        body = Body(id=None, type=None, label=["Austin"])
+        self.call(query_manager.post_resource(USER, body, REGION_URI, rdf_type_name="Region"))
+
+    def test_reads_are_pinned_after_a_write(self):
+        query_manager = self.query_manager(read_your_writes_ttl=60)
+        self.get_resource(query_manager, USER)
+        self.post(query_manager)
+        self.get_resource(query_manager, USER)
+        self.get_resource(query_manager, "other@isi.edu")
+        self.assertEqual([request["path"] for request in self.primary.requests], ["/ds/update", "/ds"])
+        self.assertEqual(len(self.replica.requests), 2)
+
+    def test_without_pinning(self):
+        query_manager = self.query_manager()
+        self.post(query_manager)
+        self.get_resource(query_manager, USER)
+        self.assertEqual([request["path"] for request in self.primary.requests], ["/ds/update"])
+        self.assertEqual(len(self.replica.requests), 1)
+
+
+class TestAsyncReadYourWrites(TestReadYourWrites):
+    query_manager_class = AsyncQueryManager
+
+    def call(self, response):
+        return asyncio.run(response)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+import asyncio
+import time
+import unittest
+from urllib.error import HTTPError
+
+from starlette.exceptions import HTTPException
+
+from obasparql import QueryManager
+from obasparql.async_sparqlconnector import AsyncSPARQLConnector
+from obasparql.resilience import CircuitBreaker, CircuitOpenError, RetryPolicy, CIRCUIT_CLOSED, CIRCUIT_HALF_OPEN, \
+    CIRCUIT_OPEN
+from obasparql.sparqlconnector import SPARQLConnector
+from tests.settings import model_catalog_queries, model_catalog_context, model_catalog_graph_base, \
+    model_catalog_prefix
+from tests.sparql_endpoint import SPARQLEndpoint, default_responder
+
+QUERY = "CONSTRUCT WHERE { ?s ?p ?o }"
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def test_delay(self):
+        policy = RetryPolicy(retries=3, backoff=0.1, max_backoff=0.3)
+        for attempt, maximum in enumerate([0.1, 0.2, 0.3, 0.3]):
+            delays = [policy.delay(attempt) for _ in range(100)]
+            self.assertTrue(all(0 <= delay <= maximum for delay in delays))
+
+    def test_should_retry(self):
+        policy = RetryPolicy(retries=1)
+        self.assertTrue(policy.should_retry(TimeoutError(), 0))
+        self.assertTrue(policy.should_retry(ConnectionRefusedError(), 0))
+        self.assertTrue(policy.should_retry(HTTPError("http://e", 503, "", {}, None), 0))
+        self.assertFalse(policy.should_retry(HTTPError("http://e", 400, "", {}, None), 0))
+        self.assertFalse(policy.should_retry(ValueError(), 0))
+        self.assertFalse(policy.should_retry(TimeoutError(), 1))
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_states(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+        breaker.before_request()
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CIRCUIT_CLOSED)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CIRCUIT_OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_request()
+
+        time.sleep(0.06)
+        # One request probes the endpoint
+        breaker.before_request()
+        self.assertEqual(breaker.state, CIRCUIT_HALF_OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_request()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CIRCUIT_OPEN)
+
+        time.sleep(0.06)
+        breaker.before_request()
+        breaker.record_success()
+        self.assertEqual(breaker.state, CIRCUIT_CLOSED)
+        self.assertEqual(breaker.stats(), {"circuit_state": CIRCUIT_CLOSED, "circuit_opened": 2, "failures": 4,
+                                           "rejected": 2})
+
+    def test_cancelled_probe(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        breaker.before_request()
+        breaker.record_error(asyncio.CancelledError())
+        breaker.before_request()
+
+    def test_disabled(self):
+        breaker = CircuitBreaker(failure_threshold=0)
+        for _ in range(10):
+            breaker.before_request()
+            breaker.record_failure()
+        self.assertEqual(breaker.state, CIRCUIT_CLOSED)
+
+
+class TestResilience(unittest.TestCase):
+    def setUp(self):
+        # The endpoint answers 503 to the first failures requests, and waits delay seconds
+        self.failures = 0
+        self.delay = 0
+        self.endpoint = SPARQLEndpoint(self.respond).__enter__()
+        self.addCleanup(self.endpoint.__exit__)
+
+    def respond(self, request):
+        time.sleep(self.delay)
+        if self.failures > 0:
+            self.failures -= 1
+            return 503, "text/plain", b"busy"
+        return default_responder(request)
+
+    def connector(self, connector_class=SPARQLConnector, retries=2, failure_threshold=5, **kwargs):
+        return connector_class(query_endpoint=self.endpoint.url,
+                               update_endpoint=f"{self.endpoint.url}/update",
+                               method="POST",
+                               returnFormat="json-ld",
+                               retry_policy=RetryPolicy(retries, backoff=0.01),
+                               circuit_breaker=CircuitBreaker(failure_threshold, reset_timeout=0.1),
+                               **kwargs)
+
+    def test_query_is_retried(self):
+        self.failures = 2
+        sparql = self.connector()
+        self.assertEqual(sparql.query(QUERY), b'{"@graph": []}')
+        self.assertEqual(len(self.endpoint.requests), 3)
+        self.assertEqual(sparql.stats(), {"requests": 3, "retries": 2, "timeouts": 0, "failures": 2,
+                                          "rejected": 0, "circuit_opened": 0, "circuit_state": CIRCUIT_CLOSED})
+
+    def test_retries_are_bounded(self):
+        self.failures = 3
+        sparql = self.connector()
+        code, _, _ = sparql.query(QUERY)
+        self.assertEqual(code, 503)
+        self.assertEqual(len(self.endpoint.requests), 3)
+
+    def test_update_is_not_retried(self):
+        self.failures = 1
+        sparql = self.connector()
+        with self.assertRaises(HTTPError):
+            sparql.update("INSERT DATA { <http://e/s> <http://e/p> <http://e/o> }")
+        self.assertEqual(len(self.endpoint.requests), 1)
+
+    def test_read_timeout(self):
+        self.delay = 0.5
+        sparql = self.connector(retries=0, read_timeout=0.1)
+        with self.assertRaises(TimeoutError):
+            sparql.query(QUERY)
+        self.assertEqual(sparql.stats()["timeouts"], 1)
+
+    def test_circuit_breaker(self):
+        self.failures = 2
+        sparql = self.connector(retries=0, failure_threshold=2)
+        for _ in range(2):
+            sparql.query(QUERY)
+        # The endpoint is not contacted while the circuit is open
+        with self.assertRaises(CircuitOpenError):
+            sparql.query(QUERY)
+        with self.assertRaises(CircuitOpenError):
+            sparql.update("INSERT DATA { <http://e/s> <http://e/p> <http://e/o> }")
+        self.assertEqual(len(self.endpoint.requests), 2)
+        time.sleep(0.15)
+        self.assertEqual(sparql.query(QUERY), b'{"@graph": []}')
+        self.assertEqual(sparql.stats()["circuit_state"], CIRCUIT_CLOSED)
+
+    def test_query_manager_unavailable(self):
+        self.failures = 100
+        query_manager = QueryManager(queries_dir=model_catalog_queries,
+                                     context_dir=model_catalog_context,
+                                     endpoint=self.endpoint.url,
+                                     named_graph_base=model_catalog_graph_base,
+                                     uri_prefix=model_catalog_prefix,
+                                     query_retries=0,
+                                     circuit_failure_threshold=1)
+        query_manager.sparql.circuit_breaker.record_failure()
+        with self.assertRaises(HTTPException) as context:
+            query_manager.get_resource(rdf_type_uri="https://w3id.org/okn/o/sdm#Region", rdf_type_name="Region")
+        self.assertEqual(context.exception.status_code, 503)
+        self.assertEqual(self.endpoint.requests, [])
+
+    def test_async(self):
+        self.failures = 1
+        sparql = self.connector(AsyncSPARQLConnector)
+        self.assertEqual(asyncio.run(sparql.query(QUERY)), b'{"@graph": []}')
+        self.assertEqual(sparql.stats()["retries"], 1)
+
+        self.delay = 0.5
+        sparql = self.connector(AsyncSPARQLConnector, retries=0, read_timeout=0.1)
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(sparql.query(QUERY))
+        self.assertEqual(sparql.stats()["timeouts"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,273 @@
+import asyncio
+import json
+import threading
+import time
+import unittest
+
+from obasparql import AsyncQueryManager, QueryManager
+from obasparql.caching import ResponseCache
+from tests.settings import model_catalog_queries, model_catalog_context, model_catalog_graph_base, \
+    model_catalog_prefix
+from tests.sparql_endpoint import SPARQLEndpoint
+from tests.test_post_resource import Body
+
+REGION_URI = "https://w3id.org/okn/o/sdm#Region"
+TRAVIS_URI = "https://w3id.org/okn/i/mint/Travis"
+USER = "mint@isi.edu"
+TRAVIS = {
+    "@graph": [{
+        "@id": TRAVIS_URI,
+        "@type": REGION_URI,
+        "label": "Travis County"
+    }],
+    "@context": {
+        "label": {"@id": "http://www.w3.org/2000/01/rdf-schema#label"}
+    }
+}
+
+
+def respond(request):
+    if request["path"].endswith("/update"):
+        return 200, "text/plain", b""
+    return 200, "application/ld+json", json.dumps(TRAVIS).encode()
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestResponseCache(unittest.TestCase):
+    def test_ttl(self):
+        clock = Clock()
+        cache = ResponseCache(10, ttl=5, clock=clock)
+        cache.put("a", 1, size=1)
+        clock.now = 4
+        self.assertEqual(cache.get("a"), 1)
+        clock.now = 5
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["expirations"], 1)
+        self.assertEqual(cache.stats()["bytes"], 0)
+
+    def test_max_bytes(self):
+        cache = ResponseCache(10, max_bytes=10)
+        cache.put("a", 1, size=4)
+        cache.put("b", 2, size=4)
+        cache.get("a")
+        cache.put("c", 3, size=4)
+        cache.put("d", 4, size=11)
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNone(cache.get("d"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.stats(), {"hits": 2, "misses": 2, "size": 2, "maxsize": 10, "evictions": 1,
+                                         "stale_hits": 0, "refreshes": 0, "expirations": 0, "invalidations": 0,
+                                         "bytes": 8, "max_bytes": 10})
+
+    def test_stale(self):
+        clock = Clock()
+        cache = ResponseCache(10, ttl=5, stale_ttl=10, clock=clock)
+        cache.put("a", 1)
+        clock.now = 6
+        self.assertEqual(cache.lookup("a"), (1, True))
+        self.assertIsNone(cache.get("a"))
+        self.assertTrue(cache.start_refresh("a"))
+        self.assertFalse(cache.start_refresh("a"))
+        cache.end_refresh("a")
+        self.assertTrue(cache.start_refresh("a"))
+        clock.now = 15
+        self.assertEqual(cache.lookup("a"), (None, False))
+        self.assertEqual(len(cache), 0)
+        stats = cache.stats()
+        self.assertEqual((stats["stale_hits"], stats["refreshes"], stats["expirations"]), (2, 2, 1))
+
+    def test_invalidate_graph(self):
+        cache = ResponseCache(10)
+        cache.put("alice", 1, graph="g:alice")
+        cache.put("bob", 2, graph="g:bob")
+        cache.put("all", 3)
+        self.assertEqual(cache.invalidate_graph("g:alice"), 2)
+        self.assertIsNone(cache.get("alice"))
+        self.assertIsNone(cache.get("all"))
+        self.assertEqual(cache.get("bob"), 2)
+
+        # A response read before the invalidation is not stored
+        generation = cache.generation
+        cache.invalidate_graph("g:bob")
+        cache.put("bob", 2, graph="g:bob", generation=generation)
+        self.assertEqual(len(cache), 0)
+
+    def test_disabled(self):
+        cache = ResponseCache()
+        self.assertFalse(cache.enabled)
+        cache.put("a", 1)
+        self.assertIsNone(cache.get("a"))
+
+
+class TestQueryManagerResponseCache(unittest.TestCase):
+    query_manager_class = QueryManager
+
+    def setUp(self):
+        self.endpoint = SPARQLEndpoint(respond).__enter__()
+        self.addCleanup(self.endpoint.__exit__)
+        self.query_manager = self.query_manager_class(queries_dir=model_catalog_queries,
+                                                      context_dir=model_catalog_context,
+                                                      endpoint=self.endpoint.url,
+                                                      named_graph_base=model_catalog_graph_base,
+                                                      uri_prefix=model_catalog_prefix,
+                                                      response_cache_size=10)
+
+    def call(self, response):
+        return response
+
+    def get_resource(self, **kwargs):
+        return self.call(self.query_manager.get_resource(rdf_type_uri=REGION_URI, rdf_type_name="Region", **kwargs))
+
+    def queries(self):
+        return [request for request in self.endpoint.requests if request["path"] == "/ds"]
+
+    def test_hit(self):
+        resource = self.get_resource(id="Travis", username=USER)
+        self.assertEqual(resource["id"], TRAVIS_URI)
+        resource["label"] = ["modified"]
+        self.assertEqual(self.get_resource(id="Travis", username=USER)["label"], ["Travis County"])
+        self.assertEqual(len(self.queries()), 1)
+
+        # Other graph, other resource and other page
+        self.get_resource(id="Travis", username="other@isi.edu")
+        self.get_resource(id="Austin", username=USER)
+        self.get_resource(username=USER, page=2, per_page=10)
+        self.get_resource(username=USER, page=2, per_page=10)
+        self.assertEqual(len(self.queries()), 4)
+        stats = self.query_manager.response_cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (2, 4, 4))
+
+    def test_put_resource(self):
+        self.get_resource(id="Travis", username=USER)
+        self.get_resource(id="Travis", username="other@isi.edu")
+        self.get_resource()
+        body = Body(id="Travis", type=[REGION_URI], label=["Travis County"])
+        self.call(self.query_manager.put_resource("Travis", USER, body, REGION_URI, rdf_type_name="Region",
+                                                  single_request=True))
+        # The resource is read again after the update
+        self.assertEqual(len(self.queries()), 4)
+        self.get_resource(id="Travis", username="other@isi.edu")
+        self.get_resource()
+        self.assertEqual(len(self.queries()), 5)
+        self.assertEqual(self.query_manager.response_cache.stats()["invalidations"], 2)
+
+    def test_post_and_delete_resource(self):
+        self.get_resource(username=USER)
+        body = Body(id=None, type=None, label=["Austin"])
+        self.call(self.query_manager.post_resource(USER, body, REGION_URI, rdf_type_name="Region"))
+        self.get_resource(username=USER)
+        self.assertEqual(len(self.queries()), 2)
+
+        self.call(self.query_manager.delete_resource("Travis", USER, rdf_type_uri=REGION_URI,
+                                                     rdf_type_name="Region"))
+        self.get_resource(username=USER)
+        self.assertEqual(len(self.queries()), 4)
+
+    def test_disabled(self):
+        self.query_manager = self.query_manager_class(queries_dir=model_catalog_queries,
+                                                      context_dir=model_catalog_context,
+                                                      endpoint=self.endpoint.url,
+                                                      named_graph_base=model_catalog_graph_base,
+                                                      uri_prefix=model_catalog_prefix)
+        self.get_resource(id="Travis", username=USER)
+        self.get_resource(id="Travis", username=USER)
+        self.assertEqual(len(self.queries()), 2)
+        self.assertEqual(len(self.query_manager.response_cache), 0)
+
+
+class TestAsyncQueryManagerResponseCache(TestQueryManagerResponseCache):
+    query_manager_class = AsyncQueryManager
+
+    def call(self, response):
+        return asyncio.run(response)
+
+
+class TestStaleWhileRevalidate(unittest.TestCase):
+    def setUp(self):
+        self.label = "Travis County"
+        # The endpoint answers when released
+        self.released = threading.Event()
+        self.released.set()
+        self.endpoint = SPARQLEndpoint(self.respond).__enter__()
+        self.addCleanup(self.endpoint.__exit__)
+        self.addCleanup(self.released.set)
+        self.clock = Clock()
+
+    def respond(self, request):
+        self.released.wait(10)
+        response = dict(TRAVIS, **{"@graph": [dict(TRAVIS["@graph"][0], label=self.label)]})
+        return 200, "application/ld+json", json.dumps(response).encode()
+
+    def query_manager(self, query_manager_class):
+        query_manager = query_manager_class(queries_dir=model_catalog_queries,
+                                            context_dir=model_catalog_context,
+                                            endpoint=self.endpoint.url,
+                                            named_graph_base=model_catalog_graph_base,
+                                            uri_prefix=model_catalog_prefix,
+                                            response_cache_size=10,
+                                            response_cache_ttl=5,
+                                            response_cache_stale_ttl=10)
+        query_manager.response_cache.clock = self.clock
+        return query_manager
+
+    @staticmethod
+    def get_label(query_manager):
+        return query_manager.get_resource(id="Travis", username=USER, rdf_type_uri=REGION_URI,
+                                          rdf_type_name="Region")["label"]
+
+    def test_stale_while_revalidate(self):
+        query_manager = self.query_manager(QueryManager)
+        self.assertEqual(self.get_label(query_manager), ["Travis County"])
+
+        self.clock.now = 6
+        self.label = "Travis"
+        self.released.clear()
+        # The stale response is returned while the only refresh is blocked
+        for _ in range(3):
+            self.assertEqual(self.get_label(query_manager), ["Travis County"])
+        self.assertEqual(query_manager.response_cache.stats()["refreshes"], 1)
+        self.released.set()
+        deadline = time.monotonic() + 10
+        while self.get_label(query_manager) != ["Travis"]:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        self.assertEqual(len(self.endpoint.requests), 2)
+
+        # Beyond the stale TTL the response is requested again before returning
+        self.clock.now = 30
+        self.label = "Travis (TX)"
+        self.assertEqual(self.get_label(query_manager), ["Travis (TX)"])
+        self.assertEqual(len(self.endpoint.requests), 3)
+
+    def test_async_stale_while_revalidate(self):
+        query_manager = self.query_manager(AsyncQueryManager)
+
+        async def get_label():
+            resource = await query_manager.get_resource(id="Travis", username=USER, rdf_type_uri=REGION_URI,
+                                                        rdf_type_name="Region")
+            return resource["label"]
+
+        async def run():
+            self.assertEqual(await get_label(), ["Travis County"])
+            self.clock.now = 6
+            self.label = "Travis"
+            labels = await asyncio.gather(*[get_label() for _ in range(3)])
+            self.assertEqual(labels, [["Travis County"]] * 3)
+            self.assertEqual(len(query_manager.refresh_tasks), 1)
+            await asyncio.gather(*query_manager.refresh_tasks)
+            self.assertEqual(await get_label(), ["Travis"])
+
+        asyncio.run(run())
+        self.assertEqual(len(self.endpoint.requests), 2)
+        self.assertEqual(query_manager.response_cache.stats()["refreshes"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
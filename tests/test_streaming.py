@@ -0,0 +1,148 @@
+import asyncio
+import json
+import unittest
+
+from obasparql import QueryManager
+from obasparql.async_sparqlconnector import AsyncConnectionPool, AsyncSPARQLConnector
+from obasparql.sparqlconnector import SPARQLConnector
+from obasparql.streaming import JSONLDStreamParser, parse_stream
+from tests.settings import model_catalog_queries, model_catalog_context, model_catalog_endpoint, \
+    model_catalog_graph_base, model_catalog_prefix, path
+from tests.sparql_endpoint import SPARQLEndpoint
+
+MODEL_URI = "https://w3id.org/okn/o/sdm#Model"
+CYCLES = "https://w3id.org/okn/i/mint/CYCLES"
+
+
+def split(data: bytes, size: int):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class TestJSONLDStreamParser(unittest.TestCase):
+    def setUp(self):
+        with open(path / "tests/inputs/input.json", "rb") as reader:
+            self.response = reader.read()
+
+    def test_every_split(self):
+        document = {"@graph": [{"@id": "http://e/a", "label": "Ñandú", "value": -12.5e3, "ok": True},
+                               {"@id": "http://e/b", "label": None, "partOf": ["http://e/a"]}],
+                    "@context": {"label": {"@id": "http://www.w3.org/2000/01/rdf-schema#label"}}}
+        data = json.dumps(document, ensure_ascii=False, indent=1).encode()
+        for position in range(len(data) + 1):
+            with self.subTest(position=position):
+                self.assertEqual(parse_stream([data[:position], data[position:]]), document)
+
+    def test_chunks(self):
+        expected = json.loads(self.response)
+        for size in (1, 7, 4096):
+            self.assertEqual(parse_stream(split(self.response, size)), expected)
+
+    def test_single_node(self):
+        document = {"@id": "http://e/a", "@type": "http://e/A", "@context": {"a": "http://e/a"}}
+        self.assertEqual(parse_stream(split(json.dumps(document).encode(), 3)), document)
+        self.assertEqual(parse_stream([b" {} "]), {})
+        self.assertEqual(parse_stream([b'{"@graph": []}']), {"@graph": []})
+
+    def test_nodes_are_grouped_by_subject(self):
+        data = json.dumps({"@graph": [{"@id": "http://e/a", "label": "a", "type": "A"},
+                                      {"@id": "http://e/b", "label": "b"},
+                                      {"@id": "http://e/a", "label": ["c", "d"], "partOf": "http://e/b"},
+                                      {"label": "blank"}]}).encode()
+        self.assertEqual(parse_stream([data])["@graph"], [
+            {"@id": "http://e/a", "label": ["a", "c", "d"], "type": "A", "partOf": "http://e/b"},
+            {"@id": "http://e/b", "label": "b"},
+            {"label": "blank"}])
+
+    def test_invalid(self):
+        for chunks in ([self.response[:-3]], [b'{"@graph": [1'], [b""], [b'{"a": 1} x'], [b'{"a" 1}'], [b"[]"]):
+            with self.subTest(chunks=chunks):
+                with self.assertRaises(ValueError):
+                    parse_stream(chunks)
+
+    def test_nodes_are_parsed_as_they_arrive(self):
+        parser = JSONLDStreamParser()
+        parser.feed(b'{"@graph": [{"@id": "http://e/a"}, {"@id": "http://e/')
+        self.assertEqual(parser.graph, [{"@id": "http://e/a"}])
+        parser.feed(b'b"}]}')
+        parser.close()
+        self.assertEqual(len(parser.graph), 2)
+
+    def test_large_value_is_decoded_once(self):
+        node = {"@id": "http://e/a", "label": 'a "quoted" \\ label ' * 2000, "partOf": [{"@id": "http://e/b"}]}
+        data = json.dumps({"@context": {"a": "http://e/a"}, "@graph": [node]}).encode()
+        parser = JSONLDStreamParser()
+        decoded = []
+        raw_decode = parser._json.raw_decode
+        parser._json.raw_decode = lambda text, position: decoded.append(position) or raw_decode(text, position)
+        for chunk in split(data, 100):
+            parser.feed(chunk)
+        parser.close()
+        self.assertEqual(parser.document(), json.loads(data))
+        # The node is decoded when it starts and when it is complete, not after every chunk
+        self.assertLess(len(decoded), 10)
+
+
+class TestStreamedFraming(unittest.TestCase):
+    def setUp(self):
+        with open(path / "tests/inputs/input.json", "rb") as reader:
+            self.response = reader.read()
+        self.query_manager = QueryManager(queries_dir=model_catalog_queries,
+                                          context_dir=model_catalog_context,
+                                          endpoint=model_catalog_endpoint,
+                                          named_graph_base=model_catalog_graph_base,
+                                          uri_prefix=model_catalog_prefix)
+
+    def test_frame_stream(self):
+        for resource in (None, CYCLES):
+            with self.subTest(resource=resource):
+                self.assertEqual(self.query_manager.frame_results(split(self.response, 100), MODEL_URI, resource),
+                                 self.query_manager.frame_results(self.response, MODEL_URI, resource))
+
+    def test_repeated_subject(self):
+        # The endpoint can return the triples of a subject in several nodes
+        document = json.loads(self.response)
+        node = next(node for node in document["@graph"] if node["@id"] == CYCLES)
+        keys = [key for key in node if key not in ("@id", "@type")]
+        document["@graph"].append({"@id": CYCLES, **{key: node.pop(key) for key in keys[:len(keys) // 2]}})
+        self.assertEqual(self.query_manager.frame_results(split(json.dumps(document).encode(), 100), MODEL_URI),
+                         self.query_manager.frame_results(self.response, MODEL_URI))
+
+
+class TestStreamedResponse(unittest.TestCase):
+    def setUp(self):
+        self.body = json.dumps({"@graph": [{"@id": f"http://e/{i}"} for i in range(20000)]}).encode()
+        self.endpoint = SPARQLEndpoint(lambda request: (200, "application/ld+json", self.body)).__enter__()
+        self.addCleanup(self.endpoint.__exit__)
+
+    def test_stream(self):
+        sparql = SPARQLConnector(query_endpoint=self.endpoint.url, method="POST", returnFormat="json-ld")
+        for _ in range(3):
+            with sparql.query_stream("CONSTRUCT WHERE { ?s ?p ?o }") as response:
+                chunks = list(response)
+            self.assertGreater(len(chunks), 1)
+            self.assertEqual(b"".join(chunks), self.body)
+        # The connection is reused once the body has been read
+        self.assertEqual(self.endpoint.connections, 1)
+        # Else it is closed
+        sparql.query_stream("CONSTRUCT WHERE { ?s ?p ?o }").close()
+        self.assertEqual(sparql.pool.idle_connections(self.endpoint.url), 0)
+
+    def test_async_stream(self):
+        pool = AsyncConnectionPool(max_concurrency=1)
+        sparql = AsyncSPARQLConnector(query_endpoint=self.endpoint.url, method="POST", returnFormat="json-ld",
+                                      pool=pool)
+
+        async def run():
+            bodies = []
+            for _ in range(3):
+                # The slot of the request is released when the response is closed
+                async with await sparql.query_stream("CONSTRUCT WHERE { ?s ?p ?o }") as response:
+                    bodies.append(b"".join([chunk async for chunk in response]))
+            return bodies
+
+        self.assertEqual(asyncio.run(run()), [self.body] * 3)
+        self.assertEqual(self.endpoint.connections, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()